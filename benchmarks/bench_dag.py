@@ -0,0 +1,52 @@
+"""Benchmark of building the DAG with different numbers of keys.
+
+Usage: python benchmarks/bench_dag.py [n_keys ...]
+
+Each registered node generates one literal key and there is one regex node
+that combines two of them. Every key and a combined key for each of them are
+required, and the time of ``RegexDiGraph.build_directed_graph`` is printed
+as a JSON line.
+"""
+from __future__ import print_function
+import json
+import sys
+import time
+
+from feagen.dag import RegexDiGraph
+
+
+def build_regex_dag(n_keys):
+    dag = RegexDiGraph()
+    for i in range(n_keys):
+        dag.add_node("gen_feature_%d" % i, keys="feature_%d" % i,
+                     attr={'handler': 'h5py'})
+    dag.add_node("gen_divided_by",
+                 keys=r"(?P<dividend>\w+)_divided_by_(?P<divisor>\w+)",
+                 successor_keys=("{dividend}", "{divisor}"),
+                 attr={'handler': 'h5py'})
+    return dag
+
+
+def bench_build_directed_graph(n_keys):
+    dag = build_regex_dag(n_keys)
+    data_keys = ["feature_%d" % i for i in range(n_keys)]
+    data_keys += ["feature_%d_divided_by_feature_%d" % (i, (i + 1) % n_keys)
+                  for i in range(n_keys)]
+    start_time = time.time()
+    dag.build_directed_graph(data_keys)
+    return {
+        'benchmark': 'build_directed_graph',
+        'n_keys': n_keys,
+        'n_data_keys': len(data_keys),
+        'seconds': time.time() - start_time,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    n_keys_list = [int(n_keys) for n_keys in argv] or [100, 1000, 10000]
+    for n_keys in n_keys_list:
+        print(json.dumps(bench_build_directed_graph(n_keys)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Benchmark of building the DAG, generating and bundling synthetic data.
+
+Usage: python benchmarks/bench_generate.py [-h] [-o OUTPUT] [options]
+
+The generators are built by ``synthetic.make_feature_generator_class``, and
+all the keys of the last layer are requested. The benchmarks are:
+
+- ``build_directed_graph`` and ``dag_prune_can_skip`` (with all the data
+  generated, so every fingerprint is checked) with ``--dag-width``,
+- ``generate`` with each handler in ``--handlers``,
+- ``bundle`` of the 'h5py' data, concatenated or not, dense or sparse.
+
+The best time of ``--repeats`` runs of each benchmark is printed (or appended
+to ``OUTPUT``) as a JSON line with its parameters, so the results of two
+versions can be compared by ``benchmarks/compare.py``.
+"""
+from __future__ import print_function
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import networkx as nx
+
+from synthetic import (make_feature_generator, make_feature_generator_class,
+                       get_layer_keys, HANDLER_PATHS, SPARSE_HANDLERS)
+
+
+@contextmanager
+def _quiet():
+    """Hide the progress printed by feagen to stdout."""
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def _best_time(function, n_repeats, setup=None):
+    best = None
+    for _ in range(n_repeats):
+        if setup is not None:
+            setup()
+        with _quiet():
+            start_time = time.time()
+            function()
+            elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _close_stores(generator):
+    for handler in generator._handlers.values():
+        if hasattr(handler, 'hdf_store'):
+            handler.hdf_store.close()
+
+
+def bench_build_directed_graph(args):
+    generator_class = make_feature_generator_class(
+        'memory', depth=args.depth, fan_out=args.fan_out)
+    data_keys = get_layer_keys(args.depth, args.dag_width, args.fan_out)
+    seconds = _best_time(
+        lambda: generator_class._dag.build_directed_graph(
+            data_keys, root_node_key='generate'),
+        args.repeats)
+    return {
+        'benchmark': 'build_directed_graph',
+        'width': args.dag_width,
+        'depth': args.depth,
+        'fan_out': args.fan_out,
+        'seconds': seconds,
+    }
+
+
+def bench_dag_prune_can_skip(args, output_dir):
+    # tiny data, since only the checks of the existing data are timed
+    generator = make_feature_generator(
+        'h5py', output_dir, depth=args.depth, fan_out=args.fan_out,
+        n_rows=1)
+    data_keys = get_layer_keys(args.depth, args.dag_width, args.fan_out)
+    with _quiet():
+        generator.generate(data_keys)
+    involved_dag = generator._dag.build_directed_graph(
+        data_keys, root_node_key='generate')
+    involved_dag.reverse(copy=False)
+    generation_order = nx.topological_sort(involved_dag)[:-1]
+    involved_dag.node['generate']['skipped'] = False
+    generator._compute_fingerprints(involved_dag, generation_order)
+    seconds = _best_time(
+        lambda: generator._dag_prune_can_skip(involved_dag,
+                                              generation_order),
+        args.repeats)
+    return {
+        'benchmark': 'dag_prune_can_skip',
+        'width': args.dag_width,
+        'depth': args.depth,
+        'fan_out': args.fan_out,
+        'n_nodes': len(generation_order),
+        'seconds': seconds,
+    }
+
+
+def bench_generate(args, output_dir, handler, density=None):
+    data_keys = get_layer_keys(args.depth, args.width, args.fan_out)
+    generators = []
+
+    def _setup():
+        for generator in generators:
+            _close_stores(generator)
+        generators[:] = []
+        shutil.rmtree(output_dir)
+        os.mkdir(output_dir)
+        generators.append(make_feature_generator(
+            handler, output_dir, depth=args.depth, fan_out=args.fan_out,
+            n_rows=args.n_rows, n_cols=args.n_cols, density=density))
+
+    seconds = _best_time(lambda: generators[0].generate(data_keys),
+                         args.repeats, _setup)
+    _close_stores(generators[0])
+    return {
+        'benchmark': 'generate',
+        'handler': handler,
+        'sparse': density is not None,
+        'width': args.width,
+        'depth': args.depth,
+        'fan_out': args.fan_out,
+        'n_rows': args.n_rows,
+        'n_cols': args.n_cols,
+        'density': density,
+        'seconds': seconds,
+    }
+
+
+def bench_bundle(args, output_dir, density=None):
+    generator = make_feature_generator(
+        'h5py', output_dir, depth=0, n_rows=args.n_rows, n_cols=args.n_cols,
+        fan_out=args.fan_out, density=density)
+    data_keys = get_layer_keys(0, args.width, args.fan_out)
+    with _quiet():
+        generator.generate(data_keys)
+    bundle_path = os.path.join(output_dir, "bundle.h5")
+
+    def _remove_bundle():
+        if os.path.exists(bundle_path):
+            os.remove(bundle_path)
+
+    results = []
+    for concat in (False, True):
+        structure_config = {'features': {'concat': concat}}
+        if concat and density is not None:
+            structure_config['features']['sparse'] = 'csr'
+        seconds = _best_time(
+            lambda: generator.bundle({'features': data_keys}, bundle_path,
+                                     structure_config=structure_config),
+            args.repeats, _remove_bundle)
+        results.append({
+            'benchmark': 'bundle',
+            'concat': concat,
+            'sparse': density is not None,
+            'n_keys': len(data_keys),
+            'n_rows': args.n_rows,
+            'n_cols': args.n_cols,
+            'density': density,
+            'seconds': seconds,
+            'nbytes': os.path.getsize(bundle_path),
+        })
+    return results
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Benchmark feagen with synthetic generators.")
+    parser.add_argument('-o', '--output', default=None,
+                        help="append the JSON lines to this file instead of "
+                             "printing them")
+    parser.add_argument('--handlers', nargs='+', default=sorted(HANDLER_PATHS),
+                        choices=sorted(HANDLER_PATHS),
+                        help="the handlers to benchmark generate with")
+    parser.add_argument('--width', type=int, default=8,
+                        help="the number of regex matches in each layer")
+    parser.add_argument('--dag-width', type=int, default=1000,
+                        help="the width of the DAG benchmarks")
+    parser.add_argument('--depth', type=int, default=3,
+                        help="the number of layers after the source layer")
+    parser.add_argument('--fan-out', type=int, default=2,
+                        help="the number of upstream keys of each key")
+    parser.add_argument('--n-rows', type=int, default=100000)
+    parser.add_argument('--n-cols', type=int, default=4)
+    parser.add_argument('--density', type=float, default=0.01,
+                        help="the density of the sparse data")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    output_dir = tempfile.mkdtemp(prefix="feagen_bench_")
+    if args.output is None:
+        output_fp = sys.stdout
+    else:
+        output_fp = open(args.output, "a")
+
+    def _bench_in_new_dir(function, *function_args):
+        bench_dir = os.path.join(output_dir, "bench")
+        os.mkdir(bench_dir)
+        try:
+            return function(args, bench_dir, *function_args)
+        finally:
+            shutil.rmtree(bench_dir)
+
+    def _output(result):
+        print(json.dumps(result, sort_keys=True), file=output_fp)
+        output_fp.flush()
+
+    try:
+        _output(bench_build_directed_graph(args))
+        _output(_bench_in_new_dir(bench_dag_prune_can_skip))
+        for handler in args.handlers:
+            _output(_bench_in_new_dir(bench_generate, handler))
+            if handler in SPARSE_HANDLERS:
+                _output(_bench_in_new_dir(bench_generate, handler,
+                                          args.density))
+        for density in (None, args.density):
+            for result in _bench_in_new_dir(bench_bundle, density):
+                _output(result)
+    finally:
+        shutil.rmtree(output_dir)
+        if args.output is not None:
+            output_fp.close()
+
+
+if __name__ == '__main__':
+    main()
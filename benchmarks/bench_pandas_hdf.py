@@ -0,0 +1,84 @@
+"""Benchmark of writing and reading frames with the pandas HDF formats.
+
+Usage: python benchmarks/bench_pandas_hdf.py [n_rows n_cols ...]
+
+For each shape, a frame of random floats is written once with each format by
+``PandasHDFDataHandler`` (the index of the table is created by ``flush``) and
+read back as a whole. The best time of three runs is printed as a JSON line.
+These numbers back ``choose_pandas_hdf_format``.
+"""
+from __future__ import print_function
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from feagen.data_handlers import PandasHDFDataHandler
+
+
+N_REPEATS = 3
+
+
+def _best_time(function):
+    best = None
+    for _ in range(N_REPEATS):
+        start_time = time.time()
+        function()
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_format(df, data_format, index, output_dir):
+    hdf_path = os.path.join(output_dir, "pandas.h5")
+
+    def _write():
+        if os.path.exists(hdf_path):
+            os.remove(hdf_path)
+        handler = PandasHDFDataHandler(hdf_path, format=data_format,
+                                       index=index)
+        handler.write_data({'df': df})
+        handler.flush()
+        handler.hdf_store.close()
+
+    write_seconds = _best_time(_write)
+    with pd.HDFStore(hdf_path) as hdf_store:
+        read_seconds = _best_time(lambda: hdf_store['df'])
+    return {
+        'benchmark': 'pandas_hdf_format',
+        'n_rows': df.shape[0],
+        'n_cols': df.shape[1],
+        'format': data_format,
+        'index': index,
+        'write_seconds': write_seconds,
+        'read_seconds': read_seconds,
+        'nbytes': os.path.getsize(hdf_path),
+    }
+
+
+def main(argv=sys.argv[1:]):
+    shapes = [(int(n_rows), int(n_cols))
+              for n_rows, n_cols in zip(argv[::2], argv[1::2])]
+    if len(shapes) == 0:
+        shapes = [(1000000, 1), (1000000, 2), (1000000, 4), (1000000, 16),
+                  (200000, 64)]
+    output_dir = tempfile.mkdtemp(prefix="feagen_bench_")
+    try:
+        for n_rows, n_cols in shapes:
+            df = pd.DataFrame(np.random.rand(n_rows, n_cols),
+                              columns=["c%d" % i for i in range(n_cols)])
+            for data_format, index in (('fixed', False), ('table', True),
+                                       ('table', False)):
+                print(json.dumps(bench_format(df, data_format, index,
+                                              output_dir)))
+    finally:
+        shutil.rmtree(output_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare two results of the benchmarks to catch the performance regressions.
+
+Usage: python benchmarks/compare.py BASELINE CURRENT [--threshold RATIO]
+
+The results are the JSON lines written by the benchmarks. The results with
+the same parameters are matched, and the ratio of each ``*seconds`` field is
+printed. The exit status is 1 if any of them is slower than the baseline by
+more than the threshold (default: 1.2, i.e., 20% slower).
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import sys
+
+
+def _is_timing(name):
+    return name.endswith('seconds')
+
+
+def load_results(path):
+    """Load the results as a dict from their parameters (as JSON) to the
+    timings.
+
+    The best time is kept if the same benchmark is run several times.
+    """
+    results = {}
+    with open(path) as fp:
+        for line in fp:
+            if line.strip() == "":
+                continue
+            result = json.loads(line)
+            params = json.dumps(
+                {name: value for name, value in result.items()
+                 if not _is_timing(name) and name != 'nbytes'},
+                sort_keys=True)
+            timings = results.setdefault(params, {})
+            for name, value in result.items():
+                if _is_timing(name) and value is not None:
+                    timings[name] = min(timings.get(name, value), value)
+    return results
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Compare two results of the benchmarks.")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help="the largest acceptable ratio of the current "
+                             "time to the baseline time (default: 1.2)")
+    args = parser.parse_args(argv)
+    baseline = load_results(args.baseline)
+    current = load_results(args.current)
+
+    has_regression = False
+    for params in sorted(set(baseline) & set(current)):
+        for name in sorted(set(baseline[params]) & set(current[params])):
+            if baseline[params][name] <= 0:
+                continue
+            ratio = current[params][name] / baseline[params][name]
+            is_regression = ratio > args.threshold
+            has_regression = has_regression or is_regression
+            print("{}{} {}: {:.4g}s -> {:.4g}s ({:.2f}x)".format(
+                "REGRESSION " if is_regression else "",
+                params, name,
+                baseline[params][name], current[params][name], ratio))
+    return 1 if has_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
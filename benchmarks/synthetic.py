@@ -0,0 +1,96 @@
+"""Synthetic feature generators for the benchmarks.
+
+``make_feature_generator_class`` builds a ``FeatureGenerator`` subclass whose
+DAG has ``depth + 1`` layers of regex nodes. The keys of layer ``d`` are
+``l<d>_<i>_<k>`` with ``i < width`` and ``k < fan_out``:
+
+- layer 0 generates random data of ``n_rows`` rows and ``n_cols`` columns
+  (a CSR matrix if ``density`` is given, or a frame for 'pandas_hdf'),
+- the key ``l<d>_<i>_<k>`` of a deeper layer requires the ``fan_out`` keys
+  ``l<d-1>_<i>_0``, ..., ``l<d-1>_<i>_<fan_out - 1>`` and sums them.
+
+So each layer has ``width * fan_out`` keys and every key but the sources has
+``fan_out`` upstream keys.
+"""
+import functools
+import operator
+import os.path
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+
+import feagen as fg
+from feagen.decorators import require, will_generate
+
+
+# the argument of FeatureGenerator and the file name in the output directory
+HANDLER_PATHS = {
+    'h5py': ('h5py_hdf_path', "h5py.h5"),
+    'pandas_hdf': ('pandas_hdf_path', "pandas.h5"),
+    'pickle': ('pickle_dir', "pickle"),
+    'npy': ('npy_dir', "npy"),
+    'memory': None,
+}
+SPARSE_HANDLERS = ('h5py', 'pickle', 'npy', 'memory')
+
+
+def make_data(handler, n_rows, n_cols, density=None, seed=0):
+    random_state = np.random.RandomState(seed)
+    if density is not None:
+        return ss.random(n_rows, n_cols, density=density, format='csr',
+                         random_state=random_state)
+    data = random_state.rand(n_rows, n_cols)
+    if handler == 'pandas_hdf':
+        return pd.DataFrame(data, columns=["c%d" % i for i in range(n_cols)])
+    return data
+
+
+def _make_source_function(handler, n_rows, n_cols, density):
+
+    @will_generate(handler, r"l0_(?P<i>\d+)_(?P<k>\d+)")
+    def gen_source(self, will_generate_key, re_args):
+        # pylint: disable=unused-argument
+        seed = int(re_args['i']) * 1000 + int(re_args['k'])
+        return make_data(handler, n_rows, n_cols, density, seed)
+    return gen_source
+
+
+def _make_layer_function(handler, layer, fan_out):
+
+    @require(tuple("l%d_{i}_%d" % (layer - 1, k) for k in range(fan_out)))
+    @will_generate(handler, r"l%d_(?P<i>\d+)_(?P<k>\d+)" % layer)
+    def gen_layer(self, data, will_generate_key, re_args):
+        # pylint: disable=unused-argument
+        return functools.reduce(operator.add,
+                                (data[key][:] for key in sorted(data)))
+    return gen_layer
+
+
+def make_feature_generator_class(handler='h5py', depth=2, fan_out=2,
+                                 n_rows=10000, n_cols=1, density=None):
+    """Return a ``FeatureGenerator`` subclass with the synthetic DAG."""
+    if density is not None and handler not in SPARSE_HANDLERS:
+        raise ValueError("The handler '{}' doesn't support sparse data."
+                         .format(handler))
+    attrs = {'gen_l0': _make_source_function(handler, n_rows, n_cols,
+                                             density)}
+    for layer in range(1, depth + 1):
+        attrs['gen_l%d' % layer] = _make_layer_function(handler, layer,
+                                                        fan_out)
+    return type('SyntheticFeatureGenerator', (fg.FeatureGenerator,), attrs)
+
+
+def make_feature_generator(handler, output_dir, **kwargs):
+    """Return an instance of ``make_feature_generator_class(handler,
+    **kwargs)`` storing its data in ``output_dir``."""
+    generator_class = make_feature_generator_class(handler, **kwargs)
+    if HANDLER_PATHS[handler] is None:
+        return generator_class()
+    path_arg, filename = HANDLER_PATHS[handler]
+    return generator_class(**{path_arg: os.path.join(output_dir, filename)})
+
+
+def get_layer_keys(layer, width, fan_out):
+    return ["l%d_%d_%d" % (layer, i, k)
+            for i in range(width) for k in range(fan_out)]
@@ -1,12 +1,31 @@
+import itertools
+import json
 import os
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
 from past.builtins import basestring
 
 import numpy as np
 import pandas as pd
 import h5py
+import h5sparse
+import scipy.sparse as ss
 import six
+from six.moves import queue
 from bistiming import IterTimer, SimpleTimer
 
+from .data_handlers import (get_row_chunks, get_data_shape, get_data_dtype,
+                            get_data_nnz, iter_row_blocks, take_rows)
+from .profiler import profile
+
+
+DEFAULT_CONCAT_THREADS = 4
+DEFAULT_LOADER_CHUNK_ROWS = 1024
+BUNDLE_SOURCES_ATTR_NAME = 'feagen_sources'
+# the options of the concatenated data that change the bundled dataset
+BUNDLE_OPTION_NAMES = ('concat', 'sparse', 'dtype', 'row_filter')
+
 
 def get_data_keys_from_structure(structure):
     data_keys = []
@@ -27,13 +46,421 @@ def get_data_keys_from_structure(structure):
     return data_keys
 
 
+def get_row_filter_keys_from_structure_config(structure_config):
+    """Return the keys used by the row filters in the structure config."""
+    row_filter_keys = []
+
+    def _get_row_filter_keys(structure_config):
+        if not isinstance(structure_config, dict):
+            return
+        for filter_key in _get_row_filter_list(
+                structure_config.get('row_filter')):
+            if filter_key.lstrip("~") not in row_filter_keys:
+                row_filter_keys.append(filter_key.lstrip("~"))
+        for _, val in six.viewitems(structure_config):
+            _get_row_filter_keys(val)
+    _get_row_filter_keys(structure_config)
+
+    return row_filter_keys
+
+
+def _get_row_filter_list(row_filter):
+    """Return the keys of the row filter (see
+    ``DataBundlerMixin.get_filtered_rows``) as a list."""
+    if row_filter is None:
+        return []
+    if isinstance(row_filter, basestring):
+        return [row_filter]
+    return row_filter
+
+
+def _get_selected_rows(values, filter_key, negate=False):
+    """Return the sorted indices of the rows selected by the 1-D boolean mask
+    or indices."""
+    if values.dtype == np.bool_:
+        return np.flatnonzero(~values if negate else values)
+    if np.issubdtype(values.dtype, np.integer):
+        if negate:
+            raise ValueError("The row filter {} of indices can't be "
+                             "negated.".format(filter_key))
+        return np.unique(values)
+    raise ValueError("The row filter {} should be boolean or integer, got {}."
+                     .format(filter_key, values.dtype))
+
+
+def to_csr_block(data_block):
+    """Convert a block of rows to a 2-D csr_matrix."""
+    if isinstance(data_block, (pd.DataFrame, pd.Series)):
+        data_block = data_block.values
+    if ss.issparse(data_block):
+        return data_block.tocsr()
+    data_block = np.asarray(data_block)
+    if data_block.ndim == 1:
+        data_block = data_block[:, np.newaxis]
+    return ss.csr_matrix(data_block)
+
+
+def get_n_bundled_rows(data_bundle_hdf_path, dset_name, n_rows, n_cols=None,
+                       dtype=None):
+    """Return the number of rows in the bundle that new rows can follow.
+
+    If the dataset can't be appended (e.g., not resizable, having more rows,
+    different columns or dtype), it is removed and 0 is returned, so it will
+    be bundled from scratch.
+    """
+    with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+        if dset_name not in h5f:
+            return 0
+        n_bundled_rows = _get_appendable_n_rows(h5f[dset_name], n_cols, dtype)
+        if n_bundled_rows is not None and n_bundled_rows <= n_rows:
+            return n_bundled_rows
+        del h5f[dset_name]
+    return 0
+
+
+def _get_appendable_n_rows(item, n_cols=None, dtype=None):
+    """Return the number of rows in the bundled item, or None if new rows
+    can't be appended to it."""
+    if isinstance(item, h5py.Dataset):
+        if _can_append_dense(item, n_cols, dtype):
+            return item.shape[0]
+    elif 'h5sparse_format' in item.attrs:
+        if _can_append_sparse(item, n_cols):
+            return int(item.attrs['h5sparse_shape'][0])
+    elif 'pandas_type' in item.attrs and 'table' in item:
+        # pandas table
+        return item['table'].shape[0]
+    return None
+
+
+def _can_append_dense(dset, n_cols=None, dtype=None):
+    return (dset.maxshape[0] is None
+            and (n_cols is None or dset.shape[1:] == (n_cols,))
+            and (dtype is None or dset.dtype == dtype))
+
+
+def _can_append_sparse(group, n_cols=None):
+    return (group['indptr'].maxshape[0] is None
+            and (n_cols is None or group.attrs['h5sparse_shape'][1] == n_cols))
+
+
+def _get_hard_linked_item(h5f, dset_name):
+    """Return the item in the file, or None if not existing or it is a link
+    to another file."""
+    if dset_name not in h5f or not isinstance(
+            h5f.get(dset_name, getlink=True), h5py.HardLink):
+        return None
+    return h5f[dset_name]
+
+
+def get_bundle_sources(data_bundle_hdf_path, dset_name):
+    """Return the sources stored with the bundled dataset or None."""
+    if not os.path.isfile(data_bundle_hdf_path):
+        return None
+    with h5py.File(data_bundle_hdf_path, 'r') as h5f:
+        item = _get_hard_linked_item(h5f, dset_name)
+        if item is None or BUNDLE_SOURCES_ATTR_NAME not in item.attrs:
+            return None
+        sources = item.attrs[BUNDLE_SOURCES_ATTR_NAME]
+    if isinstance(sources, bytes):
+        sources = sources.decode('utf-8')
+    return json.loads(sources)
+
+
+def set_bundle_sources(data_bundle_hdf_path, dset_name, sources):
+    """Store the sources with the bundled dataset, or remove them if None."""
+    with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+        item = _get_hard_linked_item(h5f, dset_name)
+        if item is None:
+            return
+        if sources is None:
+            if BUNDLE_SOURCES_ATTR_NAME in item.attrs:
+                del item.attrs[BUNDLE_SOURCES_ATTR_NAME]
+        else:
+            # fixed-length bytes can also be read by PyTables
+            item.attrs[BUNDLE_SOURCES_ATTR_NAME] = np.bytes_(
+                json.dumps(sources).encode('utf-8'))
+
+
+def delete_bundle_item(data_bundle_hdf_path, dset_name):
+    with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+        if dset_name in h5f or isinstance(h5f.get(dset_name, getlink=True),
+                                          h5py.ExternalLink):
+            del h5f[dset_name]
+
+
+def remove_unlisted_items(data_bundle_hdf_path, dset_names):
+    """Remove the items that are not in ``dset_names`` from the bundle."""
+
+    def _remove(group, prefix):
+        for name in list(group.keys()):
+            item_name = prefix + "/" + name
+            if item_name in dset_names:
+                continue
+            if (any(dset_name.startswith(item_name + "/")
+                    for dset_name in dset_names)
+                    and isinstance(group.get(name, getlink=True),
+                                   h5py.HardLink)):
+                _remove(group[name], item_name)
+            else:
+                del group[name]
+
+    if not os.path.isfile(data_bundle_hdf_path):
+        return
+    with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+        _remove(h5f, "")
+
+
+def _iter_source_lists(sources):
+    yield sources['sources']
+    # the sources of the row filter are not stored by the older versions
+    yield sources.get('row_filter_sources', [])
+
+
+def _has_same_layout(stored_sources, sources):
+    return (stored_sources['options'] == sources['options']
+            and all([source['key'] for source in stored_source_list]
+                    == [source['key'] for source in source_list]
+                    for stored_source_list, source_list in zip(
+                        _iter_source_lists(stored_sources),
+                        _iter_source_lists(sources))))
+
+
+def has_only_new_rows(stored_sources, sources):
+    """Check whether the data of the bundled dataset (and of its row filter)
+    only have new rows."""
+    if not _has_same_layout(stored_sources, sources):
+        return False
+    for stored_source, source in zip(
+            itertools.chain(*_iter_source_lists(stored_sources)),
+            itertools.chain(*_iter_source_lists(sources))):
+        if (stored_source['fingerprint'] != source['fingerprint']
+                or stored_source['dtype'] != source['dtype']
+                or stored_source['shape'] is None or source['shape'] is None
+                or stored_source['shape'][1:] != source['shape'][1:]
+                or stored_source['shape'][0] > source['shape'][0]):
+            return False
+    return True
+
+
+def get_refresh_keys(stored_sources, sources):
+    """Return the keys whose columns should be rewritten in the bundled dense
+    concatenated dataset, or None if it should be rebuilt."""
+    if (stored_sources is None
+            or not _has_same_layout(stored_sources, sources)
+            or stored_sources.get('row_filter_sources', [])
+            != sources['row_filter_sources']):
+        return None
+    if (sources['options']['dtype'] is None
+            and np.result_type(*[source['dtype']
+                                 for source in stored_sources['sources']])
+            != np.result_type(*[source['dtype']
+                                for source in sources['sources']])):
+        return None
+    refresh_keys = []
+    for stored_source, source in zip(stored_sources['sources'],
+                                     sources['sources']):
+        if stored_source['shape'] != source['shape']:
+            return None
+        if stored_source != source:
+            refresh_keys.append(source['key'])
+    return refresh_keys
+
+
+def _check_filtered_rows(rows, sources, row_filter):
+    """Check that the rows selected by the row filter exist in the data."""
+    if rows is None or len(rows) == 0:
+        return
+    for source in sources['sources']:
+        if source['shape'] is not None and rows[-1] >= source['shape'][0]:
+            raise ValueError(
+                "The row filter {} selects row {}, but {} only has {} rows."
+                .format(row_filter, rows[-1], source['key'],
+                        source['shape'][0]))
+
+
+def _prepare_bundle_item(data_bundle_hdf_path, dset_name, options,
+                         stored_sources, sources, incremental):
+    """Decide how the outdated bundled dataset is filled again.
+
+    Return ``(append, refresh_keys)``: whether the new rows are appended, and
+    the keys whose columns are rewritten (see ``get_refresh_keys``). The
+    dataset is deleted if it is rebuilt, and its sources are cleared until it
+    is complete.
+    """
+    append = (incremental and stored_sources is not None
+              and has_only_new_rows(stored_sources, sources))
+    refresh_keys = None
+    if not append:
+        if options.get('concat', False) and not options.get('sparse'):
+            refresh_keys = get_refresh_keys(stored_sources, sources)
+        if refresh_keys is None:
+            delete_bundle_item(data_bundle_hdf_path, dset_name)
+    set_bundle_sources(data_bundle_hdf_path, dset_name, None)
+    return append, refresh_keys
+
+
+class _FillColumns(object):
+    """The columns in the buffer and the dataset of the filled data.
+
+    ``indices`` are the indices of the filled data, ``buffer_col_starts``
+    maps them to their first columns in the buffer, and ``column_regions``
+    (see ``ConcatWriter``) merge the adjacent ones so that they are written
+    at once.
+    """
+
+    def __init__(self, indices, buffer_col_starts, column_regions,
+                 n_buffer_cols):
+        self.indices = indices
+        self.buffer_col_starts = buffer_col_starts
+        self.column_regions = column_regions
+        self.n_buffer_cols = n_buffer_cols
+
+
+def _get_fill_columns(data_keys, data_shapes, refresh_keys=None):
+    """Return the ``_FillColumns`` of all the data, or only of
+    ``refresh_keys`` if it is given."""
+    col_starts = np.cumsum([0] + [shape[1] for shape in data_shapes])
+    if refresh_keys is None:
+        fill_indices = list(range(len(data_keys)))
+    else:
+        fill_indices = [data_i for data_i, data_key in enumerate(data_keys)
+                        if data_key in refresh_keys]
+    buffer_col_starts = {}
+    column_regions = []
+    n_buffer_cols = 0
+    for data_i in fill_indices:
+        data_n_cols = col_starts[data_i + 1] - col_starts[data_i]
+        buffer_col_starts[data_i] = n_buffer_cols
+        if (len(column_regions) > 0
+                and column_regions[-1][3] == col_starts[data_i]):
+            column_regions[-1][1] += data_n_cols
+            column_regions[-1][3] += data_n_cols
+        else:
+            column_regions.append(
+                [n_buffer_cols, n_buffer_cols + data_n_cols,
+                 col_starts[data_i], col_starts[data_i + 1]])
+        n_buffer_cols += data_n_cols
+    return _FillColumns(fill_indices, buffer_col_starts, column_regions,
+                        n_buffer_cols)
+
+
+def _get_concat_batch_size(buffer_size, row_nbytes, chunk_rows, n_rows):
+    """Return the number of rows in each of the two buffers."""
+    batch_size = buffer_size // 2 // max(row_nbytes, 1)
+    if batch_size == 0:
+        print("Warning! buffer_size not enough to fitted by an "
+              "instance. Trying to use more memory.")
+        batch_size = 1
+    elif batch_size > chunk_rows:
+        # write whole chunks
+        batch_size -= batch_size % chunk_rows
+    return min(batch_size, max(n_rows, 1))
+
+
+def _iter_bundle_row_blocks(n_rows, batch_size, rows, row_start):
+    """Iterate over the blocks of the rows to bundle from the ``row_start``-th
+    bundled row (see ``iter_row_blocks``)."""
+    if rows is None:
+        return iter_row_blocks(n_rows, batch_size, start=row_start)
+    return iter_row_blocks(n_rows, batch_size, rows[row_start:])
+
+
+def _read_dense_block(data, read_lock, read_start, read_end, block_rows):
+    """Read the selected rows of a block as a 2-D array."""
+    if read_lock is None:
+        data_block = data[read_start: read_end]
+    else:
+        with read_lock:
+            data_block = data[read_start: read_end]
+    if isinstance(data_block, (pd.DataFrame, pd.Series)):
+        data_block = data_block.values
+    data_block = take_rows(data_block, block_rows)
+    if ss.issparse(data_block):
+        data_block = data_block.toarray()
+    if data_block.ndim == 1:
+        data_block = data_block[:, np.newaxis]
+    return data_block
+
+
+class ConcatWriter(object):
+    """Write the buffers of rows into a dataset in a dedicated thread.
+
+    A buffer is taken by ``get_buffer``, filled and passed to ``write``. It can
+    be taken again after being written. If ``column_regions`` is given, each
+    ``(buffer_col_start, buffer_col_end, dset_col_start, dset_col_end)`` of
+    it is written to its columns of the dataset, otherwise the whole rows are
+    written.
+    """
+
+    def __init__(self, dset, buffers, column_regions=None):
+        self.dset = dset
+        if (column_regions is not None and len(column_regions) == 1
+                and tuple(column_regions[0][2:]) == (0, dset.shape[1])):
+            column_regions = None
+        self.column_regions = column_regions
+        self._free_buffers = queue.Queue()
+        for data_buffer in buffers:
+            self._free_buffers.put(data_buffer)
+        self._write_queue = queue.Queue()
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._write_queue.get()
+            if item is None:
+                break
+            data_buffer, batch_start, batch_end = item
+            if self._exc_info is None:
+                try:
+                    self._write(data_buffer, batch_start, batch_end)
+                except Exception:  # pylint: disable=broad-except
+                    self._exc_info = sys.exc_info()
+            self._free_buffers.put(data_buffer)
+
+    def _write(self, data_buffer, batch_start, batch_end):
+        n_rows = batch_end - batch_start
+        if self.column_regions is None:
+            self.dset[batch_start: batch_end] = data_buffer[:n_rows]
+            return
+        for (buffer_col_start, buffer_col_end,
+             dset_col_start, dset_col_end) in self.column_regions:
+            self.dset[batch_start: batch_end, dset_col_start: dset_col_end] = \
+                data_buffer[:n_rows, buffer_col_start: buffer_col_end]
+
+    def _raise_error(self):
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+
+    def get_buffer(self):
+        data_buffer = self._free_buffers.get()
+        self._raise_error()
+        return data_buffer
+
+    def write(self, data_buffer, batch_start, batch_end):
+        self._write_queue.put((data_buffer, batch_start, batch_end))
+
+    def stop(self):
+        """Wait for the pending buffers to be written."""
+        if self._thread is not None:
+            self._write_queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        self._raise_error()
+
+
 class DataBundlerMixin(object):
 
-    def fill_concat_data(self, data_bundle_hdf_path, dset_name, data_keys,
-                         buffer_size=int(1e+9)):
+    def _get_concat_shapes(self, data_keys):
         data_shapes = []
         for data_key in data_keys:
-            data_shape = self.get(data_key).shape
+            data_shape = get_data_shape(self.get(data_key))
             if len(data_shape) == 1:
                 data_shape += (1,)
             data_shapes.append(data_shape)
@@ -46,69 +473,574 @@ class DataBundlerMixin(object):
             if data_shape[0] != n_rows:
                 raise ValueError("different number of instances: {} and {}."
                                  .format(data_shapes[0], data_shape))
+        return data_shapes
+
+    def _get_concat_dtype(self, data_list, dtype=None):
+        if dtype is not None:
+            return np.dtype(dtype)
+        return np.result_type(*[get_data_dtype(data) for data in data_list])
+
+    def _get_read_locks(self, data_keys):
+        """Return the lock to read each data with, or None if its handler can
+        be read concurrently. The data of the same handler share a lock."""
+        handler_locks = {}
+        read_locks = []
+        for data_key in data_keys:
+            handler = self.get_handler(data_key)
+            if handler.concurrent_read:
+                read_locks.append(None)
+            else:
+                read_locks.append(handler_locks.setdefault(
+                    id(handler), threading.Lock()))
+        return read_locks
+
+    def fill_concat_data(self, data_bundle_hdf_path, dset_name, data_keys,
+                         buffer_size=int(1e+9), incremental=False,
+                         dtype=None, n_threads=DEFAULT_CONCAT_THREADS,
+                         refresh_keys=None, rows=None):
+        """Concatenate the data horizontally into a dense dataset.
+
+        The rows are filled block by block. The block of each data is read by
+        ``n_threads`` threads into a buffer of whole rows, while a writer
+        thread writes the previous buffer into the row-chunked dataset, so
+        two buffers of at most ``buffer_size`` bytes in total are used. If
+        ``dtype`` is None, it is inferred by ``np.result_type``.
+
+        If ``refresh_keys`` is given, only the columns of these data are
+        rewritten in the existing dataset. If ``rows`` (the sorted indices) is
+        given, only these rows are bundled.
+        """
+        data_shapes = self._get_concat_shapes(data_keys)
+        data_list = [self.get(data_key) for data_key in data_keys]
+        dtype = self._get_concat_dtype(data_list, dtype)
+        n_rows = data_shapes[0][0]
+        n_bundle_rows = n_rows if rows is None else len(rows)
+        n_cols = sum(shape[1] for shape in data_shapes)
+        concat_shape = (n_bundle_rows, n_cols)
+        row_start = 0
+        if incremental:
+            row_start = get_n_bundled_rows(data_bundle_hdf_path, dset_name,
+                                           n_bundle_rows, n_cols, dtype)
+        fill_columns = _get_fill_columns(data_keys, data_shapes, refresh_keys)
+        chunks = get_row_chunks(concat_shape, dtype.itemsize, resizable=True)
+        batch_size = _get_concat_batch_size(
+            buffer_size, dtype.itemsize * fill_columns.n_buffer_cols,
+            chunks[0], n_rows)
+
+        with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+            if row_start > 0 or refresh_keys is not None:
+                dset = h5f[dset_name]
+                dset.resize(n_bundle_rows, axis=0)
+            else:
+                dset = h5f.create_dataset(dset_name, shape=concat_shape,
+                                          dtype=dtype, chunks=chunks,
+                                          maxshape=(None, n_cols))
+            if row_start >= n_bundle_rows or len(fill_columns.indices) == 0:
+                return
+            writer = ConcatWriter(dset, [
+                np.empty((batch_size, fill_columns.n_buffer_cols),
+                         dtype=dtype)
+                for _ in range(2)], fill_columns.column_regions)
+            pool = ThreadPool(max(min(n_threads, len(fill_columns.indices)),
+                                  1))
+            try:
+                self._fill_concat_blocks(
+                    writer, pool, data_list, self._get_read_locks(data_keys),
+                    fill_columns, _iter_bundle_row_blocks(
+                        n_rows, batch_size, rows, row_start),
+                    "Filling {}".format(dset_name), n_bundle_rows, row_start)
+                writer.close()
+            finally:
+                pool.close()
+                pool.join()
+                writer.stop()
+
+    @staticmethod
+    def _fill_concat_blocks(writer, pool, data_list, read_locks, fill_columns,
+                            row_blocks, timer_name, n_bundle_rows, row_start):
+        """Read the blocks of the filled data by the pool into the buffers of
+        the writer."""
+        def _fill_block(args):
+            data_i, data_buffer, read_start, read_end, block_rows = args
+            data_block = _read_dense_block(data_list[data_i],
+                                           read_locks[data_i], read_start,
+                                           read_end, block_rows)
+            buffer_col_start = fill_columns.buffer_col_starts[data_i]
+            data_buffer[:data_block.shape[0],
+                        buffer_col_start: buffer_col_start
+                        + data_block.shape[1]] = data_block
+
+        with IterTimer(timer_name, n_bundle_rows) as timer:
+            for read_start, read_end, block_rows in row_blocks:
+                timer.update(row_start)
+                data_buffer = writer.get_buffer()
+                pool.map(_fill_block,
+                         [(data_i, data_buffer, read_start, read_end,
+                           block_rows)
+                          for data_i in fill_columns.indices])
+                n_block_rows = (read_end - read_start if block_rows is None
+                                else len(block_rows))
+                writer.write(data_buffer, row_start, row_start + n_block_rows)
+                row_start += n_block_rows
+
+    def fill_sparse_concat_data(self, data_bundle_hdf_path, dset_name,
+                                data_keys, buffer_size=int(1e+9),
+                                incremental=False, sparse_format='csr',
+                                rows=None, dtype=None):
+        """Concatenate the sparse and dense data into a sparse dataset.
+
+        The blocks of rows of all the data are stacked horizontally and then
+        appended to an h5sparse dataset, so the memory used is bounded by
+        ``buffer_size`` and the dense data is never densified. If ``rows``
+        (the sorted indices) is given, only these rows are bundled. If
+        ``dtype`` is None, it is inferred by ``np.result_type``.
+        """
+        if sparse_format != 'csr':
+            raise ValueError("only csr is supported for the sparse bundle, "
+                             "got {}".format(sparse_format))
+        data_shapes = self._get_concat_shapes(data_keys)
+        n_rows = data_shapes[0][0]
+        n_bundle_rows = n_rows if rows is None else len(rows)
+        n_cols = sum(shape[1] for shape in data_shapes)
+        row_start = 0
+        if incremental:
+            row_start = get_n_bundled_rows(data_bundle_hdf_path, dset_name,
+                                           n_bundle_rows, n_cols)
+
+        data_list = [self.get(data_key) for data_key in data_keys]
+        dtype = self._get_concat_dtype(data_list, dtype)
+        # the size of a row in the blocks, which are sparse
+        row_nbytes = 0
+        for data, data_shape in zip(data_list, data_shapes):
+            nnz = get_data_nnz(data)
+            if nnz is None:
+                nnz = data_shape[0] * data_shape[1]
+            value_nbytes = get_data_dtype(data).itemsize + 4  # with index
+            row_nbytes += value_nbytes * nnz // max(n_rows, 1)
+        batch_size = buffer_size // max(row_nbytes, 1)
+        if batch_size == 0:
+            print("Warning! buffer_size not enough to fitted by an "
+                  "instance. Trying to use more memory.")
+            batch_size = 1
+
+        with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+            h5f = h5sparse.Group(h5f)
+            if row_start == 0:
+                h5f.create_dataset(
+                    dset_name, data=ss.csr_matrix((0, n_cols), dtype=dtype),
+                    chunks=True, maxshape=(None,))
+            dset = h5f[dset_name]
+            with IterTimer("Filling sparse {}".format(dset_name),
+                           n_bundle_rows) as timer:
+                for read_start, read_end, block_rows in (
+                        _iter_bundle_row_blocks(n_rows, batch_size, rows,
+                                                row_start)):
+                    timer.update(row_start)
+                    block = ss.hstack(
+                        [to_csr_block(take_rows(data[read_start: read_end],
+                                                block_rows))
+                         for data in data_list],
+                        format='csr', dtype=dtype)
+                    dset.append(block)
+                    row_start += block.shape[0]
+
+    def link_concat_data(self, data_bundle_hdf_path, dset_name, data_keys,
+                         dtype=None):
+        """Concatenate the data into a virtual dataset without copying.
+
+        The columns of the HDF5 virtual dataset are mapped to the source
+        datasets. If some data can't be mapped (e.g., not in an HDF5 dataset
+        or sparse), nothing is created and False is returned.
+        """
+        data_shapes = self._get_concat_shapes(data_keys)
+        sources = [self.get_handler(data_key).get_virtual_source(
+            data_key, data_bundle_hdf_path) for data_key in data_keys]
+        if data_shapes[0][0] == 0 or any(source is None
+                                         for source in sources):
+            return False
+        if dtype is None:
+            dtype = np.result_type(*[source.dtype for source in sources])
         n_cols = sum(shape[1] for shape in data_shapes)
-        concat_shape = (n_rows, n_cols)
-
-        h5f = h5py.File(data_bundle_hdf_path)
-        dset = h5f.create_dataset(dset_name, shape=concat_shape,
-                                  dtype=np.float32)
-
-        data_d = 0
-        for data_i, (data_key, data_shape) in enumerate(
-                zip(data_keys, data_shapes)):
-            data = self.get(data_key)
-            if isinstance(data, pd.DataFrame):
-                data = data.values
-            batch_size = buffer_size // (data.dtype.itemsize * data_shape[1])
-            if batch_size == 0:
-                print("Warning! buffer_size not enough to fitted by an "
-                      "instance. Trying to use more memory.")
-                batch_size = 1
-            with IterTimer("({}/{}) Filling {}"
-                           .format(data_i + 1, len(data_keys), data_key),
-                           data_shape[0]) as timer:
-                for batch_start in range(0, data_shape[0], batch_size):
-                    timer.update(batch_start)
-                    batch_end = min(data_shape[0], batch_start + batch_size)
-                    data_buffer = data[batch_start: batch_end]
-                    if isinstance(data_buffer, pd.DataFrame):
-                        data_buffer.values
-                    if len(data_buffer.shape) == 1:
-                        data_buffer = data_buffer[:, np.newaxis]
-                    dset[batch_start: batch_end,
-                         data_d: data_d + data_shape[1]] = data_buffer
-
-            data_d += data_shape[1]
-
-        h5f.close()
+        layout = h5py.VirtualLayout(shape=(data_shapes[0][0], n_cols),
+                                    dtype=dtype)
+        col_start = 0
+        for source, data_shape in zip(sources, data_shapes):
+            layout[:, col_start: col_start + data_shape[1]] = source
+            col_start += data_shape[1]
+        with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+            h5f.create_virtual_dataset(dset_name, layout)
+        return True
+
+    def _bundle_one(self, data_key, data_bundle_hdf_path, dset_name,
+                    incremental=False, rows=None):
+        handler = self.get_handler(data_key)
+        row_start = 0
+        if incremental:
+            row_start = get_n_bundled_rows(
+                data_bundle_hdf_path, dset_name,
+                handler.get_n_rows(data_key) if rows is None else len(rows))
+        handler.bundle(data_key, data_bundle_hdf_path, dset_name,
+                       row_start=row_start, rows=rows)
+
+    def get_filtered_rows(self, row_filter):
+        """Return the sorted indices of the rows selected by the row filter.
+
+        The row filter is a key or a list of keys, whose selected rows are
+        intersected. The data of a key can be a boolean mask, or the indices
+        of the selected rows. A boolean key prefixed with ``~`` selects the
+        rows where it is False.
+        """
+        rows = None
+        for filter_key in _get_row_filter_list(row_filter):
+            negate = filter_key.startswith("~")
+            if negate:
+                filter_key = filter_key[1:]
+            key_rows = _get_selected_rows(
+                self._get_row_filter_values(filter_key), filter_key, negate)
+            rows = (key_rows if rows is None
+                    else np.intersect1d(rows, key_rows, assume_unique=True))
+        return rows.astype(np.int64)
+
+    def _get_row_filter_values(self, filter_key):
+        """Return the data of the row filter key as a 1-D array."""
+        values = self.get(filter_key)[:]
+        if isinstance(values, (pd.DataFrame, pd.Series)):
+            values = values.values
+        values = np.asarray(values)
+        if values.ndim == 2 and values.shape[1] == 1:
+            values = values[:, 0]
+        if values.ndim != 1:
+            raise ValueError("The row filter {} should be 1-D, got shape "
+                             "{}.".format(filter_key, values.shape))
+        return values
+
+    def _get_bundle_source(self, data_key):
+        """Return the fingerprint, shape and dtype of the data, which tell
+        whether its bundled copy is up to date."""
+        data = self.get(data_key)
+        shape = dtype = None
+        if (isinstance(data, h5sparse.Dataset)
+                or getattr(data, 'shape', None) is not None):
+            shape = [int(dim) for dim in get_data_shape(data)]
+        if (isinstance(data, (h5sparse.Dataset, pd.DataFrame))
+                or hasattr(data, 'dtype')):
+            dtype = str(get_data_dtype(data))
+        return {
+            'key': data_key,
+            'fingerprint': self.get_handler(data_key).get_fingerprint(
+                data_key),
+            'shape': shape,
+            'dtype': dtype,
+        }
+
+    def _get_bundle_sources(self, data_keys, options):
+        """Return the sources of the bundled dataset as stored in JSON."""
+        sources = {
+            'options': {name: options.get(name)
+                        for name in BUNDLE_OPTION_NAMES},
+            'sources': [self._get_bundle_source(data_key)
+                        for data_key in data_keys],
+            'row_filter_sources': [
+                self._get_bundle_source(filter_key.lstrip("~"))
+                for filter_key in _get_row_filter_list(
+                    options.get('row_filter'))],
+        }
+        return json.loads(json.dumps(sources))
+
+    def _link_bundle_item(self, data_bundle_hdf_path, dset_name, data_keys,
+                          options, buffer_size):
+        if not options.get('concat', False):
+            self.get_handler(data_keys[0]).link(
+                data_keys[0], data_bundle_hdf_path, dset_name)
+        elif options.get('sparse'):
+            self.fill_sparse_concat_data(
+                data_bundle_hdf_path, dset_name, data_keys, buffer_size,
+                sparse_format=options['sparse'], dtype=options.get('dtype'))
+        elif not self.link_concat_data(data_bundle_hdf_path, dset_name,
+                                       data_keys, options.get('dtype')):
+            self.fill_concat_data(
+                data_bundle_hdf_path, dset_name, data_keys, buffer_size,
+                dtype=options.get('dtype'),
+                n_threads=options.get('n_threads', DEFAULT_CONCAT_THREADS))
+
+    def _fill_bundle_item(self, data_bundle_hdf_path, dset_name, data_keys,
+                          options, buffer_size, append, rows, refresh_keys):
+        if not options.get('concat', False):
+            self._bundle_one(data_keys[0], data_bundle_hdf_path, dset_name,
+                             append, rows)
+        elif options.get('sparse'):
+            self.fill_sparse_concat_data(
+                data_bundle_hdf_path, dset_name, data_keys, buffer_size,
+                append, options['sparse'], rows, options.get('dtype'))
+        else:
+            self.fill_concat_data(
+                data_bundle_hdf_path, dset_name, data_keys, buffer_size,
+                append, options.get('dtype'),
+                options.get('n_threads', DEFAULT_CONCAT_THREADS),
+                refresh_keys=refresh_keys, rows=rows)
 
     def bundle(self, structure, data_bundle_hdf_path, buffer_size=int(1e+9),
-               structure_config=None):
+               structure_config=None, incremental=False, link=False,
+               profiler=None):
+        """Bundle the data into an HDF5 file according to the structure.
+
+        The fingerprint, shape and dtype of the data in each bundled dataset
+        are stored with it, so an existing bundle is refreshed: only the new
+        and changed datasets are bundled again, only the columns of the
+        changed data are rewritten in a dense concatenated dataset, and the
+        datasets not in the structure are removed. (HDF5 doesn't reclaim the
+        space of the removed data, use ``h5repack`` to shrink the file.)
+
+        If ``incremental`` is True, only the rows that are not in the bundle
+        yet are appended to the datasets whose data only have new rows.
+
+        A ``row_filter`` in ``structure_config`` (see ``get_filtered_rows``)
+        applies to all the data under it, and only the selected rows are
+        copied block by block. The data under a row filter is always copied
+        even if ``link`` is True.
+
+        If ``link`` is True, the data is linked instead of copied when the
+        handler supports it: each data becomes an external link (or external
+        storage for the ``.npy`` files), and the dense concatenated data
+        becomes a virtual dataset. Linking is cheap, so the bundle is always
+        rebuilt in this mode.
+
+        If ``profiler`` (``feagen.profiler.Profiler``) is given, the bundling
+        of each dataset is recorded as a span.
+        """
         if structure_config is None:
             structure_config = {}
+        dset_names = set()
+        filtered_rows = {}
 
-        def _bundle_data(structure, structure_config, dset_name=""):
+        def _get_filtered_rows(row_filter):
+            filter_id = json.dumps(row_filter)
+            if filter_id not in filtered_rows:
+                filtered_rows[filter_id] = self.get_filtered_rows(row_filter)
+            return filtered_rows[filter_id]
+
+        def _bundle_dataset(dset_name, data_keys, options):
+            dset_names.add(dset_name)
+            with profile(profiler, dset_name, 'bundle'):
+                _fill_dataset(dset_name, data_keys, options)
+
+        def _fill_dataset(dset_name, data_keys, options):
+            row_filter = options.get('row_filter')
+            if link and not row_filter:
+                self._link_bundle_item(data_bundle_hdf_path, dset_name,
+                                       data_keys, options, buffer_size)
+                return
+            rows = _get_filtered_rows(row_filter) if row_filter else None
+            sources = self._get_bundle_sources(data_keys, options)
+            _check_filtered_rows(rows, sources, row_filter)
+            stored_sources = get_bundle_sources(data_bundle_hdf_path,
+                                                dset_name)
+            if sources == stored_sources:
+                return
+            append, refresh_keys = _prepare_bundle_item(
+                data_bundle_hdf_path, dset_name, options, stored_sources,
+                sources, incremental)
+            self._fill_bundle_item(data_bundle_hdf_path, dset_name,
+                                   data_keys, options, buffer_size, append,
+                                   rows, refresh_keys)
+            set_bundle_sources(data_bundle_hdf_path, dset_name, sources)
+
+        def _bundle_data(structure, structure_config, dset_name="",
+                         row_filter=None):
+            row_filter = structure_config.get('row_filter', row_filter)
             if isinstance(structure, basestring) and dset_name != "":
-                (self.get_handler(structure)
-                 .bundle(structure, data_bundle_hdf_path, dset_name))
+                _bundle_dataset(dset_name, [structure],
+                                {'row_filter': row_filter})
             elif isinstance(structure, list):
                 if structure_config.get('concat', False):
-                    self.fill_concat_data(data_bundle_hdf_path, dset_name,
-                                          structure, buffer_size)
+                    _bundle_dataset(dset_name, structure,
+                                    dict(structure_config,
+                                         row_filter=row_filter))
                 else:
                     for data_key in structure:
-                        (self.get_handler(data_key)
-                         .bundle(data_key, data_bundle_hdf_path,
-                                 dset_name + "/" + data_key))
+                        _bundle_dataset(dset_name + "/" + data_key,
+                                        [data_key],
+                                        {'row_filter': row_filter})
             elif isinstance(structure, dict):
                 for key, val in six.viewitems(structure):
                     _bundle_data(val, structure_config.get(key, {}),
-                                 dset_name + "/" + key)
+                                 dset_name + "/" + key, row_filter)
             else:
                 raise TypeError("The bundle structure only support "
                                 "dict, list and str (except the first layer).")
 
-        if os.path.isfile(data_bundle_hdf_path):
+        if os.path.isfile(data_bundle_hdf_path) and link:
             os.remove(data_bundle_hdf_path)
         with SimpleTimer("Bundling data"):
             _bundle_data(structure, structure_config)
+            remove_unlisted_items(data_bundle_hdf_path, dset_names)
+
+
+def _check_loader_args(batch_size, prefetch, shuffle_buffer_chunks):
+    if batch_size < 1 or prefetch < 1 or shuffle_buffer_chunks < 1:
+        raise ValueError("batch_size, prefetch and shuffle_buffer_chunks "
+                         "should be positive integers.")
+
+
+class BundleLoader(object):
+    """Iterate over the minibatches of the datasets in a data bundle.
+
+    The rows are read by chunks of contiguous rows. With ``shuffle``, the
+    chunks are read in a random order, and the rows of every
+    ``shuffle_buffer_chunks`` chunks are shuffled in memory, so the reads
+    stay sequential while the data can be larger than the memory. The batches
+    are prepared by a background thread, which keeps at most ``prefetch``
+    batches ready.
+
+    Parameters
+    ==========
+    data_bundle_hdf_path: str
+        The path of the data bundle.
+    dset_names: {str, list of str}
+        The dense or h5sparse datasets with the same number of rows. A batch
+        is an array (or a csr_matrix) if it is a str, otherwise a tuple of
+        them in the same order.
+    batch_size: int
+    shuffle: bool
+    chunk_rows: {None, int}
+        The number of rows read at a time. If None, the largest number of
+        rows in an HDF5 chunk of the dense datasets is used, or
+        ``DEFAULT_LOADER_CHUNK_ROWS`` if they are not chunked.
+    shuffle_buffer_chunks: int
+        The number of chunks whose rows are shuffled together.
+    prefetch: int
+        The maximum number of batches prepared in advance.
+    drop_last: bool
+        Drop the last batch if it has less than ``batch_size`` rows.
+    random_state: {None, int, numpy.random.RandomState}
+    """
+
+    def __init__(self, data_bundle_hdf_path, dset_names, batch_size=256,
+                 shuffle=False, chunk_rows=None, shuffle_buffer_chunks=16,
+                 prefetch=2, drop_last=False, random_state=None):
+        _check_loader_args(batch_size, prefetch, shuffle_buffer_chunks)
+        self.data_bundle_hdf_path = data_bundle_hdf_path
+        self._return_tuple = not isinstance(dset_names, basestring)
+        self.dset_names = (list(dset_names) if self._return_tuple
+                           else [dset_names])
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer_chunks = shuffle_buffer_chunks
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        if isinstance(random_state, np.random.RandomState):
+            self.random_state = random_state
+        else:
+            self.random_state = np.random.RandomState(random_state)
+        self.n_rows, dset_chunk_rows = self._inspect_datasets()
+        if chunk_rows is None:
+            chunk_rows = (max(dset_chunk_rows) if len(dset_chunk_rows) > 0
+                          else DEFAULT_LOADER_CHUNK_ROWS)
+        self.chunk_rows = chunk_rows
+
+    def _inspect_datasets(self):
+        """Return the number of rows of the datasets, and the numbers of rows
+        in the HDF5 chunks of the chunked dense datasets."""
+        dset_chunk_rows = []
+        n_rows = None
+        with h5py.File(self.data_bundle_hdf_path, 'r') as h5f:
+            h5f = h5sparse.Group(h5f)
+            for dset_name in self.dset_names:
+                dset = h5f[dset_name]
+                if not isinstance(dset, (h5py.Dataset, h5sparse.Dataset)):
+                    raise NotImplementedError(
+                        "Only the dense and h5sparse datasets are supported, "
+                        "got {} ({}).".format(type(dset), dset_name))
+                dset_n_rows = get_data_shape(dset)[0]
+                if n_rows is None:
+                    n_rows = dset_n_rows
+                elif dset_n_rows != n_rows:
+                    raise ValueError("different number of instances: {} and "
+                                     "{}.".format(n_rows, dset_n_rows))
+                if isinstance(dset, h5py.Dataset) and dset.chunks is not None:
+                    dset_chunk_rows.append(dset.chunks[0])
+        return n_rows, dset_chunk_rows
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_rows // self.batch_size
+        return (self.n_rows + self.batch_size - 1) // self.batch_size
+
+    @staticmethod
+    def _concat_blocks(blocks):
+        if ss.issparse(blocks[0]):
+            return ss.vstack(blocks, format='csr')
+        return np.concatenate(blocks)
+
+    def _iter_batches(self):
+        chunk_starts = np.arange(0, self.n_rows, self.chunk_rows)
+        n_group_chunks = 1
+        if self.shuffle:
+            self.random_state.shuffle(chunk_starts)
+            n_group_chunks = self.shuffle_buffer_chunks
+        remainders = None
+        with h5py.File(self.data_bundle_hdf_path, 'r') as h5f:
+            h5f = h5sparse.Group(h5f)
+            dsets = [h5f[dset_name] for dset_name in self.dset_names]
+            for group_start in range(0, len(chunk_starts), n_group_chunks):
+                group_chunk_starts = chunk_starts[
+                    group_start: group_start + n_group_chunks]
+                buffers = []
+                for dset_i, dset in enumerate(dsets):
+                    blocks = [dset[chunk_start: min(self.n_rows, chunk_start
+                                                    + self.chunk_rows)]
+                              for chunk_start in group_chunk_starts]
+                    if remainders is not None:
+                        blocks.insert(0, remainders[dset_i])
+                    buffers.append(self._concat_blocks(blocks))
+                n_buffer_rows = buffers[0].shape[0]
+                if self.shuffle:
+                    order = self.random_state.permutation(n_buffer_rows)
+                else:
+                    order = np.arange(n_buffer_rows)
+                n_batch_rows = n_buffer_rows - n_buffer_rows % self.batch_size
+                for batch_start in range(0, n_batch_rows, self.batch_size):
+                    batch_rows = order[batch_start:
+                                       batch_start + self.batch_size]
+                    yield tuple(buf[batch_rows] for buf in buffers)
+                remainders = [buf[order[n_batch_rows:]] for buf in buffers]
+        if (remainders is not None and remainders[0].shape[0] > 0
+                and not self.drop_last):
+            yield tuple(remainders)
+
+    def __iter__(self):
+        batch_queue = queue.Queue(maxsize=self.prefetch)
+        stop_event = threading.Event()
+
+        def _put(item):
+            while not stop_event.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _prefetch():
+            try:
+                for batch in self._iter_batches():
+                    if not _put((True, batch)):
+                        return
+                _put((True, None))
+            except Exception:  # pylint: disable=broad-except
+                _put((False, sys.exc_info()))
+
+        thread = threading.Thread(target=_prefetch)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                success, batch = batch_queue.get()
+                if not success:
+                    six.reraise(*batch)
+                if batch is None:
+                    return
+                yield batch if self._return_tuple else batch[0]
+        finally:
+            stop_event.set()
+            thread.join()
@@ -0,0 +1,161 @@
+import json
+import os.path
+import sqlite3
+import time
+
+import six
+from mkdir_p import mkdir_p
+
+
+CATALOG_COLUMNS = ('key', 'handler', 'shape', 'dtype', 'nbytes', 'fingerprint',
+                   'created_at', 'duration')
+HISTORY_COLUMNS = ('func_name', 'pattern', 'n_runs', 'duration', 'nbytes',
+                   'updated_at')
+# the weight of the latest run in the moving averages of the history
+HISTORY_WEIGHT = 0.5
+
+
+class DataCatalog(object):
+    """SQLite catalog of the metadata of the generated data.
+
+    The catalog records the handler, shape, dtype, size, fingerprint, creation
+    time and generation duration of each key, so the generation can be
+    planned without opening the data stores.
+
+    It also keeps the history of the node functions: the moving averages of
+    the duration and the output size per generated key of each function and
+    key pattern, which are kept across runs even if the data is removed.
+
+    The changes are only visible to the other connections after ``commit``,
+    so a batch of changes is written in one transaction.
+
+    Parameters
+    ==========
+    path: str
+        The path of the SQLite file.
+    """
+
+    def __init__(self, path):
+        catalog_dir = os.path.dirname(path)
+        if catalog_dir != '':
+            mkdir_p(catalog_dir)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS data ("
+            "key TEXT PRIMARY KEY, handler TEXT NOT NULL, shape TEXT, "
+            "dtype TEXT, nbytes INTEGER, fingerprint TEXT, created_at REAL, "
+            "duration REAL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            "func_name TEXT NOT NULL, pattern TEXT NOT NULL, n_runs INTEGER, "
+            "duration REAL, nbytes REAL, updated_at REAL, "
+            "PRIMARY KEY (func_name, pattern))")
+        self._conn.commit()
+
+    @staticmethod
+    def _to_record(row):
+        record = dict(zip(CATALOG_COLUMNS, row))
+        if record['shape'] is not None:
+            record['shape'] = tuple(json.loads(record['shape']))
+        return record
+
+    def get(self, key):
+        """Return the record of the key as a dict, or None if not found."""
+        row = self._conn.execute(
+            "SELECT {} FROM data WHERE key = ?".format(
+                ", ".join(CATALOG_COLUMNS)),
+            (key,)).fetchone()
+        if row is None:
+            return None
+        return self._to_record(row)
+
+    def __contains__(self, key):
+        return self._conn.execute("SELECT 1 FROM data WHERE key = ?",
+                                  (key,)).fetchone() is not None
+
+    def put(self, key, handler, shape=None, dtype=None, nbytes=None,
+            fingerprint=None, created_at=None, duration=None):
+        if shape is not None:
+            shape = json.dumps([int(dim) for dim in shape])
+        if dtype is not None:
+            dtype = str(dtype)
+        if created_at is None:
+            created_at = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO data ({}) VALUES ({})".format(
+                ", ".join(CATALOG_COLUMNS),
+                ", ".join("?" * len(CATALOG_COLUMNS))),
+            (key, handler, shape, dtype, nbytes, fingerprint, created_at,
+             duration))
+
+    def delete(self, key):
+        self._conn.execute("DELETE FROM data WHERE key = ?", (key,))
+
+    def delete_handler(self, handler):
+        """Remove all the records of a handler, e.g., when its store is gone."""
+        self._conn.execute("DELETE FROM data WHERE handler = ?", (handler,))
+
+    def delete_removed_stores(self, store_paths):
+        """Remove the records of the handlers whose stores have been removed,
+        since they are stale, and commit.
+
+        Parameters
+        ==========
+        store_paths: dict
+            The handler key -> the path of its store, or None if it is not
+            stored in a path.
+        """
+        for handler, store_path in six.viewitems(store_paths):
+            if store_path is not None and not os.path.exists(store_path):
+                self.delete_handler(handler)
+        self.commit()
+
+    def iter_records(self, handler=None):
+        """Iterate over the records (sorted by key) as dicts."""
+        query = "SELECT {} FROM data".format(", ".join(CATALOG_COLUMNS))
+        args = ()
+        if handler is not None:
+            query += " WHERE handler = ?"
+            args = (handler,)
+        for row in self._conn.execute(query + " ORDER BY key", args):
+            yield self._to_record(row)
+
+    def get_history(self, func_name, pattern=""):
+        """Return the history of the function and the key pattern as a dict,
+        or None if it has never run."""
+        row = self._conn.execute(
+            "SELECT {} FROM history WHERE func_name = ? AND pattern = ?"
+            .format(", ".join(HISTORY_COLUMNS)),
+            (func_name, pattern)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(HISTORY_COLUMNS, row))
+
+    def add_history(self, func_name, pattern="", duration=None, nbytes=None):
+        """Add a run with the duration and the output size per key to the
+        moving averages."""
+        history = self.get_history(func_name, pattern)
+        if history is None:
+            history = {'n_runs': 0, 'duration': None, 'nbytes': None}
+        for name, value in (('duration', duration), ('nbytes', nbytes)):
+            if value is None:
+                continue
+            if history[name] is None:
+                history[name] = value
+            else:
+                history[name] += HISTORY_WEIGHT * (value - history[name])
+        self._conn.execute(
+            "INSERT OR REPLACE INTO history ({}) VALUES ({})".format(
+                ", ".join(HISTORY_COLUMNS),
+                ", ".join("?" * len(HISTORY_COLUMNS))),
+            (func_name, pattern, history['n_runs'] + 1, history['duration'],
+             history['nbytes'], time.time()))
+
+    def commit(self):
+        """Write the changes since the last commit to the file."""
+        self._conn.commit()
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
@@ -0,0 +1,101 @@
+"""Predict the cost of a generation from the history of the node functions.
+
+The catalog keeps the moving averages of the duration and the output size per
+key of each node function and key pattern (see ``DataCatalog.add_history``).
+``DataGenerator.explain`` multiplies them by the numbers of keys that will be
+generated, and finds the critical path, i.e., the chain of dependent nodes
+that takes the longest time, which bounds the time even with many jobs.
+"""
+from __future__ import division
+
+
+def get_history_pattern(node_attr):
+    """Return the key pattern of the node in the history.
+
+    The nodes in 'one' mode are distinguished by the regex key they match, so
+    e.g. all the keys matching ``(?P<a>\\w+)_divided_by_(?P<b>\\w+)`` share
+    the history. The nodes in 'full' mode generate all their keys together.
+    """
+    if node_attr['mode'] == 'one':
+        return node_attr['__regex_key__']
+    return ""
+
+
+def get_critical_path(dag, generation_order):
+    """Return the critical path of the nodes that are not skipped and its
+    estimated duration.
+
+    The nodes with unknown ``estimated_duration`` are regarded as taking no
+    time.
+    """
+    finish_times = {}
+    previous_nodes = {}
+    for node in generation_order:
+        node_attr = dag.node[node]
+        if node_attr['skipped']:
+            continue
+        start_time = 0.
+        previous_nodes[node] = None
+        for upstream_node in dag.predecessors_iter(node):
+            if finish_times.get(upstream_node, -1.) > start_time:
+                start_time = finish_times[upstream_node]
+                previous_nodes[node] = upstream_node
+        finish_times[node] = (start_time
+                              + (node_attr['estimated_duration'] or 0.))
+    if len(finish_times) == 0:
+        return [], 0.
+    node = max(finish_times, key=finish_times.get)
+    duration = finish_times[node]
+    path = []
+    while node is not None:
+        path.append(node)
+        node = previous_nodes[node]
+    return path[::-1], duration
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "?"
+    if seconds < 60:
+        return "{:.1f}s".format(seconds)
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return "{}m{:02d}s".format(minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "{}h{:02d}m".format(hours, minutes)
+
+
+def format_nbytes(nbytes):
+    if nbytes is None:
+        return "?"
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024:
+            return "{:.1f}{}".format(nbytes, unit)
+        nbytes /= 1024
+    return "{:.1f}TB".format(nbytes)
+
+
+def format_explanation(explanation):
+    """Format the result of ``DataGenerator.explain`` as text."""
+    rows = [["node", "function", "handler", "time", "bytes"]]
+    rows.extend([node['name'], node['func_name'], node['handler'],
+                 format_duration(node['duration']),
+                 format_nbytes(node['nbytes'])]
+                for node in explanation['nodes'])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(val.ljust(width) for val, width in zip(row, widths))
+             .rstrip() for row in rows]
+    lines.append("")
+    lines.append("{} nodes to generate, {} skipped.".format(
+        len(explanation['nodes']), explanation['n_skipped']))
+    lines.append("Estimated time: {} ({} on the critical path)".format(
+        format_duration(explanation['duration']),
+        format_duration(explanation['critical_path_duration'])))
+    lines.append("Estimated bytes to write: {}".format(
+        format_nbytes(explanation['nbytes'])))
+    if explanation['n_unknown'] > 0:
+        lines.append("{} nodes have never run, so their cost is unknown and "
+                     "not counted.".format(explanation['n_unknown']))
+    lines.append("Critical path: {}".format(
+        " -> ".join(explanation['critical_path'])))
+    return "\n".join(lines)
@@ -7,6 +7,32 @@ from six.moves import map
 from mkdir_p import mkdir_p
 import networkx as nx
 
+from .cost_model import format_duration, format_nbytes
+
+
+# the characters that make a key be a regular expression rather than a literal
+REGEX_META_PATTERN = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+
+def _parse_float(value):
+    """Parse the attribute of agraph, which is converted to str (and is ""
+    if not set)."""
+    return None if value in (None, "", "None") else float(value)
+
+
+def _get_node_label(node_attr):
+    """Return the label of the node from its agraph attributes."""
+    if node_attr['skipped'] == "True":
+        return node_attr['__name__'] + " (skipped)"
+    label = node_attr['__name__']
+    # estimated by DataGenerator.draw_involved_dag
+    duration = _parse_float(node_attr.get('estimated_duration'))
+    if duration is not None:
+        label += "\n~{} {}".format(
+            format_duration(duration),
+            format_nbytes(_parse_float(node_attr.get('estimated_nbytes'))))
+    return label
+
 
 def draw_dag(nx_dag, path):
     if dirname(path) != '':
@@ -23,11 +49,9 @@ def draw_dag(nx_dag, path):
                     and edge.attr['skipped_keys'] is not None):
                 edge.attr['label'] += "(%s skipped)" % edge.attr['skipped_keys']
     for node in agraph.nodes_iter():
+        node.attr['label'] = _get_node_label(node.attr)
         if node.attr['skipped'] == "True":
-            node.attr['label'] = node.attr['__name__'] + " (skipped)"
             node.attr['fontcolor'] = 'grey'
-        else:
-            node.attr['label'] = node.attr['__name__']
     agraph.layout('dot')
     agraph.draw(path)
 
@@ -47,6 +71,11 @@ class RegexDiGraph(object):
         self._node_attr_dict = {}
         self._node_succesor_dict = {}
         self._node_mode_dict = {}
+        # indices for matching: literal key -> (regex key, compiled pattern),
+        # and the compiled patterns of the other regex keys
+        self._literal_key_dict = {}
+        self._compiled_regex_keys = []
+        self._match_cache = {}
 
     def add_node(self, name, keys=(), re_escape_keys=(), successor_keys=(),
                  attr=None, mode='one'):
@@ -73,14 +102,48 @@ class RegexDiGraph(object):
                 raise ValueError("duplicated data key '{}' for {} and {}"
                                  .format(key, self._key_node_dict[key], name))
             self._key_node_dict[key] = name
+        self._index_regex_keys(name)
         self._node_succesor_dict[name] = tuple(sorted(set(successor_keys)))
         self._node_mode_dict[name] = mode
 
+    def _index_regex_keys(self, name):
+        """Index the regex keys of the node for fast matching.
+
+        The keys without special characters and the escaped keys can only
+        match one string, so they are put into a dict by that string. All the
+        keys are compiled.
+        """
+        regex_keys = self._node_key_dict[name]['keys']
+        re_escape_keys = self._node_key_dict[name]['re_escape_keys']
+        for regex_key in regex_keys:
+            pattern = re.compile(r"(?:%s)\Z" % regex_key)
+            if REGEX_META_PATTERN.search(regex_key) is None:
+                (self._literal_key_dict.setdefault(regex_key, [])
+                 .append((regex_key, pattern)))
+            else:
+                self._compiled_regex_keys.append((regex_key, pattern))
+        for literal_key in re_escape_keys:
+            regex_key = re.escape(literal_key)
+            (self._literal_key_dict.setdefault(literal_key, [])
+             .append((regex_key, re.compile(r"(?:%s)\Z" % regex_key))))
+        self._match_cache = {}
+
     def match_node(self, key):
+        if key not in self._match_cache:
+            self._match_cache[key] = self._match_node(key)
+        return self._match_cache[key]
+
+    def _match_node(self, key):
         found_node = None
-        for regex_key, node in six.viewitems(self._key_node_dict):
-            match_object = re.match("(?:%s)\Z" % regex_key, key)
+        candidates = [
+            (regex_key, pattern.match(key))
+            for regex_key, pattern in self._literal_key_dict.get(key, ())
+        ]
+        candidates.extend((regex_key, pattern.match(key))
+                          for regex_key, pattern in self._compiled_regex_keys)
+        for regex_key, match_object in candidates:
             if match_object is not None:
+                node = self._key_node_dict[regex_key]
                 if found_node is None:
                     found_node = node
                     found_regex_key = regex_key
@@ -127,6 +190,7 @@ class RegexDiGraph(object):
                 attr = self._node_attr_dict[node].copy()
                 attr.setdefault('__name__', node)
                 attr['__re_args__'] = re_args
+                attr['__regex_key__'] = regex_key
                 nx_digraph.add_node(node_key, attr)
                 self._grow_ancestors(nx_digraph, node_key,
                                      self._node_succesor_dict[node], re_args)
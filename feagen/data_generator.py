@@ -1,4 +1,9 @@
+from contextlib import contextmanager
+import functools
+import hashlib
+import heapq
 import inspect
+import time
 from past.builtins import basestring
 
 import six
@@ -7,11 +12,19 @@ from bistiming import SimpleTimer
 
 from .dag import RegexDiGraph, draw_dag
 from .bundling import DataBundlerMixin
+from .catalog import DataCatalog
+from .cost_model import get_critical_path, get_history_pattern
+from .executors import TaskRunner
+from .profiler import diff_resource_usage, get_resource_usage, profile
 from .data_handlers import (
+    DataHandler,
     MemoryDataHandler,
+    BoundedMemoryDataHandler,
     H5pyDataHandler,
     PandasHDFDataHandler,
     PickleDataHandler,
+    NumpyDataHandler,
+    get_data_nbytes,
 )
 
 
@@ -27,16 +40,23 @@ class FeatureGeneratorType(type):
         dag = RegexDiGraph()
         # build the dynamic DAG
         handler_set = set()
+        # the functions that need write_stream of their handlers
+        stream_functions = {}
         for function_name, function in attrs:
             node_attrs = function._feagen_will_generate
             del function.__dict__['_feagen_will_generate']
             handler_set.add(node_attrs['handler'])
             node_attrs['func_name'] = function_name
+            if node_attrs['stream'] or node_attrs['incremental']:
+                stream_functions[function_name] = node_attrs['handler']
             if hasattr(function, '_feagen_require'):
                 node_attrs['require'] = function._feagen_require
+                node_attrs['require_select'] = function._feagen_require_select
                 del function.__dict__['_feagen_require']
+                del function.__dict__['_feagen_require_select']
             else:
                 node_attrs['require'] = ()
+                node_attrs['require_select'] = {}
             if node_attrs['mode'] == 'one':
                 dag.add_node(function_name,
                              keys=node_attrs['keys'],
@@ -54,15 +74,147 @@ class FeatureGeneratorType(type):
 
         cls._dag = dag
         cls._handler_set = handler_set
+        cls._stream_functions = stream_functions
+
+
+# the function kwargs that let the node function write data by itself
+_WRITER_KWARG_SET = frozenset(['create_dataset_functions', 'append_functions'])
 
 
 def _run_function(function, handler_key, will_generate_keys, kwargs):
+    """Run the node function and return the result and the resource usage
+    (see ``diff_resource_usage``)."""
+    start_usage = get_resource_usage()
     with SimpleTimer("Generating {} {} using {}"
                      .format(handler_key, will_generate_keys,
                              function.__name__),
                      end_in_new_line=False):  # pylint: disable=C0330
         result_dict = function(**kwargs)
-    return result_dict
+    return result_dict, diff_resource_usage(start_usage)
+
+
+@contextmanager
+def _hold_lock(handler):
+    """Hold the lock of the handler (see ``DataHandler.lock``) if it has one,
+    so the threads of the thread backend don't access its store at the same
+    time."""
+    if handler.lock is None:
+        yield
+        return
+    with handler.lock:
+        yield
+
+
+def _hash_function_source(function):
+    try:
+        source = inspect.getsource(function)
+    except (IOError, TypeError):
+        # the source is not available, e.g., defined in the interpreter
+        source = six.get_function_code(
+            six.get_method_function(function)).co_code
+    return hashlib.sha1(
+        source if isinstance(source, bytes) else source.encode('utf-8')
+    ).hexdigest()
+
+
+def _get_will_generate_keys(dag, node):
+    if dag.node[node]['mode'] == 'one':
+        return (node,)
+    return node
+
+
+def _get_task_name(dag, nodes):
+    return ", ".join(key for node in nodes
+                     for key in _get_will_generate_keys(dag, node))
+
+
+def _count_waiting_upstreams(dag, nodes):
+    return {
+        node: sum(1 for upstream in dag.predecessors(node)
+                  if not dag.node[upstream]['skipped'])
+        for node in nodes
+    }
+
+
+def _supports_stream(handler):
+    return (six.get_unbound_function(type(handler).write_stream)
+            is not six.get_unbound_function(DataHandler.write_stream))
+
+
+def _check_appended_upstream_nodes(nx_digraph, appended_nodes,
+                                   changed_nodes):
+    """Check that the upstream nodes of the appended nodes will have new
+    rows."""
+    for node in appended_nodes:
+        upstream_nodes = nx_digraph.predecessors(node)
+        if len(upstream_nodes) > 0 and not any(
+                nx_digraph.node[upstream_node]['incremental']
+                or upstream_node in changed_nodes
+                for upstream_node in upstream_nodes):
+            raise ValueError(
+                "The incremental node {} only requires {}, which won't "
+                "have new rows since they are neither incremental nor in "
+                "memory. Make them incremental too.".format(
+                    _get_task_name(nx_digraph, (node,)),
+                    ", ".join(_get_task_name(nx_digraph, (upstream_node,))
+                              for upstream_node in upstream_nodes)))
+
+
+class _ReadyNodeHeap(object):
+    """The ready nodes ordered by their scores (the highest first) and then
+    by their ranks.
+
+    The outdated scores of a node are kept in the heap and skipped when they
+    are popped.
+    """
+
+    def __init__(self, rank, get_score):
+        self._rank = rank
+        self._get_score = get_score
+        self._scores = {}
+        self._heap = []
+        self._popped_nodes = set()
+
+    def push(self, node):
+        self._scores[node] = self._get_score(node)
+        heapq.heappush(self._heap,
+                       (-self._scores[node], self._rank[node], node))
+
+    def update(self, node):
+        """Update the score of the node if it is ready and not popped."""
+        if node in self._scores and node not in self._popped_nodes:
+            self.push(node)
+
+    def pop(self):
+        """Pop the node with the highest score, or return None if no node is
+        ready."""
+        while len(self._heap) > 0:
+            neg_score, _, node = heapq.heappop(self._heap)
+            if (node not in self._popped_nodes
+                    and -neg_score == self._scores[node]):
+                self._popped_nodes.add(node)
+                return node
+        return None
+
+
+def _create_memory_handler(max_bytes=None, spill_dir=None, cache_dir=None):
+    if max_bytes is None:
+        return MemoryDataHandler(cache_dir)
+    return BoundedMemoryDataHandler(int(float(max_bytes)), spill_dir,
+                                    cache_dir)
+
+
+def _create_missing_handlers(handlers, handler_set, handler_constructors):
+    """Create the handlers in ``handler_set`` that are not given in
+    ``handlers`` by ``handler_constructors``."""
+    for handler_key, (path_name, path, constructor) in six.viewitems(
+            handler_constructors):
+        if handler_key not in handler_set or handler_key in handlers:
+            continue
+        if path_name is not None and path is None:
+            raise ValueError("{} should be specified when initiating "
+                             "FeatureGenerator.".format(path_name))
+        handlers[handler_key] = constructor()
 
 
 def _check_result_dict_type(result_dict, function_name):
@@ -74,7 +226,7 @@ def _check_result_dict_type(result_dict, function_name):
 
 class DataGenerator(six.with_metaclass(FeatureGeneratorType, DataBundlerMixin)):
 
-    def __init__(self, handlers):
+    def __init__(self, handlers, catalog=None):
         handler_set = set(six.viewkeys(handlers))
         if handler_set != self._handler_set:
             redundant_handlers_set = handler_set - self._handler_set
@@ -82,7 +234,16 @@ class DataGenerator(six.with_metaclass(FeatureGeneratorType, DataBundlerMixin)):
             raise ValueError('Handler set mismatch. {} redundant and {} lacked.'
                              .format(redundant_handlers_set,
                                      lacked_handlers_set))
+        for function_name, handler_key in six.viewitems(
+                self._stream_functions):
+            if not _supports_stream(handlers[handler_key]):
+                raise ValueError(
+                    "{} doesn't support stream=True or incremental=True "
+                    "used by {}.".format(type(handlers[handler_key]).__name__,
+                                         function_name))
         self._handlers = handlers
+        self._catalog = catalog
+        self._profiler = None
 
     def get_handler(self, key):
         node_attr = self._dag.get_node_attr(key)
@@ -94,10 +255,120 @@ class DataGenerator(six.with_metaclass(FeatureGeneratorType, DataBundlerMixin)):
         data = handler.get(key)
         return data
 
+    def _compute_fingerprints(self, nx_digraph, generation_order):
+        """Compute the fingerprint of each node in the involved DAG.
+
+        The fingerprint is the hash of the source code of the node function,
+        its ``handler_kwargs``, ``re_args`` and the selections of the required
+        data, and the fingerprints of its upstream nodes, so changing a
+        function also changes the fingerprints of all its descendants.
+        """
+        source_hashes = {}
+        for node in generation_order:
+            node_attr = nx_digraph.node[node]
+            func_name = node_attr['func_name']
+            if func_name not in source_hashes:
+                source_hashes[func_name] = _hash_function_source(
+                    getattr(self, func_name))
+            upstream_fingerprints = sorted(
+                (sorted(six.iteritems(edge_attr['template_keys'])),
+                 nx_digraph.node[source]['fingerprint'])
+                for source, _, edge_attr in nx_digraph.in_edges_iter(
+                    node, data=True))
+            require_select = sorted(
+                (template_key, sorted(six.iteritems(select_kwargs)))
+                for template_key, select_kwargs in six.iteritems(
+                    node_attr['require_select']))
+            fingerprint = hashlib.sha1()
+            for part in (source_hashes[func_name],
+                         sorted(six.iteritems(node_attr['handler_kwargs'])),
+                         sorted(six.iteritems(node_attr['__re_args__'])),
+                         require_select,
+                         upstream_fingerprints):
+                fingerprint.update(repr(part).encode('utf-8'))
+            node_attr['fingerprint'] = fingerprint.hexdigest()
+
+    def _is_cataloged(self, handler_key):
+        return (self._catalog is not None
+                and not isinstance(self._handlers[handler_key],
+                                   MemoryDataHandler))
+
+    def _catalog_key(self, handler_key, key, duration=None):
+        """Record the metadata of the data in the catalog."""
+        handler = self._handlers[handler_key]
+        record = handler.get_metadata(key)
+        record.update({
+            'key': key,
+            'handler': handler_key,
+            'fingerprint': handler.get_fingerprint(key),
+            'duration': duration,
+        })
+        self._catalog.put(**record)
+        return record
+
+    def _get_key_record(self, handler_key, key):
+        """Return the catalog record of the data or None if not existing.
+
+        If the data is not in the catalog (e.g., generated before using the
+        catalog), the handler is checked and the data is cataloged. The
+        record is confirmed by the handler if it's cheap, so the record of
+        the removed data is dropped. For the handlers not using the catalog,
+        only ``fingerprint`` is returned.
+        """
+        handler = self._handlers[handler_key]
+        if self._is_cataloged(handler_key):
+            record = self._catalog.get(key)
+            if record is not None and record['handler'] == handler_key:
+                if not handler.is_can_skip_cheap() or handler.can_skip(key):
+                    return record
+                self._catalog.delete(key)
+        if not handler.can_skip(key):
+            return None
+        if self._is_cataloged(handler_key):
+            return self._catalog_key(handler_key, key)
+        return {'fingerprint': handler.get_fingerprint(key)}
+
+    def _is_outdated(self, node_attr, record):
+        return (record is not None and record['fingerprint'] is not None
+                and record['fingerprint'] != node_attr['fingerprint'])
+
+    def _can_skip_key(self, node_attr, key):
+        """Check whether the data exists and is generated by the same code.
+
+        The data without fingerprint (e.g., generated by an older version) is
+        regarded as up to date.
+        """
+        record = self._get_key_record(node_attr['handler'], key)
+        return record is not None and not self._is_outdated(node_attr, record)
+
+    def _get_n_rows(self, handler_key, key):
+        record = self._get_key_record(handler_key, key)
+        if record is not None and record.get('shape') is not None:
+            return record['shape'][0]
+        return self._handlers[handler_key].get_n_rows(key)
+
+    def _commit_catalog(self):
+        if self._catalog is not None:
+            self._catalog.commit()
+
+    def _delete_data(self, handler_key, key):
+        self._handlers[handler_key].delete(key)
+        if self._is_cataloged(handler_key):
+            self._catalog.delete(key)
+
+    def _record_written_data(self, node_attr, keys, duration=None):
+        """Store the fingerprints and update the catalog after writing."""
+        handler = self._handlers[node_attr['handler']]
+        for key in keys:
+            if not handler.can_skip(key):
+                continue
+            handler.set_fingerprint(key, node_attr['fingerprint'])
+            if self._is_cataloged(node_attr['handler']):
+                self._catalog_key(node_attr['handler'], key, duration)
+
     def _dag_prune_can_skip(self, nx_digraph, generation_order):
         for node in reversed(generation_order):
             node_attr = nx_digraph.node[node]
-            handler = self._handlers[node_attr['handler']]
             node_attr['skipped'] = True
             for _, target, edge_attr in nx_digraph.out_edges_iter(node,
                                                                   data=True):
@@ -109,88 +380,689 @@ class DataGenerator(six.with_metaclass(FeatureGeneratorType, DataBundlerMixin)):
                     edge_attr['skipped_keys'] = set()
                     edge_attr['nonskipped_keys'] = set()
                     for required_key in required_keys:
-                        if handler.can_skip(required_key):
+                        if (not node_attr.get('rows_changed', False)
+                                and self._can_skip_key(node_attr,
+                                                       required_key)):
                             edge_attr['skipped_keys'].add(required_key)
                         else:
                             edge_attr['nonskipped_keys'].add(required_key)
                     if len(edge_attr['nonskipped_keys']) > 0:
                         node_attr['skipped'] = False
 
-    def build_involved_dag(self, data_keys):
+    def _set_row_starts(self, nx_digraph, generation_order):
+        """Find the rows to append for the incremental nodes.
+
+        Only the incremental nodes having up-to-date data are appended, so
+        ``row_start`` is the number of existing rows. The new rows come from
+        the 'memory' data required by them, which is generated again, or from
+        the incremental upstream nodes, so the incremental nodes should form
+        a chain from the 'memory' data (or from the nodes reading the new rows
+        by themselves). All the nodes depending on the appended or
+        regenerated data get ``rows_changed``, so they are not skipped even
+        though their fingerprints don't change.
+        """
+        appended_nodes = self._set_appended_row_starts(nx_digraph,
+                                                       generation_order)
+        changed_nodes = self._get_changed_nodes(nx_digraph, generation_order,
+                                                appended_nodes)
+        _check_appended_upstream_nodes(nx_digraph, appended_nodes,
+                                       changed_nodes)
+        for node in changed_nodes:
+            nx_digraph.node[node]['rows_changed'] = True
+
+    def _set_appended_row_starts(self, nx_digraph, generation_order):
+        """Set ``row_start`` of the incremental nodes having up-to-date data
+        and return these nodes."""
+        appended_nodes = []
+        for node in generation_order:
+            node_attr = nx_digraph.node[node]
+            if not node_attr['incremental']:
+                continue
+            keys = _get_will_generate_keys(nx_digraph, node)
+            if not all(self._can_skip_key(node_attr, key) for key in keys):
+                continue
+            n_rows_set = set(self._get_n_rows(node_attr['handler'], key)
+                             for key in keys)
+            if len(n_rows_set) != 1:
+                raise ValueError("The data {} have different numbers of rows "
+                                 "so they can't be appended.".format(keys))
+            node_attr['row_start'] = n_rows_set.pop()
+            appended_nodes.append(node)
+        return appended_nodes
+
+    def _get_changed_nodes(self, nx_digraph, generation_order,
+                           appended_nodes):
+        """Get the appended nodes, the memory data they get the new rows from,
+        and all the nodes depending on them."""
+        changed_nodes = set()
+        stack = list(appended_nodes)
+        while len(stack) > 0:
+            node = stack.pop()
+            if node in changed_nodes:
+                continue
+            changed_nodes.add(node)
+            stack.extend(upstream_node for upstream_node
+                         in nx_digraph.predecessors_iter(node)
+                         if self._get_memory_handler(
+                             nx_digraph, upstream_node) is not None)
+        for node in generation_order:
+            if any(upstream_node in changed_nodes
+                   for upstream_node in nx_digraph.predecessors_iter(node)):
+                changed_nodes.add(node)
+        return changed_nodes
+
+    def build_involved_dag(self, data_keys, incremental=False):
         # get the nodes and edges that will be considered during the generation
         involved_dag = self._dag.build_directed_graph(data_keys,
                                                       root_node_key='generate')
         involved_dag.reverse(copy=False)
         generation_order = nx.topological_sort(involved_dag)[:-1]
         involved_dag.node['generate']['skipped'] = False
+        self._compute_fingerprints(involved_dag, generation_order)
+        if incremental:
+            self._set_row_starts(involved_dag, generation_order)
         self._dag_prune_can_skip(involved_dag, generation_order)
+        # the data checked by the handlers are cataloged
+        self._commit_catalog()
         return involved_dag, generation_order
 
     def draw_involved_dag(self, path, data_keys):
-        involved_dag, _ = self.build_involved_dag(data_keys)
+        involved_dag, generation_order = self.build_involved_dag(data_keys)
+        self._estimate_costs(involved_dag, generation_order)
         draw_dag(involved_dag, path)
 
+    def _get_required_data(self, handler_key, keys, selects):
+        """Get the data of ``keys`` from the handler.
+
+        The keys in ``selects`` are read by ``select`` with their arguments.
+        """
+        handler = self._handlers[handler_key]
+        with profile(self._profiler, handler_key, 'read'), \
+                _hold_lock(handler):
+            data = handler.get([key for key in keys if key not in selects])
+            for key, select_kwargs in six.viewitems(selects):
+                data[key] = handler.select(key, **select_kwargs)
+        return data
+
+    @staticmethod
+    def _get_edge_selects(dag, node, edge_attr):
+        """Map the required keys on the edge to their select arguments."""
+        require_select = dag.node[node]['require_select']
+        return {key: require_select[template_key]
+                for template_key, key in six.viewitems(
+                    edge_attr['template_keys'])
+                if template_key in require_select}
+
     def _get_upstream_data(self, dag, node):
         data = {}
         for source, _, edge_attr in dag.in_edges_iter(node, data=True):
-            source_attr = dag.node[source]
-            source_handler = self._handlers[source_attr['handler']]
-            formatted_key_data = source_handler.get(edge_attr['keys'])
+            formatted_key_data = self._get_required_data(
+                dag.node[source]['handler'], edge_attr['keys'],
+                self._get_edge_selects(dag, node, edge_attr))
             # change the key to template
             data.update({template_key: formatted_key_data[key]
                          for template_key, key in six.viewitems(
                              edge_attr['template_keys'])})
         return data
 
-    def _generate_one(self, dag, node, func_name, handler_key, handler_kwargs,
-                      re_args, mode):
+    def _remove_outdated_data(self, node_attr, keys):
+        # the data having the old rows is generated again unless appended
+        regenerate = (node_attr.get('rows_changed', False)
+                      and 'row_start' not in node_attr)
+        with _hold_lock(self._handlers[node_attr['handler']]):
+            for key in keys:
+                record = self._get_key_record(node_attr['handler'], key)
+                if (self._is_outdated(node_attr, record)
+                        or (regenerate and record is not None)):
+                    self._delete_data(node_attr['handler'], key)
+
+    def _prepare_generation(self, dag, node):
+        node_attr = dag.node[node]
+        mode = node_attr['mode']
         if mode == 'one':
             will_generate_keys = (node,)
         elif mode == 'full':
             will_generate_keys = node
         else:
             raise ValueError("Mode '%s' is not supported." % mode)
-        handler = self._handlers[handler_key]
+        handler = self._handlers[node_attr['handler']]
+        self._remove_outdated_data(node_attr, will_generate_keys)
         data = self._get_upstream_data(dag, node)
         function_kwargs = handler.get_function_kwargs(
             will_generate_keys=will_generate_keys,
             data=data,
-            **handler_kwargs
+            **node_attr['handler_kwargs']
         )
         if mode == 'one':
             function_kwargs['will_generate_key'] = node
-        if len(re_args) > 0:
-            function_kwargs['re_args'] = re_args
-        function = getattr(self, func_name)
-        result_dict = _run_function(function, handler_key, node,
-                                    function_kwargs)
+        if len(node_attr['__re_args__']) > 0:
+            function_kwargs['re_args'] = node_attr['__re_args__']
+        if node_attr['incremental']:
+            function_kwargs['row_start'] = node_attr.get('row_start', 0)
+        return {
+            'function': getattr(self, node_attr['func_name']),
+            'handler_key': node_attr['handler'],
+            'will_generate_keys': node,
+            'kwargs': function_kwargs,
+        }
+
+    def _write_result(self, dag, node, result_dict, duration=None):
+        node_attr = dag.node[node]
+        will_generate_keys = _get_will_generate_keys(dag, node)
+        task_name = _get_task_name(dag, (node,))
+        if node_attr['stream']:
+            with profile(self._profiler, task_name, 'write'):
+                self._write_stream(node, node_attr, will_generate_keys,
+                                   result_dict)
+        elif node_attr['incremental']:
+            # write the data as a stream with only one block, so the data can
+            # be appended later
+            with profile(self._profiler, task_name, 'write'):
+                self._write_stream(node, node_attr, will_generate_keys,
+                                   [result_dict])
+        else:
+            self._write_result_dict(node, node_attr, will_generate_keys,
+                                    result_dict, task_name)
+        with profile(self._profiler, task_name, 'write'):
+            self._record_written_data(node_attr, will_generate_keys,
+                                      duration)
+
+    def _prepare_batch_generation(self, dag, nodes):
+        """Prepare to generate the keys of a batched node in one call.
 
+        The node function gets all the keys, the ``re_args`` of each key, and
+        the upstream data of all the keys, where the upstream data are indexed
+        by the actual keys, so each of them is fetched only once.
+        """
+        node_attr = dag.node[nodes[0]]
+        handler = self._handlers[node_attr['handler']]
+        for node in nodes:
+            self._remove_outdated_data(dag.node[node], (node,))
+        upstream_keys = {}
+        upstream_selects = {}
+        for node in nodes:
+            for source, _, edge_attr in dag.in_edges_iter(node, data=True):
+                handler_key = dag.node[source]['handler']
+                upstream_keys.setdefault(handler_key, set()).update(
+                    edge_attr['keys'])
+                upstream_selects.setdefault(handler_key, {}).update(
+                    self._get_edge_selects(dag, node, edge_attr))
+        data = {}
+        for handler_key, keys in six.viewitems(upstream_keys):
+            data.update(self._get_required_data(
+                handler_key, keys, upstream_selects[handler_key]))
+        function_kwargs = handler.get_function_kwargs(
+            will_generate_keys=nodes,
+            data=data,
+            **node_attr['handler_kwargs']
+        )
+        function_kwargs['will_generate_keys'] = list(nodes)
+        function_kwargs['re_args'] = {node: dag.node[node]['__re_args__']
+                                      for node in nodes}
+        return {
+            'function': getattr(self, node_attr['func_name']),
+            'handler_key': node_attr['handler'],
+            'will_generate_keys': nodes,
+            'kwargs': function_kwargs,
+        }
+
+    def _write_batch_result(self, dag, nodes, result_dict, duration=None):
+        node_attr = dag.node[nodes[0]]
+        handler = self._handlers[node_attr['handler']]
+        task_name = _get_task_name(dag, nodes)
+        if result_dict is None:
+            result_dict = {}
+        with profile(self._profiler, task_name, 'validate'):
+            _check_result_dict_type(result_dict, node_attr['func_name'])
+            handler.check_result_dict_keys(result_dict, nodes,
+                                           node_attr['func_name'],
+                                           node_attr['handler'],
+                                           **node_attr['handler_kwargs'])
+        with profile(self._profiler, task_name, 'write'):
+            handler.write_data(result_dict, **node_attr['handler_kwargs'])
+            for node in nodes:
+                self._record_written_data(dag.node[node], (node,), duration)
+
+    def _prepare_task(self, dag, nodes):
+        with profile(self._profiler, _get_task_name(dag, nodes), 'fetch'):
+            if dag.node[nodes[0]]['batch']:
+                return self._prepare_batch_generation(dag, nodes)
+            return self._prepare_generation(dag, nodes[0])
+
+    def _write_task_result(self, dag, nodes, result):
+        """Write the result of ``_run_function``."""
+        result_dict, usage = result
+        duration = usage['wall']
+        if self._profiler is not None:
+            self._profiler.add_span(_get_task_name(dag, nodes), 'compute',
+                                    usage)
+        write_start_time = time.time()
+        with _hold_lock(self._handlers[dag.node[nodes[0]]['handler']]):
+            if dag.node[nodes[0]]['batch']:
+                self._write_batch_result(dag, nodes, result_dict, duration)
+            else:
+                self._write_result(dag, nodes[0], result_dict, duration)
+        # the streams are computed while being written
+        self._record_history(dag, nodes,
+                             duration + time.time() - write_start_time)
+        self._commit_catalog()
+
+    def _record_history(self, dag, nodes, duration):
+        """Add the duration and the output size per key of the run to the
+        history in the catalog."""
+        if self._catalog is None:
+            return
+        node_attr = dag.node[nodes[0]]
+        handler_key = node_attr['handler']
+        keys = [key for node in nodes
+                for key in _get_will_generate_keys(dag, node)]
+        nbytes = 0
+        for key in keys:
+            if self._is_cataloged(handler_key):
+                record = self._catalog.get(key)
+            else:
+                record = self._handlers[handler_key].get_metadata(key)
+            if record is None or record['nbytes'] is None:
+                nbytes = None
+                break
+            nbytes += record['nbytes']
+        self._catalog.add_history(
+            node_attr['func_name'], get_history_pattern(node_attr),
+            duration / len(keys), None if nbytes is None else nbytes / len(keys))
+
+    def _estimate_costs(self, dag, generation_order):
+        """Set ``estimated_duration`` and ``estimated_nbytes`` of the nodes
+        that will run according to the history, or None if unknown."""
+        for node in generation_order:
+            node_attr = dag.node[node]
+            node_attr['estimated_duration'] = None
+            node_attr['estimated_nbytes'] = None
+            if node_attr['skipped'] or self._catalog is None:
+                continue
+            history = self._catalog.get_history(
+                node_attr['func_name'], get_history_pattern(node_attr))
+            if history is None:
+                continue
+            n_keys = len(_get_will_generate_keys(dag, node))
+            for name in ('duration', 'nbytes'):
+                if history[name] is not None:
+                    node_attr['estimated_' + name] = history[name] * n_keys
+
+    def explain(self, data_keys, incremental=False):
+        """Predict the generation of the data without running it.
+
+        The cost of each node is estimated from the history in the catalog,
+        so ``catalog_path`` should be set, or the costs are all unknown.
+
+        Returns
+        =======
+        explanation: dict
+            ``nodes`` (the nodes to generate in order, each with ``name``,
+            ``func_name``, ``handler``, the estimated ``duration`` and
+            ``nbytes``), ``n_skipped``, ``n_unknown`` (the number of nodes
+            without history), the total ``duration`` and ``nbytes``, and
+            ``critical_path`` with its ``critical_path_duration``. See
+            ``feagen.cost_model.format_explanation``.
+        """
+        involved_dag, generation_order = self.build_involved_dag(
+            data_keys, incremental)
+        self._estimate_costs(involved_dag, generation_order)
+        nodes = []
+        for node in generation_order:
+            node_attr = involved_dag.node[node]
+            if node_attr['skipped']:
+                continue
+            nodes.append({
+                'name': _get_task_name(involved_dag, (node,)),
+                'func_name': node_attr['func_name'],
+                'handler': node_attr['handler'],
+                'duration': node_attr['estimated_duration'],
+                'nbytes': node_attr['estimated_nbytes'],
+            })
+        critical_path, critical_path_duration = get_critical_path(
+            involved_dag, generation_order)
+        return {
+            'nodes': nodes,
+            'n_skipped': len(generation_order) - len(nodes),
+            'n_unknown': sum(node['duration'] is None for node in nodes),
+            'duration': sum(node['duration'] or 0. for node in nodes),
+            'nbytes': sum(node['nbytes'] or 0 for node in nodes),
+            'critical_path': [_get_task_name(involved_dag, (node,))
+                              for node in critical_path],
+            'critical_path_duration': critical_path_duration,
+        }
+
+    def _write_result_dict(self, node, node_attr, will_generate_keys,
+                           result_dict, task_name):
+        handler = self._handlers[node_attr['handler']]
         if result_dict is None:
             result_dict = {}
-        elif mode == 'one':
+        elif node_attr['mode'] == 'one':
             result_dict = {node: result_dict}
-        _check_result_dict_type(result_dict, func_name)
-        handler.check_result_dict_keys(result_dict, will_generate_keys,
-                                       func_name, handler_key,
-                                       **handler_kwargs)
-        handler.write_data(result_dict)
+        with profile(self._profiler, task_name, 'validate'):
+            _check_result_dict_type(result_dict, node_attr['func_name'])
+            handler.check_result_dict_keys(result_dict, will_generate_keys,
+                                           node_attr['func_name'],
+                                           node_attr['handler'],
+                                           **node_attr['handler_kwargs'])
+        with profile(self._profiler, task_name, 'write'):
+            handler.write_data(result_dict, **node_attr['handler_kwargs'])
+
+    def _write_stream(self, node, node_attr, will_generate_keys, blocks):
+        func_name = node_attr['func_name']
+        if blocks is None:
+            raise ValueError("the method {} with stream=True should yield "
+                             "blocks of rows".format(func_name))
+        handler = self._handlers[node_attr['handler']]
+        append = 'row_start' in node_attr
+
+        def _check_blocks():
+            n_blocks = 0
+            for result_dict in blocks:
+                if node_attr['mode'] == 'one':
+                    result_dict = {node: result_dict}
+                _check_result_dict_type(result_dict, func_name)
+                handler.check_result_dict_keys(result_dict, will_generate_keys,
+                                               func_name, node_attr['handler'],
+                                               **node_attr['handler_kwargs'])
+                n_blocks += 1
+                yield result_dict
+            # appending no rows is fine, but the data should be created
+            if n_blocks == 0 and not append:
+                raise ValueError("the method {} with stream=True yielded no "
+                                 "blocks, so {} is not created"
+                                 .format(func_name, will_generate_keys))
+
+        handler.write_stream(_check_blocks(), append=append,
+                             **node_attr['handler_kwargs'])
+
+    def _generate_serial(self, dag, generation_order, consumer_counts=None):
+        """Run the nodes one by one in ``generation_order``.
+
+        The batched nodes of the same function that are ready are run
+        together when the first of them is reached.
+        """
+        batch_groups = {}
+        for node in generation_order:
+            if dag.node[node]['batch']:
+                (batch_groups.setdefault(dag.node[node]['func_name'], [])
+                 .append(node))
+        done_nodes = set()
+        for node in generation_order:
+            if node in done_nodes:
+                continue
+            nodes = (node,)
+            if dag.node[node]['batch']:
+                nodes = tuple(
+                    batch_node
+                    for batch_node in batch_groups[dag.node[node]['func_name']]
+                    if batch_node not in done_nodes and all(
+                        upstream in done_nodes or dag.node[upstream]['skipped']
+                        for upstream in dag.predecessors(batch_node)))
+            result = _run_function(**self._prepare_task(dag, nodes))
+            self._write_task_result(dag, nodes, result)
+            done_nodes.update(nodes)
+            if consumer_counts is not None:
+                for done_node in nodes:
+                    self._release_memory(dag, done_node, consumer_counts)
+
+    def _get_memory_handler(self, dag, node):
+        handler = self._handlers[dag.node[node]['handler']]
+        if isinstance(handler, MemoryDataHandler):
+            return handler
+        return None
+
+    def _iter_required_memory_keys(self, dag, node):
+        for source, _, edge_attr in dag.in_edges_iter(node, data=True):
+            handler = self._get_memory_handler(dag, source)
+            if handler is None:
+                continue
+            for key in edge_attr['keys']:
+                yield handler, key
+
+    def _count_memory_consumers(self, dag):
+        """Count the nonskipped nodes that require each in-memory key."""
+        consumer_counts = {}
+        for source, target, edge_attr in dag.edges_iter(data=True):
+            if (dag.node[target]['skipped']
+                    or self._get_memory_handler(dag, source) is None):
+                continue
+            for key in edge_attr['keys']:
+                consumer_counts[key] = consumer_counts.get(key, 0) + 1
+        return consumer_counts
+
+    def _release_memory(self, dag, node, consumer_counts):
+        """Release the in-memory keys that no other node requires."""
+        for handler, key in self._iter_required_memory_keys(dag, node):
+            consumer_counts[key] -= 1
+            if consumer_counts[key] == 0:
+                handler.release(key)
+        # the generated keys that no node requires
+        handler = self._get_memory_handler(dag, node)
+        if handler is not None:
+            for key in _get_will_generate_keys(dag, node):
+                if consumer_counts.get(key, 0) == 0:
+                    handler.release(key)
+
+    def _estimate_memory_nbytes(self, dag, generation_order, keys):
+        """Estimate the size of each of the in-memory ``keys``.
+
+        The size of the data already in memory is measured, and the size of
+        the data to generate is estimated from the history. The unknown sizes
+        are regarded as the mean of the known ones.
+        """
+        self._estimate_costs(dag, generation_order)
+        key_nbytes = {}
+        for node in generation_order:
+            handler = self._get_memory_handler(dag, node)
+            if handler is None:
+                continue
+            node_attr = dag.node[node]
+            will_generate_keys = _get_will_generate_keys(dag, node)
+            for key in will_generate_keys:
+                if key not in keys:
+                    continue
+                if key in handler.data:
+                    key_nbytes[key] = get_data_nbytes(handler.data[key])
+                elif node_attr['estimated_nbytes'] is not None:
+                    key_nbytes[key] = (float(node_attr['estimated_nbytes'])
+                                       / len(will_generate_keys))
+        default_nbytes = 1.
+        if len(key_nbytes) > 0:
+            default_nbytes = sum(six.itervalues(key_nbytes)) / len(key_nbytes)
+        return {key: key_nbytes.get(key, default_nbytes) for key in keys}
+
+    def _get_memory_aware_order(self, dag, generation_order):
+        """Reorder the nonskipped nodes to lower the peak memory usage.
+
+        It greedily picks the ready node that releases the most bytes of
+        in-memory data and holds the fewest new ones, so the in-memory data
+        is consumed as soon as possible instead of being piled up. The ties
+        are broken by ``generation_order``. The ready nodes are kept in a
+        heap, and only the scores of the nodes that become the last consumer
+        of some data are updated after each pick.
+        """
+        nodes = [node for node in generation_order
+                 if not dag.node[node]['skipped']]
+        key_consumers = self._get_memory_key_consumers(dag, nodes)
+        if len(key_consumers) == 0:
+            # no in-memory data to release
+            return nodes
+        consumer_counts = {key: len(consumers)
+                           for key, consumers in six.viewitems(key_consumers)}
+        key_nbytes = self._estimate_memory_nbytes(dag, generation_order,
+                                                  consumer_counts)
+        n_waiting_upstreams = _count_waiting_upstreams(dag, nodes)
+        ready_nodes = _ReadyNodeHeap(
+            {node: i for i, node in enumerate(nodes)},
+            lambda node: self._get_released_nbytes(dag, node, key_nbytes,
+                                                   consumer_counts))
+        for node in nodes:
+            if n_waiting_upstreams[node] == 0:
+                ready_nodes.push(node)
+        order = []
+        node = ready_nodes.pop()
+        while node is not None:
+            order.append(node)
+            self._update_ready_nodes(dag, node, ready_nodes, key_consumers,
+                                     consumer_counts, n_waiting_upstreams)
+            node = ready_nodes.pop()
+        return order
+
+    def _get_memory_key_consumers(self, dag, nodes):
+        """Return the in-memory keys -> the nodes requiring them."""
+        key_consumers = {}
+        for node in nodes:
+            for _, key in self._iter_required_memory_keys(dag, node):
+                key_consumers.setdefault(key, []).append(node)
+        return key_consumers
+
+    def _get_released_nbytes(self, dag, node, key_nbytes, consumer_counts):
+        """Return the bytes of the in-memory data released by the node minus
+        the ones held by its results."""
+        released_nbytes = sum(
+            key_nbytes[key]
+            for _, key in self._iter_required_memory_keys(dag, node)
+            if consumer_counts[key] == 1)
+        held_nbytes = 0.
+        if self._get_memory_handler(dag, node) is not None:
+            held_nbytes = sum(key_nbytes[key]
+                              for key in _get_will_generate_keys(dag, node)
+                              if consumer_counts.get(key, 0) > 0)
+        return released_nbytes - held_nbytes
 
-    def generate(self, data_keys, dag_output_path=None):
+    def _update_ready_nodes(self, dag, node, ready_nodes, key_consumers,
+                            consumer_counts, n_waiting_upstreams):
+        """Update the ready nodes after the node is picked.
+
+        The scores of the nodes that become the last consumers of some data
+        are updated, and the downstream nodes whose upstream nodes are all
+        picked become ready.
+        """
+        for _, key in self._iter_required_memory_keys(dag, node):
+            consumer_counts[key] -= 1
+            if consumer_counts[key] != 1:
+                continue
+            # the last consumer of the key will release it
+            for consumer in key_consumers[key]:
+                ready_nodes.update(consumer)
+        for downstream in dag.successors_iter(node):
+            if downstream not in n_waiting_upstreams:
+                continue
+            n_waiting_upstreams[downstream] -= 1
+            if n_waiting_upstreams[downstream] == 0:
+                ready_nodes.push(downstream)
+
+    def _generate_parallel(self, dag, generation_order, n_jobs, backend,
+                           consumer_counts=None):
+        """Run every node as soon as all of its upstream nodes are written.
+
+        The node functions are run by the backend while the results are
+        written in this thread only, so the handlers always have one writer.
+        The stores that can't be accessed by several threads (see
+        ``DataHandler.lock``) are only read and written with their locks.
+        Nodes that write data by themselves (e.g., using
+        ``create_dataset_functions``) and the nodes with ``stream=True`` are
+        also run in this thread. If more nodes are ready than ``n_jobs``, the
+        one earlier in ``generation_order`` is run first. The ready batched
+        nodes of the same function are run in one task.
+        """
+        rank = {node: i for i, node in enumerate(generation_order)}
+        n_waiting_upstreams = _count_waiting_upstreams(dag, generation_order)
+        ready_nodes = [(rank[node], node) for node in generation_order
+                       if n_waiting_upstreams[node] == 0]
+        heapq.heapify(ready_nodes)
+        runner = TaskRunner(n_jobs, backend)
+
+        def _finish(nodes, result):
+            self._write_task_result(dag, nodes, result)
+            for node in nodes:
+                if consumer_counts is not None:
+                    self._release_memory(dag, node, consumer_counts)
+                for downstream in dag.successors(node):
+                    if downstream not in n_waiting_upstreams:
+                        continue
+                    n_waiting_upstreams[downstream] -= 1
+                    if n_waiting_upstreams[downstream] == 0:
+                        heapq.heappush(ready_nodes,
+                                       (rank[downstream], downstream))
+
+        while len(ready_nodes) > 0 or runner.n_running > 0:
+            while len(ready_nodes) > 0 and not runner.is_full():
+                _, node = heapq.heappop(ready_nodes)
+                nodes = (node,)
+                if dag.node[node]['batch']:
+                    func_name = dag.node[node]['func_name']
+                    nodes += tuple(
+                        ready_node for _, ready_node in sorted(ready_nodes)
+                        if dag.node[ready_node]['batch']
+                        and dag.node[ready_node]['func_name'] == func_name)
+                    ready_nodes[:] = [item for item in ready_nodes
+                                      if item[1] not in nodes]
+                    heapq.heapify(ready_nodes)
+                run_kwargs = self._prepare_task(dag, nodes)
+                if (dag.node[node]['stream']
+                        or _WRITER_KWARG_SET & set(run_kwargs['kwargs'])):
+                    _finish(nodes, _run_function(**run_kwargs))
+                else:
+                    runner.submit(nodes, _run_function, run_kwargs)
+            if runner.n_running > 0:
+                _finish(*runner.wait_one())
+
+    def generate(self, data_keys, dag_output_path=None, n_jobs=1,
+                 backend='thread', release_memory=True, incremental=False,
+                 profiler=None):
+        """Generate the data and all of its ancestors that are not generated.
+
+        Parameters
+        ==========
+        n_jobs: int
+            The maximum number of node functions that run at the same time.
+        backend: {'thread', 'process'}
+            Run the node functions in threads or in forked processes. It only
+            works when ``n_jobs > 1``.
+        release_memory: bool
+            Release the data in the memory handler once all the nodes
+            requiring it are generated, and run first the nodes that release
+            the most in-memory data. The data in ``data_keys`` are kept.
+        incremental: bool
+            Append the new rows to the existing data of the nodes with
+            ``incremental=True``. Their node functions get ``row_start``, the
+            number of existing rows, and should only return the rows after it.
+        profiler: feagen.profiler.Profiler
+            Record the resource usage of each phase of the nodes.
+        """
         if isinstance(data_keys, basestring):
             data_keys = (data_keys,)
-        involved_dag, generation_order = self.build_involved_dag(data_keys)
+        involved_dag, generation_order = self.build_involved_dag(
+            data_keys, incremental=incremental)
         if dag_output_path is not None:
+            self._estimate_costs(involved_dag, generation_order)
             draw_dag(involved_dag, dag_output_path)
+        consumer_counts = None
+        if release_memory:
+            generation_order = self._get_memory_aware_order(involved_dag,
+                                                            generation_order)
+            consumer_counts = self._count_memory_consumers(involved_dag)
+        else:
+            generation_order = [node for node in generation_order
+                                if not involved_dag.node[node]['skipped']]
 
         # generate data
-        for node in generation_order:
-            node_attr = involved_dag.node[node]
-            if node_attr['skipped']:
-                continue
-            self._generate_one(
-                involved_dag, node, node_attr['func_name'],
-                node_attr['handler'], node_attr['handler_kwargs'],
-                node_attr['__re_args__'], node_attr['mode'])
+        self._profiler = profiler
+        try:
+            if n_jobs > 1:
+                self._generate_parallel(involved_dag, generation_order,
+                                        n_jobs, backend, consumer_counts)
+            else:
+                self._generate_serial(involved_dag, generation_order,
+                                      consumer_counts)
+        finally:
+            self._profiler = None
+            for handler in six.itervalues(self._handlers):
+                with _hold_lock(handler):
+                    handler.flush()
+            self._commit_catalog()
 
         return involved_dag
 
@@ -206,28 +1078,37 @@ class DataGenerator(six.with_metaclass(FeatureGeneratorType, DataBundlerMixin)):
 class FeatureGenerator(DataGenerator):
 
     def __init__(self, handlers=None, h5py_hdf_path=None, pandas_hdf_path=None,
-                 pickle_dir=None):
+                 pickle_dir=None, npy_dir=None, memory_max_bytes=None,
+                 memory_spill_dir=None, memory_cache_dir=None,
+                 catalog_path=None,
+                 h5py_dataset_kwargs=None, pandas_hdf_write_kwargs=None):
         if handlers is None:
             handlers = {}
-        if ('memory' in self._handler_set
-                and 'memory' not in handlers):
-            handlers['memory'] = MemoryDataHandler()
-        if ('h5py' in self._handler_set
-                and 'h5py' not in handlers):
-            if h5py_hdf_path is None:
-                raise ValueError("h5py_hdf_path should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['h5py'] = H5pyDataHandler(h5py_hdf_path)
-        if ('pandas_hdf' in self._handler_set
-                and 'pandas_hdf' not in handlers):
-            if pandas_hdf_path is None:
-                raise ValueError("pandas_hdf_path should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['pandas_hdf'] = PandasHDFDataHandler(pandas_hdf_path)
-        if ('pickle' in self._handler_set
-                and 'pickle' not in handlers):
-            if pickle_dir is None:
-                raise ValueError("pickle_dir should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['pickle'] = PickleDataHandler(pickle_dir)
-        super(FeatureGenerator, self).__init__(handlers)
+        # the handler key -> (the argument name and the value of the required
+        # path, the constructor)
+        handler_constructors = {
+            'memory': (None, None, functools.partial(
+                _create_memory_handler, memory_max_bytes, memory_spill_dir,
+                memory_cache_dir)),
+            'h5py': ('h5py_hdf_path', h5py_hdf_path, functools.partial(
+                H5pyDataHandler, h5py_hdf_path,
+                **(h5py_dataset_kwargs or {}))),
+            'pandas_hdf': ('pandas_hdf_path', pandas_hdf_path,
+                           functools.partial(
+                               PandasHDFDataHandler, pandas_hdf_path,
+                               **(pandas_hdf_write_kwargs or {}))),
+            'pickle': ('pickle_dir', pickle_dir,
+                       functools.partial(PickleDataHandler, pickle_dir)),
+            'npy': ('npy_dir', npy_dir,
+                    functools.partial(NumpyDataHandler, npy_dir)),
+        }
+        _create_missing_handlers(handlers, self._handler_set,
+                                 handler_constructors)
+        catalog = None
+        if catalog_path is not None:
+            catalog = DataCatalog(catalog_path)
+            catalog.delete_removed_stores({
+                handler_key: path for handler_key, (path_name, path, _)
+                in six.viewitems(handler_constructors)
+                if path_name is not None})
+        super(FeatureGenerator, self).__init__(handlers, catalog)
@@ -1,6 +1,11 @@
+import atexit
 import os.path
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from functools import partial
+from shutil import rmtree
+from tempfile import mkdtemp
+import threading
 
 from bistiming import SimpleTimer
 import h5py
@@ -14,9 +19,14 @@ import six
 from six.moves import cPickle
 
 from .data_wrappers import PandasHDFDataset
+from .data_wrappers.pandas_hdf import DEFAULT_CHUNK_ROWS
 
 
 SPARSE_FORMAT_SET = set(['csr', 'csc'])
+FINGERPRINT_ATTR_NAME = 'feagen_fingerprint'
+ROW_CHUNK_NBYTES = 1 << 20
+BUNDLE_BLOCK_NBYTES = 1 << 26
+AUTO_FIXED_MAX_COLUMNS = 2
 
 
 def check_redundant_keys(result_dict_key_set, will_generate_key_set,
@@ -39,12 +49,172 @@ def check_exact_match_keys(result_dict_key_set, will_generate_key_set,
                              will_generate_key_set, handler_key))
 
 
+def get_link_path(target_path, link_file_path):
+    """Return the path of the target relative to the file holding the link.
+
+    HDF5 resolves the relative paths of the external links and the sources of
+    the virtual datasets against the directory of the file holding them, so
+    the files can be moved together.
+    """
+    return os.path.relpath(
+        os.path.abspath(target_path),
+        os.path.dirname(os.path.abspath(link_file_path)))
+
+
+def create_npy_external_dataset(group, name, npy_path):
+    """Create a dataset whose raw data is stored in the ``.npy`` file.
+
+    The absolute path is stored since HDF5 resolves the relative paths of the
+    external storage against the working directory.
+    """
+    array = np.load(npy_path, mmap_mode='r')
+    return group.create_dataset(
+        name, shape=array.shape, dtype=array.dtype,
+        external=[(os.path.abspath(npy_path), array.offset, array.nbytes)])
+
+
+def check_h5py_nan(key, result):
+    if ss.isspmatrix(result):
+        if np.isnan(result.data).any():
+            raise ValueError("data {} have nan".format(key))
+    elif np.isnan(result).any():
+        raise ValueError("data {} have nan".format(key))
+
+
+def check_pandas_null(key, result):
+    if isinstance(result, pd.DataFrame):
+        is_null = result.isnull().any().any()
+    elif isinstance(result, pd.Series):
+        is_null = result.isnull().any()
+    else:
+        raise ValueError("PandasHDFDataHandler doesn't support type "
+                         "{} (in key {})".format(type(result), key))
+    if is_null:
+        raise ValueError("data {} have nan".format(key))
+
+
+def get_row_chunks(shape, itemsize, n_chunk_rows=None, resizable=False):
+    """Return the chunk shape for reading the rows in batches.
+
+    Each chunk contains whole rows. If ``n_chunk_rows`` is None, it is chosen
+    to make each chunk about ``ROW_CHUNK_NBYTES`` bytes.
+    """
+    row_shape = tuple(shape[1:])
+    if n_chunk_rows is None:
+        row_nbytes = itemsize * int(np.prod(row_shape))
+        n_chunk_rows = ROW_CHUNK_NBYTES // max(row_nbytes, 1)
+    if not resizable:
+        n_chunk_rows = min(n_chunk_rows, shape[0])
+    return (max(int(n_chunk_rows), 1),) + row_shape
+
+
+def get_data_shape(data):
+    """Return the shape of the data, including the h5sparse datasets."""
+    if isinstance(data, h5sparse.Dataset):
+        return tuple(int(dim) for dim in data.h5py_group.attrs['h5sparse_shape'])
+    return tuple(data.shape)
+
+
+def get_data_dtype(data):
+    if isinstance(data, h5sparse.Dataset):
+        return data.h5py_group['data'].dtype
+    elif isinstance(data, pd.DataFrame):
+        return np.result_type(*data.dtypes)
+    return data.dtype
+
+
+def get_data_nnz(data):
+    """Return the number of the stored values of the sparse data or None."""
+    if isinstance(data, h5sparse.Dataset):
+        return data.h5py_group['data'].shape[0]
+    elif ss.issparse(data):
+        return data.nnz
+    return None
+
+
+def get_block_rows(data):
+    """Return the number of rows in a block of about ``BUNDLE_BLOCK_NBYTES``
+    bytes when the data is copied block by block."""
+    shape = get_data_shape(data)
+    itemsize = get_data_dtype(data).itemsize
+    nnz = get_data_nnz(data)
+    if nnz is None:
+        row_nbytes = itemsize * int(np.prod(shape[1:]))
+    else:
+        # with the indices
+        row_nbytes = (itemsize + 4) * nnz // max(shape[0], 1)
+    return max(BUNDLE_BLOCK_NBYTES // max(row_nbytes, 1), 1)
+
+
+def iter_row_blocks(n_rows, block_size, rows=None, start=0):
+    """Iterate over the blocks of the rows to read.
+
+    Yield ``(read_start, read_end, block_rows)``. If ``rows`` (the sorted
+    indices of the selected rows) is None, the rows from ``start`` are read
+    by blocks of ``block_size`` rows and ``block_rows`` is None. Otherwise,
+    ``block_rows`` are the indices of the selected rows relative to
+    ``read_start`` in each block, and the blocks without selected rows are
+    skipped.
+    """
+    for block_start in range(start, n_rows, block_size):
+        block_end = min(n_rows, block_start + block_size)
+        if rows is None:
+            yield block_start, block_end, None
+            continue
+        left, right = np.searchsorted(rows, [block_start, block_end])
+        if right > left:
+            yield (rows[left], rows[right - 1] + 1,
+                   rows[left:right] - rows[left])
+
+
+def take_rows(data_block, block_rows):
+    """Select the rows of a block, or return the block if ``block_rows`` is
+    None."""
+    if block_rows is None:
+        return data_block
+    if isinstance(data_block, (pd.DataFrame, pd.Series)):
+        return data_block.iloc[block_rows]
+    return data_block[block_rows]
+
+
+def choose_pandas_hdf_format(result):
+    """Choose the format that is faster to write and read the result.
+
+    The fixed format is faster to write, but reading a frame with more than
+    ``AUTO_FIXED_MAX_COLUMNS`` columns is slower than the table format (see
+    ``benchmarks/bench_pandas_hdf.py``), and the object columns are pickled.
+    The table format can't store a frame with MultiIndex columns.
+    """
+    if isinstance(result, pd.Series):
+        dtypes = [result.dtype]
+    else:
+        if isinstance(result.columns, pd.MultiIndex):
+            return 'fixed'
+        if result.shape[1] > AUTO_FIXED_MAX_COLUMNS:
+            return 'table'
+        dtypes = result.dtypes
+    if any(dtype == np.object_ for dtype in dtypes):
+        return 'table'
+    return 'fixed'
+
+
 class DataHandler(six.with_metaclass(ABCMeta, object)):
+    # whether the data returned by ``get`` can be read by several threads at
+    # the same time, e.g., by the concat bundling
+    concurrent_read = False
+    # the lock that the threads should hold to access the store, which is
+    # also held by the data returned by ``get``, or None if not needed
+    lock = None
 
     @abstractmethod
     def can_skip(self, data_key):
         pass
 
+    def is_can_skip_cheap(self):
+        """Whether ``can_skip`` is cheap (e.g., doesn't open a store), so the
+        records in the catalog are confirmed by it."""
+        return True
+
     @abstractmethod
     def get(self, keys):
         pass
@@ -65,55 +235,346 @@ class DataHandler(six.with_metaclass(ABCMeta, object)):
 
     @abstractmethod
     def write_data(self, result_dict):
+        """Write the data.
+
+        The keyword arguments of ``will_generate`` other than the ones used by
+        feagen are also passed to ``get_function_kwargs``,
+        ``check_result_dict_keys``, ``write_data`` and ``write_stream``.
+        """
         pass
 
-    def bundle(self, key, path, new_key):
-        """Copy the data to another HDF5 file with new key."""
+    def write_stream(self, result_dict_iter, append=False):
+        """Write the blocks of rows in ``result_dict_iter`` one by one.
+
+        If ``append`` is True, the blocks are appended to the existing data.
+        """
+        raise NotImplementedError("{} doesn't support stream=True or "
+                                  "incremental=True."
+                                  .format(type(self).__name__))
+
+    def flush(self):
+        """Finish the deferred work after generating the data."""
+        pass
+
+    def select(self, key, columns=None, where=None, start=None, stop=None):
+        """Read the rows from ``start`` to ``stop`` of the data."""
+        if columns is not None or where is not None:
+            raise NotImplementedError("{} doesn't support selecting by columns "
+                                      "or where.".format(type(self).__name__))
+        return self.get(key)[start:stop]
+
+    def get_n_rows(self, key):
+        return self.get(key).shape[0]
+
+    def get_metadata(self, key):
+        """Return the shape, dtype and size (in bytes) of the data."""
         data = self.get(key)
-        with h5py.File(path) as h5f:
+        return {
+            'shape': getattr(data, 'shape', None),
+            'dtype': getattr(data, 'dtype', None),
+            'nbytes': getattr(data, 'nbytes', None),
+        }
+
+    def get_fingerprint(self, key):
+        """Return the fingerprint stored with the data, or None if unknown."""
+        # pylint: disable=unused-argument
+        return None
+
+    def set_fingerprint(self, key, fingerprint):
+        """Store the fingerprint with the data."""
+        pass
+
+    def delete(self, key):
+        """Remove the data so that it can be generated again."""
+        raise NotImplementedError("{} doesn't support deleting data."
+                                  .format(type(self).__name__))
+
+    def bundle(self, key, path, new_key, row_start=0, rows=None):
+        """Copy the data to another HDF5 file with new key.
+
+        If ``rows`` (the sorted indices) is given, only these rows are copied
+        block by block. If ``row_start`` > 0, only the (selected) rows from
+        ``row_start`` are appended to the existing dataset ``new_key``.
+        """
+        data = self.get(key)
+        if rows is not None:
+            self._bundle_rows(data, path, new_key, row_start, rows)
+            return
+        with h5py.File(path, 'a') as h5f:
             if ss.isspmatrix(data) or isinstance(data, h5sparse.Dataset):
                 h5f = h5sparse.Group(h5f)
-            h5f.create_dataset(new_key, data=data)
+                if row_start > 0:
+                    h5f[new_key].append(data[row_start:])
+                else:
+                    h5f.create_dataset(new_key, data=data, chunks=True,
+                                       maxshape=(None,))
+            elif row_start > 0:
+                dset = h5f[new_key]
+                dset.resize(data.shape[0], axis=0)
+                dset[row_start:] = data[row_start:]
+            else:
+                h5f.create_dataset(new_key, data=data, chunks=True,
+                                   maxshape=(None,) + data.shape[1:])
+
+    @staticmethod
+    def _bundle_rows(data, path, new_key, row_start, rows):
+        shape = get_data_shape(data)
+        with h5py.File(path, 'a') as h5f:
+            if ss.isspmatrix(data) or isinstance(data, h5sparse.Dataset):
+                h5f = h5sparse.Group(h5f)
+                if row_start == 0:
+                    h5f.create_dataset(
+                        new_key, data=ss.csr_matrix(
+                            (0, shape[1]), dtype=get_data_dtype(data)),
+                        chunks=True, maxshape=(None,))
+                sparse_dset = h5f[new_key]
+                for read_start, read_end, block_rows in iter_row_blocks(
+                        shape[0], get_block_rows(data), rows[row_start:]):
+                    sparse_dset.append(
+                        data[read_start: read_end][block_rows].tocsr())
+                return
+            if row_start == 0:
+                h5f.create_dataset(new_key, shape=(len(rows),) + shape[1:],
+                                   dtype=get_data_dtype(data), chunks=True,
+                                   maxshape=(None,) + shape[1:])
+            dset = h5f[new_key]
+            dset.resize(len(rows), axis=0)
+            for read_start, read_end, block_rows in iter_row_blocks(
+                    shape[0], get_block_rows(data), rows[row_start:]):
+                data_block = take_rows(data[read_start: read_end], block_rows)
+                if isinstance(data_block, (pd.DataFrame, pd.Series)):
+                    data_block = data_block.values
+                dset[row_start: row_start + len(block_rows)] = data_block
+                row_start += len(block_rows)
+
+    def link(self, key, path, new_key):
+        """Link the data to another HDF5 file with new key without copying.
+
+        The data is copied by ``bundle`` if the handler can't link it.
+        """
+        self.bundle(key, path, new_key)
+
+    def get_virtual_source(self, key, path):
+        """Return the ``h5py.VirtualSource`` of the data for a virtual dataset
+        in the HDF5 file ``path``, or None if the data can't be mapped."""
+        # pylint: disable=unused-argument
+        return None
 
 
 class H5pyDataHandler(DataHandler):
+    """Store the data in an HDF5 file.
+
+    The dataset options can be set for each key by the keyword arguments of
+    ``will_generate``, which override the defaults set here.
 
-    def __init__(self, hdf_path):
+    Parameters
+    ==========
+    hdf_path: str
+        The path of the HDF5 file.
+    chunks: {None, False, True, 'auto', int, tuple}
+        None or False stores the data contiguously (it is chunked with 'auto'
+        if compressed). True uses the h5py heuristic. 'auto' chunks the whole
+        rows so that each chunk has about 1 MiB, which is efficient for
+        reading the rows in batches, e.g., when bundling. An int is the number
+        of rows in a chunk. A tuple is the chunk shape. The sparse data is
+        chunked with 'auto' unless an int is given.
+    compression: {None, 'gzip', 'lzf', int}
+        The compression filter (an int is the gzip level).
+    compression_opts:
+        The options of the compression filter.
+    shuffle: bool
+        Whether to use the shuffle filter, which improves the compression.
+    """
+
+    def __init__(self, hdf_path, chunks=None, compression=None,
+                 compression_opts=None, shuffle=False):
         hdf_dir = os.path.dirname(hdf_path)
         if hdf_dir != '':
             mkdir_p(hdf_dir)
-        self.h5f = h5py.File(hdf_path, 'a')
+        self.hdf_path = hdf_path
+        self._h5f = None
+        self._default_dataset_kwargs = {
+            'chunks': chunks,
+            'compression': compression,
+            'compression_opts': compression_opts,
+            'shuffle': shuffle,
+        }
+
+    @property
+    def h5f(self):
+        """The HDF5 file, which is opened on the first access."""
+        if self._h5f is None:
+            self._h5f = h5py.File(self.hdf_path, 'a')
+        return self._h5f
 
     def can_skip(self, data_key):
         if data_key in self.h5f:
             return True
         return False
 
+    def is_can_skip_cheap(self):
+        return self._h5f is not None
+
     def get(self, key):
         if isinstance(key, basestring):
             return h5sparse.Group(self.h5f)[key]
         return {k: h5sparse.Group(self.h5f)[k] for k in key}
 
+    def _get_dataset_kwargs(self, **dataset_kwargs):
+        """Fill the unset dataset options with the defaults."""
+        kwargs = dict(self._default_dataset_kwargs)
+        kwargs.update((name, value)
+                      for name, value in six.iteritems(dataset_kwargs)
+                      if value is not None)
+        return kwargs
+
+    @staticmethod
+    def _get_filter_kwargs(dataset_kwargs):
+        filter_kwargs = {}
+        if dataset_kwargs['compression'] is not None:
+            filter_kwargs['compression'] = dataset_kwargs['compression']
+            if dataset_kwargs['compression_opts'] is not None:
+                filter_kwargs['compression_opts'] = (
+                    dataset_kwargs['compression_opts'])
+        if dataset_kwargs['shuffle']:
+            filter_kwargs['shuffle'] = True
+        return filter_kwargs
+
+    def _get_chunks_option(self, dataset_kwargs, resizable=False):
+        """Return the ``chunks`` option, which is 'auto' instead of None or
+        False if the data has to be chunked (resizable or filtered)."""
+        chunks = dataset_kwargs['chunks']
+        if chunks is not None and chunks is not False:
+            return chunks
+        if resizable or len(self._get_filter_kwargs(dataset_kwargs)) > 0:
+            return 'auto'
+        return None
+
+    def _get_chunks(self, dataset_kwargs, shape, itemsize, resizable=False):
+        """Return the chunk shape, or None if the data is contiguous."""
+        chunks = self._get_chunks_option(dataset_kwargs, resizable)
+        if chunks is None:
+            return None
+        if len(shape) == 0 or (shape[0] == 0 and not resizable):
+            # scalar and empty data can't be chunked
+            return None
+        if chunks is True or isinstance(chunks, tuple):
+            return chunks
+        n_chunk_rows = None if chunks == 'auto' else chunks
+        return get_row_chunks(shape, itemsize, n_chunk_rows, resizable)
+
+    def _create_dense_dataset(self, key, result, resizable=False,
+                              **dataset_kwargs):
+        result = np.asarray(result)
+        dataset_kwargs = self._get_dataset_kwargs(**dataset_kwargs)
+        kwargs = {}
+        chunks = self._get_chunks(dataset_kwargs, result.shape,
+                                  result.dtype.itemsize, resizable)
+        if chunks is not None:
+            # the filters only work with chunked data
+            kwargs = self._get_filter_kwargs(dataset_kwargs)
+            kwargs['chunks'] = chunks
+        if resizable:
+            kwargs['maxshape'] = (None,) + result.shape[1:]
+        self.h5f.create_dataset(key, data=result, **kwargs)
+
+    def _create_sparse_dataset(self, key, result, resizable=False,
+                               **dataset_kwargs):
+        """Create the sparse data in the same layout as h5sparse."""
+        dataset_kwargs = self._get_dataset_kwargs(**dataset_kwargs)
+        chunks = dataset_kwargs['chunks']
+        if isinstance(chunks, tuple):
+            raise ValueError("the chunk shape of the sparse data {} can't be "
+                             "a tuple".format(key))
+        # the average number of the stored entries in a row
+        n_row_entries = float(max(result.nnz, 1)) / max(result.shape[0], 1)
+        group = self.h5f.create_group(key)
+        group.attrs['h5sparse_format'] = result.format
+        group.attrs['h5sparse_shape'] = result.shape
+        components = (
+            ('data', result.data, None),
+            ('indices', result.indices, np.int32),
+            ('indptr', result.indptr, np.int64),
+        )
+        for name, component, dtype in components:
+            component = np.asarray(component, dtype=dtype)
+            component_kwargs = dict(dataset_kwargs)
+            if (isinstance(chunks, six.integer_types)
+                    and not isinstance(chunks, bool)):
+                if name != 'indptr':
+                    # the number of rows to the number of entries
+                    component_kwargs['chunks'] = int(chunks * n_row_entries)
+            elif chunks is not True:
+                component_kwargs['chunks'] = 'auto'
+            kwargs = {}
+            component_chunks = self._get_chunks(
+                component_kwargs, component.shape, component.dtype.itemsize,
+                resizable)
+            if component_chunks is not None:
+                kwargs = self._get_filter_kwargs(component_kwargs)
+                kwargs['chunks'] = component_chunks
+            if resizable:
+                kwargs['maxshape'] = (None,)
+            group.create_dataset(name, data=component, **kwargs)
+
+    def _create_dataset(self, key, result, resizable=False, **dataset_kwargs):
+        if ss.isspmatrix(result):
+            if result.format not in SPARSE_FORMAT_SET:
+                raise ValueError("H5pyDataHandler doesn't support the sparse "
+                                 "format {} (in key {})"
+                                 .format(result.format, key))
+            self._create_sparse_dataset(key, result, resizable,
+                                        **dataset_kwargs)
+        else:
+            self._create_dense_dataset(key, result, resizable,
+                                       **dataset_kwargs)
+
+    def _get_create_dataset_function(self, key, sparse=False,
+                                     **dataset_kwargs):
+        """Return the function for manually creating the dataset ``key``.
+
+        The filters and the explicit chunk shape are used unless they are
+        given when calling the function.
+        """
+        dataset_kwargs = self._get_dataset_kwargs(**dataset_kwargs)
+        default_kwargs = self._get_filter_kwargs(dataset_kwargs)
+        chunks = dataset_kwargs['chunks']
+        if (chunks is True or isinstance(chunks, tuple)) and not sparse:
+            default_kwargs['chunks'] = chunks
+        if sparse:
+            create_dataset = h5sparse.Group(self.h5f).create_dataset
+        else:
+            create_dataset = self.h5f.create_dataset
+
+        def _create_dataset(*args, **kwargs):
+            for name, value in six.iteritems(default_kwargs):
+                kwargs.setdefault(name, value)
+            return create_dataset(key, *args, **kwargs)
+        return _create_dataset
+
     def get_function_kwargs(self, will_generate_keys, data,
-                            manually_create_dataset=False):
+                            manually_create_dataset=False, **dataset_kwargs):
         kwargs = {}
         if len(data) > 0:
             kwargs['data'] = data
         if manually_create_dataset is True:
             kwargs['create_dataset_functions'] = {
-                k: partial(self.h5f.create_dataset, k)
+                k: self._get_create_dataset_function(k, **dataset_kwargs)
                 for k in will_generate_keys
             }
         elif manually_create_dataset in SPARSE_FORMAT_SET:
             kwargs['create_dataset_functions'] = {
-                k: partial(h5sparse.Group(self.h5f).create_dataset, k)
+                k: self._get_create_dataset_function(k, sparse=True,
+                                                     **dataset_kwargs)
                 for k in will_generate_keys
             }
         return kwargs
 
     def check_result_dict_keys(self, result_dict, will_generate_keys,
                                function_name, handler_key,
-                               manually_create_dataset=False):
+                               manually_create_dataset=False,
+                               **dataset_kwargs):
+        # pylint: disable=unused-argument
         will_generate_key_set = set(will_generate_keys)
         result_dict_key_set = set(result_dict.keys())
         if manually_create_dataset:
@@ -125,13 +586,11 @@ class H5pyDataHandler(DataHandler):
             check_exact_match_keys(result_dict_key_set, will_generate_key_set,
                                    function_name, handler_key)
 
-    def write_data(self, result_dict):
+    def write_data(self, result_dict, manually_create_dataset=False,
+                   **dataset_kwargs):
+        # pylint: disable=unused-argument
         for key, result in six.iteritems(result_dict):
-            if ss.isspmatrix(result):
-                if np.isnan(result.data).any():
-                    raise ValueError("data {} have nan".format(key))
-            elif np.isnan(result).any():
-                raise ValueError("data {} have nan".format(key))
+            check_h5py_nan(key, result)
             with SimpleTimer("Writing generated data {} to hdf5 file"
                              .format(key),
                              end_in_new_line=False):
@@ -139,49 +598,273 @@ class H5pyDataHandler(DataHandler):
                     # self.h5f[key][...] = result
                     raise NotImplementedError("Overwriting not supported.")
                 else:
-                    if (isinstance(result, ss.csc_matrix)
-                            or isinstance(result, ss.csr_matrix)):
-                        # sparse matrix
-                        h5sparse.Group(self.h5f).create_dataset(key,
-                                                                data=result)
-                    else:
-                        self.h5f.create_dataset(key, data=result)
+                    self._create_dataset(key, result, **dataset_kwargs)
         self.h5f.flush()
 
+    def get_n_rows(self, key):
+        item = self.h5f[key]
+        if isinstance(item, h5py.Group):
+            # sparse matrix
+            return int(item.attrs['h5sparse_shape'][0])
+        return item.shape[0]
+
+    def _create_resizable(self, key, result, **dataset_kwargs):
+        if ss.isspmatrix(result) and not isinstance(result, ss.csr_matrix):
+            raise ValueError("only csr_matrix can be appended "
+                             "(in key {})".format(key))
+        self._create_dataset(key, result, resizable=True, **dataset_kwargs)
+
+    def _append_block(self, key, result):
+        item = self.h5f[key]
+        if isinstance(item, h5py.Group):
+            # sparse matrix
+            if item['indptr'].maxshape[0] is not None:
+                raise ValueError("data {} is not resizable".format(key))
+            h5sparse.Group(self.h5f)[key].append(result)
+        else:
+            if item.maxshape[0] is not None:
+                raise ValueError("data {} is not resizable".format(key))
+            n_rows = item.shape[0]
+            item.resize(n_rows + result.shape[0], axis=0)
+            item[n_rows:] = result
+
+    def _truncate(self, key, n_rows):
+        item = self.h5f[key]
+        if isinstance(item, h5py.Group):
+            # sparse matrix
+            nnz = item['indptr'][n_rows]
+            item['data'].resize((nnz,))
+            item['indices'].resize((nnz,))
+            item['indptr'].resize((n_rows + 1,))
+            item.attrs['h5sparse_shape'] = (
+                n_rows, item.attrs['h5sparse_shape'][1])
+        else:
+            item.resize(n_rows, axis=0)
+
+    def write_stream(self, result_dict_iter, append=False,
+                     manually_create_dataset=False, **dataset_kwargs):
+        # pylint: disable=unused-argument
+        # the number of rows before writing (None for the new keys)
+        orig_n_rows = {}
+        try:
+            with SimpleTimer("Writing generated data stream to hdf5 file",
+                             end_in_new_line=False):
+                for result_dict in result_dict_iter:
+                    for key, result in six.iteritems(result_dict):
+                        check_h5py_nan(key, result)
+                        if key in orig_n_rows:
+                            self._append_block(key, result)
+                        elif key in self.h5f:
+                            if not append:
+                                raise NotImplementedError(
+                                    "Overwriting not supported.")
+                            orig_n_rows[key] = self.get_n_rows(key)
+                            self._append_block(key, result)
+                        else:
+                            orig_n_rows[key] = None
+                            self._create_resizable(key, result,
+                                                   **dataset_kwargs)
+        except BaseException:
+            # don't leave the partial data, or it will be skipped next time
+            for key, n_rows in six.iteritems(orig_n_rows):
+                if n_rows is None:
+                    del self.h5f[key]
+                else:
+                    self._truncate(key, n_rows)
+            raise
+        finally:
+            self.h5f.flush()
+
+    def get_metadata(self, key):
+        item = self.h5f[key]
+        if isinstance(item, h5py.Group):
+            datasets = [item[name] for name in ('data', 'indices', 'indptr')]
+            return {
+                'shape': tuple(item.attrs['h5sparse_shape']),
+                'dtype': item['data'].dtype,
+                'nbytes': sum(dset.id.get_storage_size() for dset in datasets),
+            }
+        return {
+            'shape': item.shape,
+            'dtype': item.dtype,
+            'nbytes': item.id.get_storage_size(),
+        }
+
+    def get_fingerprint(self, key):
+        return self.h5f[key].attrs.get(FINGERPRINT_ATTR_NAME)
+
+    def set_fingerprint(self, key, fingerprint):
+        self.h5f[key].attrs[FINGERPRINT_ATTR_NAME] = fingerprint
+
+    def delete(self, key):
+        del self.h5f[key]
+
+    def link(self, key, path, new_key):
+        """Link the data to another HDF5 file by an external link."""
+        self.h5f.flush()
+        with h5py.File(path, 'a') as h5f:
+            h5f[new_key] = h5py.ExternalLink(
+                get_link_path(self.hdf_path, path), key)
+
+    def get_virtual_source(self, key, path):
+        item = self.h5f[key]
+        if not isinstance(item, h5py.Dataset):
+            # sparse data
+            return None
+        self.h5f.flush()
+        return h5py.VirtualSource(get_link_path(self.hdf_path, path), key,
+                                  shape=item.shape, dtype=item.dtype)
+
 
 class PandasHDFDataHandler(DataHandler):
+    """Store the data in an HDF5 file using pandas HDFStore.
+
+    The write options can be set for each key by the keyword arguments of
+    ``will_generate``, which override the defaults set here.
+
+    Parameters
+    ==========
+    hdf_path: str
+        The path of the HDF5 file.
+    format: {'auto', 'table', 'fixed'}
+        The format of the data written at once. 'auto' chooses the one that
+        is faster to write and read (see ``choose_pandas_hdf_format``), or
+        'table' if the table options below are set. The streamed and
+        manually appended data are always in the table format.
+    complib: {None, 'zlib', 'lzo', 'bzip2', 'blosc', ...}
+        The compression library. The default is used by all the data, while
+        the one set for a key only works with the table format.
+    complevel: int
+        The compression level (0-9).
+    data_columns: list or True
+        The columns that can be queried by ``where`` (table format only).
+    expectedrows: int
+        The expected number of rows of the table for optimizing the chunk
+        size (table format only).
+    index: bool
+        Whether to create the table index. The index is created by ``flush``
+        after the generation instead of after every write.
+    """
 
-    def __init__(self, hdf_path):
+    def __init__(self, hdf_path, format='auto', complib=None, complevel=None,
+                 data_columns=None, expectedrows=None, index=True):
+        # pylint: disable=redefined-builtin
         hdf_dir = os.path.dirname(hdf_path)
         if hdf_dir != '':
             mkdir_p(hdf_dir)
-        self.hdf_store = pd.HDFStore(hdf_path)
+        self.hdf_path = hdf_path
+        self._hdf_store = None
+        self._store_kwargs = {'complib': complib, 'complevel': complevel}
+        self._default_write_kwargs = {
+            'format': format,
+            'data_columns': data_columns,
+            'expectedrows': expectedrows,
+            'index': index,
+        }
+        # the tables whose index is not created yet
+        self._unindexed_keys = set()
+        # PyTables is not thread-safe
+        self.lock = threading.RLock()
+
+    @property
+    def hdf_store(self):
+        """The HDF store, which is opened on the first access."""
+        if self._hdf_store is None:
+            self._hdf_store = pd.HDFStore(self.hdf_path, **self._store_kwargs)
+        return self._hdf_store
+
+    def _get_write_kwargs(self, **write_kwargs):
+        """Fill the unset write options with the defaults."""
+        kwargs = dict(self._default_write_kwargs)
+        kwargs.update((name, value)
+                      for name, value in six.iteritems(write_kwargs)
+                      if value is not None)
+        return kwargs
+
+    @staticmethod
+    def _get_table_kwargs(write_kwargs):
+        """Return the table options of ``HDFStore.append`` except index."""
+        table_kwargs = {}
+        for name in ('complib', 'complevel', 'data_columns', 'expectedrows'):
+            if write_kwargs.get(name) is not None:
+                table_kwargs[name] = write_kwargs[name]
+        return table_kwargs
+
+    def _get_format(self, key, result, write_kwargs):
+        data_format = write_kwargs['format']
+        has_table_kwargs = len(self._get_table_kwargs(write_kwargs)) > 0
+        if data_format == 'auto':
+            if has_table_kwargs:
+                return 'table'
+            return choose_pandas_hdf_format(result)
+        if data_format == 'fixed' and has_table_kwargs:
+            raise ValueError("complib, complevel, data_columns and "
+                             "expectedrows of key {} only work with "
+                             "format='table'".format(key))
+        if data_format not in ('table', 'fixed'):
+            raise ValueError("unknown format {} (in key {})"
+                             .format(data_format, key))
+        return data_format
+
+    def _append(self, key, result, write_kwargs, **append_kwargs):
+        """Append to the table without creating the index."""
+        write_kwargs = self._get_write_kwargs(**write_kwargs)
+        for name, value in six.iteritems(
+                self._get_table_kwargs(write_kwargs)):
+            append_kwargs.setdefault(name, value)
+        append_kwargs.setdefault('index', write_kwargs['index'])
+        if append_kwargs.pop('index'):
+            self._unindexed_keys.add(key)
+        self.hdf_store.append(key, result, index=False, **append_kwargs)
+
+    def _get_append_function(self, key, **write_kwargs):
+        """Return the function for manually appending to ``key``."""
+        return partial(self._append, key, write_kwargs=write_kwargs)
 
     def can_skip(self, data_key):
         if data_key in self.hdf_store:
             return True
         return False
 
+    def is_can_skip_cheap(self):
+        return self._hdf_store is not None
+
     def get(self, key):
         if isinstance(key, basestring):
-            return PandasHDFDataset(self.hdf_store, key)
-        return {k: PandasHDFDataset(self.hdf_store, k) for k in key}
+            return PandasHDFDataset(self.hdf_store, key, self.lock)
+        return {k: PandasHDFDataset(self.hdf_store, k, self.lock)
+                for k in key}
+
+    def select(self, key, columns=None, where=None, start=None, stop=None):
+        """Read the selected columns and rows into a pandas object."""
+        if self.hdf_store.get_storer(key).is_table:
+            return self.hdf_store.select(key, where=where, columns=columns,
+                                         start=start, stop=stop)
+        if where is not None:
+            raise ValueError("where only works with the table format but {} is "
+                             "in the fixed format. Write it with "
+                             "format='table' or data_columns.".format(key))
+        result = self.hdf_store.select(key, start=start, stop=stop)
+        if columns is not None:
+            result = result[columns]
+        return result
 
     def get_function_kwargs(self, will_generate_keys, data,
-                            manually_append=False):
+                            manually_append=False, **write_kwargs):
         kwargs = {}
         if len(data) > 0:
             kwargs['data'] = data
         if manually_append is True:
             kwargs['append_functions'] = {
-                k: partial(self.hdf_store.append, k)
+                k: self._get_append_function(k, **write_kwargs)
                 for k in will_generate_keys
             }
         return kwargs
 
     def check_result_dict_keys(self, result_dict, will_generate_keys,
                                function_name, handler_key,
-                               manually_append=False):
+                               manually_append=False, **write_kwargs):
+        # pylint: disable=unused-argument
         will_generate_key_set = set(will_generate_keys)
         result_dict_key_set = set(result_dict.keys())
         if manually_append:
@@ -193,57 +876,400 @@ class PandasHDFDataHandler(DataHandler):
             check_exact_match_keys(result_dict_key_set, will_generate_key_set,
                                    function_name, handler_key)
 
-    def write_data(self, result_dict):
+    def write_data(self, result_dict, manually_append=False,
+                   **write_kwargs):
+        # pylint: disable=unused-argument
+        write_kwargs = self._get_write_kwargs(**write_kwargs)
         for key, result in six.iteritems(result_dict):
-            is_null = False
-            if isinstance(result, pd.DataFrame):
-                if result.isnull().any().any():
-                    is_null = True
-            elif isinstance(result, pd.Series):
-                if result.isnull().any():
-                    is_null = True
-            else:
-                raise ValueError("PandasHDFDataHandler doesn't support type "
-                                 "{} (in key {})".format(type(result), key))
-            if is_null:
-                raise ValueError("data {} have nan".format(key))
+            check_pandas_null(key, result)
             with SimpleTimer("Writing generated data {} to hdf5 file"
                              .format(key),
                              end_in_new_line=False):
-                if (isinstance(result, pd.DataFrame)
-                        and isinstance(result.index, pd.MultiIndex)
-                        and isinstance(result.columns, pd.MultiIndex)):
+                if self._get_format(key, result, write_kwargs) == 'fixed':
                     self.hdf_store.put(key, result)
                 else:
-                    self.hdf_store.put(key, result, format='table')
+                    self._append(key, result, write_kwargs)
+        # the data is synced to the disk by flush() after the generation
+        self.hdf_store.flush()
+
+    def write_stream(self, result_dict_iter, append=False,
+                     manually_append=False, **write_kwargs):
+        # pylint: disable=unused-argument
+        # the number of rows before writing (None for the new keys)
+        orig_n_rows = {}
+        try:
+            with SimpleTimer("Writing generated data stream to hdf5 file",
+                             end_in_new_line=False):
+                for result_dict in result_dict_iter:
+                    for key, result in six.iteritems(result_dict):
+                        check_pandas_null(key, result)
+                        if key not in orig_n_rows:
+                            if key not in self.hdf_store:
+                                orig_n_rows[key] = None
+                            elif append:
+                                orig_n_rows[key] = self.get_n_rows(key)
+                            else:
+                                raise NotImplementedError(
+                                    "Overwriting not supported.")
+                        self._append(key, result, write_kwargs)
+        except BaseException:
+            # don't leave the partial data, or it will be skipped next time
+            for key, n_rows in six.iteritems(orig_n_rows):
+                if key not in self.hdf_store:
+                    continue
+                if n_rows is None:
+                    self.hdf_store.remove(key)
+                    self._unindexed_keys.discard(key)
+                else:
+                    self.hdf_store.remove(key, start=n_rows)
+            raise
+        finally:
+            self.hdf_store.flush()
+
+    def flush(self):
+        """Create the deferred table indexes and sync the file to the disk."""
+        if self._hdf_store is None:
+            return
+        for key in sorted(self._unindexed_keys):
+            if key in self.hdf_store:
+                self.hdf_store.create_table_index(key)
+        self._unindexed_keys.clear()
         self.hdf_store.flush(fsync=True)
 
-    def bundle(self, key, path, new_key):
-        """Copy the data to another HDF5 file with new key."""
-        data = self.get(key).value
-        data.to_hdf(path, new_key)
+    def get_fingerprint(self, key):
+        # the storer attrs of a table can be stale, so use the node attrs
+        return getattr(self.hdf_store.get_node(key)._v_attrs,
+                       FINGERPRINT_ATTR_NAME, None)
+
+    def set_fingerprint(self, key, fingerprint):
+        setattr(self.hdf_store.get_node(key)._v_attrs, FINGERPRINT_ATTR_NAME,
+                fingerprint)
+
+    def delete(self, key):
+        self.hdf_store.remove(key)
+        self._unindexed_keys.discard(key)
+
+    def bundle(self, key, path, new_key, row_start=0, rows=None):
+        """Copy the data to another HDF5 file with new key.
+
+        The data is copied by blocks of rows into a table, so the rows from
+        ``row_start`` can be appended to the bundled table. If ``rows`` (the
+        sorted indices) is given, only these rows are copied. The data with
+        MultiIndex columns, which can't be a table, is copied at once.
+        """
+        dataset = self.get(key)
+        if dataset.shape is None:
+            value = dataset.value
+            if rows is not None:
+                value = value.iloc[rows]
+            value.to_hdf(path, new_key)
+            return
+        n_rows = len(dataset) if rows is None else len(rows)
+        if row_start == 0 and n_rows == 0:
+            dataset[0:0].to_hdf(path, new_key)
+            return
+        with pd.HDFStore(path) as bundle_store:
+            if rows is None:
+                for chunk in dataset.iter_chunks(start=row_start):
+                    bundle_store.append(new_key, chunk, index=False)
+                return
+            for read_start, _, block_rows in iter_row_blocks(
+                    len(dataset), DEFAULT_CHUNK_ROWS, rows[row_start:]):
+                bundle_store.append(new_key,
+                                    dataset[read_start + block_rows],
+                                    index=False)
+
+
+def dump_data(val, path):
+    """Write the data to ``path`` + ``.npy`` (for the numpy arrays) or ``.pkl``
+    and return the path of the file.
+
+    With pickle protocol 5, the buffers of the data (e.g., the columns of a
+    frame) are written after the pickle instead of being copied into it, so
+    loading them is mostly reading the file into memory.
+    """
+    if isinstance(val, np.ndarray) and not val.dtype.hasobject:
+        path += ".npy"
+        np.save(path, val)
+        return path
+    path += ".pkl"
+    buffers = []
+    if cPickle.HIGHEST_PROTOCOL >= 5:
+        payload = cPickle.dumps(val, protocol=5,
+                                buffer_callback=buffers.append)
+        buffers = [buf.raw() for buf in buffers]
+    else:
+        payload = cPickle.dumps(val, protocol=cPickle.HIGHEST_PROTOCOL)
+    with open(path, "wb") as fp:
+        cPickle.dump((payload, [buf.nbytes for buf in buffers]), fp,
+                     protocol=cPickle.HIGHEST_PROTOCOL)
+        for buf in buffers:
+            fp.write(buf)
+    return path
+
+
+def load_data(path):
+    """Load the data written by ``dump_data``."""
+    if path.endswith(".npy"):
+        return np.load(path)
+    with open(path, "rb") as fp:
+        payload, buffer_sizes = cPickle.load(fp)
+        buffers = []
+        for buffer_size in buffer_sizes:
+            buf = bytearray(buffer_size)
+            fp.readinto(buf)
+            buffers.append(buf)
+    if len(buffers) == 0:
+        return cPickle.loads(payload)
+    return cPickle.loads(payload, buffers=buffers)
 
 
 class MemoryDataHandler(DataHandler):
+    """Keep the data in memory.
+
+    The data generated with ``will_generate('memory', ..., persist=True)`` is
+    also written to ``cache_dir`` with its fingerprint, so it's loaded from
+    the cache instead of generated again by the next runs, until the
+    fingerprint of the node changes. The fingerprint only covers the code and
+    the upstream data, so remove the cache if the node reads a file that has
+    changed.
+
+    Parameters
+    ==========
+    cache_dir: str or None
+        The directory of the persisted data.
+    """
+    concurrent_read = True
 
-    def __init__(self):
+    def __init__(self, cache_dir=None):
         self.data = {}
+        self._fingerprints = {}
+        if cache_dir is not None:
+            mkdir_p(cache_dir)
+        self.cache_dir = cache_dir
+
+    def _get_cache_path(self, key):
+        """Return the path of the persisted data, or None if not found."""
+        if self.cache_dir is None:
+            return None
+        for ext in (".npy", ".pkl"):
+            path = os.path.join(self.cache_dir, key + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _get_cache_fingerprint_path(self, key):
+        return os.path.join(self.cache_dir, key + ".fingerprint")
+
+    def _is_cached(self, key):
+        # the data is complete only after its fingerprint is written
+        return (self._get_cache_path(key) is not None
+                and os.path.exists(self._get_cache_fingerprint_path(key)))
+
+    def _write_cache(self, result_dict):
+        if self.cache_dir is None:
+            raise ValueError("persist=True needs the cache_dir of "
+                             "MemoryDataHandler (memory_cache_dir of "
+                             "FeatureGenerator).")
+        for key, val in six.viewitems(result_dict):
+            self._delete_cache(key)
+            with SimpleTimer("Persisting data %s" % key,
+                             end_in_new_line=False):
+                dump_data(val, os.path.join(self.cache_dir, key))
+
+    def _load_cache(self, key):
+        path = self._get_cache_path(key)
+        if path is None:
+            raise KeyError(key)
+        with SimpleTimer("Loading persisted data %s" % key,
+                         end_in_new_line=False):
+            return load_data(path)
+
+    def _delete_cache(self, key):
+        fingerprint_path = None
+        if self.cache_dir is not None:
+            fingerprint_path = self._get_cache_fingerprint_path(key)
+        for path in (fingerprint_path, self._get_cache_path(key)):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
 
     def can_skip(self, data_key):
-        if data_key in self.data:
+        if data_key in self.data or self._is_cached(data_key):
             return True
         return False
 
+    def get_metadata(self, key):
+        data = self.get(key)
+        return {
+            'shape': getattr(data, 'shape', None),
+            'dtype': getattr(data, 'dtype', None),
+            'nbytes': get_data_nbytes(data),
+        }
+
+    def _get_one(self, key):
+        if key not in self.data:
+            self.data[key] = self._load_cache(key)
+        return self.data[key]
+
     def get(self, key):
         if isinstance(key, basestring):
-            return self.data[key]
-        return {k: self.data[k] for k in key}
+            return self._get_one(key)
+        return {k: self._get_one(k) for k in key}
 
-    def write_data(self, result_dict):
+    def get_function_kwargs(self, will_generate_keys, data, persist=False):
+        # pylint: disable=unused-argument
+        return super(MemoryDataHandler, self).get_function_kwargs(
+            will_generate_keys, data)
+
+    def check_result_dict_keys(self, result_dict, will_generate_keys,
+                               function_name, handler_key, persist=False):
+        # pylint: disable=unused-argument
+        super(MemoryDataHandler, self).check_result_dict_keys(
+            result_dict, will_generate_keys, function_name, handler_key)
+
+    def write_data(self, result_dict, persist=False):
         self.data.update(result_dict)
+        if persist:
+            self._write_cache(result_dict)
+
+    def release(self, key):
+        """Remove the data from memory. The persisted data is kept."""
+        self.data.pop(key, None)
+        self._fingerprints.pop(key, None)
+
+    def get_fingerprint(self, key):
+        if key in self._fingerprints or not self._is_cached(key):
+            return self._fingerprints.get(key)
+        with open(self._get_cache_fingerprint_path(key)) as fp:
+            return fp.read()
+
+    def set_fingerprint(self, key, fingerprint):
+        self._fingerprints[key] = fingerprint
+        if self._get_cache_path(key) is not None:
+            with open(self._get_cache_fingerprint_path(key), "w") as fp:
+                fp.write(fingerprint)
+
+    def delete(self, key):
+        self.release(key)
+        self._delete_cache(key)
+
+
+def get_data_nbytes(data):
+    """Estimate the number of bytes that the data occupies in memory."""
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    elif isinstance(data, (pd.DataFrame, pd.Series)):
+        return int(np.sum(data.memory_usage(deep=True)))
+    elif ss.isspmatrix(data):
+        return sum(getattr(data, attr).nbytes
+                   for attr in ('data', 'indices', 'indptr', 'row', 'col')
+                   if hasattr(data, attr))
+    return len(cPickle.dumps(data, protocol=cPickle.HIGHEST_PROTOCOL))
+
+
+class BoundedMemoryDataHandler(MemoryDataHandler):
+    """Memory data handler that spills the data to disk when it's too large.
+
+    When the total size of the data exceeds ``max_bytes``, the least recently
+    used data are evicted and written to ``spill_dir`` (``.npy`` for numpy
+    arrays and pickle otherwise). They are loaded back when requested again.
+    The data should not be modified in place after being written.
+
+    Parameters
+    ==========
+    max_bytes: int
+        The memory budget in bytes.
+    spill_dir: str or None
+        The directory of the spilled files. A temporary directory is used if
+        None, which is removed by ``close`` or at exit.
+    cache_dir: str or None
+        The directory of the persisted data (see ``MemoryDataHandler``).
+    """
+
+    def __init__(self, max_bytes, spill_dir=None, cache_dir=None):
+        super(BoundedMemoryDataHandler, self).__init__(cache_dir)
+        self._owns_spill_dir = spill_dir is None
+        if spill_dir is None:
+            spill_dir = mkdtemp(prefix="feagen_spill_")
+            atexit.register(rmtree, spill_dir, True)
+        else:
+            mkdir_p(spill_dir)
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.data = OrderedDict()
+        self.nbytes = 0  # the bytes of the data in memory
+        self._nbytes = {}
+        self._spill_paths = {}
+        self._n_spill_files = 0
+
+    def can_skip(self, data_key):
+        if (data_key in self.data or data_key in self._spill_paths
+                or self._is_cached(data_key)):
+            return True
+        return False
+
+    def _spill(self, key):
+        val = self.data.pop(key)
+        self.nbytes -= self._nbytes[key]
+        if key in self._spill_paths:
+            # the file is still the same as the data
+            return
+        path = os.path.join(self.spill_dir, "%d" % self._n_spill_files)
+        self._n_spill_files += 1
+        with SimpleTimer("Spilling data %s to disk" % key,
+                         end_in_new_line=False):
+            self._spill_paths[key] = dump_data(val, path)
+
+    def _put(self, key, val):
+        self.data[key] = val
+        self.nbytes += self._nbytes[key]
+        while len(self.data) > 1 and self.nbytes > self.max_bytes:
+            self._spill(next(iter(self.data)))
+
+    def _get_one(self, key):
+        if key in self.data:
+            val = self.data.pop(key)
+            self.nbytes -= self._nbytes[key]
+        elif key in self._spill_paths:
+            val = load_data(self._spill_paths[key])
+        else:
+            val = self._load_cache(key)
+            self._nbytes[key] = get_data_nbytes(val)
+        # move the key to the most recently used end
+        self._put(key, val)
+        return val
+
+    def write_data(self, result_dict, persist=False):
+        for key, val in six.viewitems(result_dict):
+            self.release(key)
+            self._nbytes[key] = get_data_nbytes(val)
+            self._put(key, val)
+        if persist:
+            self._write_cache(result_dict)
+
+    def release(self, key):
+        if key in self.data:
+            del self.data[key]
+            self.nbytes -= self._nbytes[key]
+        self._nbytes.pop(key, None)
+        self._fingerprints.pop(key, None)
+        path = self._spill_paths.pop(key, None)
+        if path is not None:
+            os.remove(path)
+
+    def close(self):
+        """Release all the data and remove the temporary spill directory.
+
+        The handler can't spill data after it's closed.
+        """
+        for key in list(self.data) + list(self._spill_paths):
+            self.release(key)
+        if self._owns_spill_dir:
+            rmtree(self.spill_dir, ignore_errors=True)
 
 
 class PickleDataHandler(DataHandler):
+    concurrent_read = True
 
     def __init__(self, pickle_dir):
         mkdir_p(pickle_dir)
@@ -255,6 +1281,9 @@ class PickleDataHandler(DataHandler):
             return True
         return False
 
+    def _get_fingerprint_path(self, key):
+        return os.path.join(self.pickle_dir, key + ".fingerprint")
+
     def get(self, key):
         if isinstance(key, basestring):
             with open(os.path.join(self.pickle_dir, key + ".pkl"), "rb") as fp:
@@ -272,3 +1301,196 @@ class PickleDataHandler(DataHandler):
                              end_in_new_line=False), \
                     open(pickle_path, "wb") as fp:
                 cPickle.dump(val, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+
+    def get_metadata(self, key):
+        metadata = super(PickleDataHandler, self).get_metadata(key)
+        metadata['nbytes'] = os.path.getsize(
+            os.path.join(self.pickle_dir, key + ".pkl"))
+        return metadata
+
+    def get_fingerprint(self, key):
+        fingerprint_path = self._get_fingerprint_path(key)
+        if not os.path.exists(fingerprint_path):
+            return None
+        with open(fingerprint_path) as fp:
+            return fp.read()
+
+    def set_fingerprint(self, key, fingerprint):
+        with open(self._get_fingerprint_path(key), "w") as fp:
+            fp.write(fingerprint)
+
+    def delete(self, key):
+        os.remove(os.path.join(self.pickle_dir, key + ".pkl"))
+        fingerprint_path = self._get_fingerprint_path(key)
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
+
+
+class NumpyDataHandler(DataHandler):
+    """Store each data as ``.npy`` files in a directory.
+
+    The data is memory-mapped when read, so it is read through the page cache
+    without copying. A sparse matrix is stored as a directory ``key.csr`` (or
+    ``key.csc``) with the components ``data.npy``, ``indices.npy``,
+    ``indptr.npy`` and ``shape.npy``.
+
+    Parameters
+    ==========
+    npy_dir: str
+        The directory to store the data.
+    """
+    concurrent_read = True
+
+    def __init__(self, npy_dir):
+        mkdir_p(npy_dir)
+        self.npy_dir = npy_dir
+
+    def _get_dense_path(self, key):
+        return os.path.join(self.npy_dir, key + ".npy")
+
+    def _get_sparse_dir(self, key, sparse_format):
+        return os.path.join(self.npy_dir, key + "." + sparse_format)
+
+    def _get_fingerprint_path(self, key):
+        return os.path.join(self.npy_dir, key + ".fingerprint")
+
+    def _find_sparse_format(self, key):
+        for sparse_format in SPARSE_FORMAT_SET:
+            if os.path.isdir(self._get_sparse_dir(key, sparse_format)):
+                return sparse_format
+        return None
+
+    def can_skip(self, data_key):
+        if (os.path.exists(self._get_dense_path(data_key))
+                or self._find_sparse_format(data_key) is not None):
+            return True
+        return False
+
+    def _get_one(self, key):
+        sparse_format = self._find_sparse_format(key)
+        if sparse_format is None:
+            return np.load(self._get_dense_path(key), mmap_mode='r')
+        sparse_dir = self._get_sparse_dir(key, sparse_format)
+        components = [
+            np.load(os.path.join(sparse_dir, name + ".npy"), mmap_mode='r')
+            for name in ('data', 'indices', 'indptr')]
+        shape = tuple(np.load(os.path.join(sparse_dir, "shape.npy")))
+        matrix_class = (ss.csr_matrix if sparse_format == 'csr'
+                        else ss.csc_matrix)
+        return matrix_class(tuple(components), shape=shape, copy=False)
+
+    def get(self, key):
+        if isinstance(key, basestring):
+            return self._get_one(key)
+        return {k: self._get_one(k) for k in key}
+
+    @staticmethod
+    def _save(path, array):
+        # write to a temporary file first so that a partial file won't be
+        # regarded as generated
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as fp:
+            np.save(fp, array)
+        os.rename(tmp_path, path)
+
+    def _write_sparse(self, key, result):
+        sparse_format = result.format
+        if sparse_format not in SPARSE_FORMAT_SET:
+            raise ValueError("NumpyDataHandler doesn't support sparse format "
+                             "{} (in key {}).".format(sparse_format, key))
+        sparse_dir = self._get_sparse_dir(key, sparse_format)
+        tmp_dir = sparse_dir + ".tmp"
+        mkdir_p(tmp_dir)
+        for name in ('data', 'indices', 'indptr'):
+            self._save(os.path.join(tmp_dir, name + ".npy"),
+                       getattr(result, name))
+        self._save(os.path.join(tmp_dir, "shape.npy"),
+                   np.asarray(result.shape, dtype=np.int64))
+        os.rename(tmp_dir, sparse_dir)
+
+    def write_data(self, result_dict):
+        for key, result in six.viewitems(result_dict):
+            if self.can_skip(key):
+                self.delete(key)
+            key_dir = os.path.dirname(os.path.join(self.npy_dir, key))
+            mkdir_p(key_dir)
+            with SimpleTimer("Writing generated data {} to npy file"
+                             .format(key),
+                             end_in_new_line=False):  # pylint: disable=C0330
+                if ss.isspmatrix(result):
+                    check_h5py_nan(key, result)
+                    self._write_sparse(key, result)
+                    continue
+                if isinstance(result, (pd.DataFrame, pd.Series)):
+                    result = result.values
+                result = np.asarray(result)
+                if result.dtype.hasobject:
+                    raise ValueError("NumpyDataHandler doesn't support object "
+                                     "arrays (in key {}).".format(key))
+                check_h5py_nan(key, result)
+                self._save(self._get_dense_path(key), result)
+
+    def get_metadata(self, key):
+        metadata = super(NumpyDataHandler, self).get_metadata(key)
+        sparse_format = self._find_sparse_format(key)
+        if sparse_format is None:
+            metadata['nbytes'] = os.path.getsize(self._get_dense_path(key))
+        else:
+            sparse_dir = self._get_sparse_dir(key, sparse_format)
+            metadata['nbytes'] = sum(
+                os.path.getsize(os.path.join(sparse_dir, file_name))
+                for file_name in os.listdir(sparse_dir))
+        return metadata
+
+    def get_fingerprint(self, key):
+        fingerprint_path = self._get_fingerprint_path(key)
+        if not os.path.exists(fingerprint_path):
+            return None
+        with open(fingerprint_path) as fp:
+            return fp.read()
+
+    def set_fingerprint(self, key, fingerprint):
+        with open(self._get_fingerprint_path(key), "w") as fp:
+            fp.write(fingerprint)
+
+    def link(self, key, path, new_key):
+        """Map the ``.npy`` files to another HDF5 file as external storage.
+
+        A sparse matrix becomes an h5sparse group of the external datasets.
+        The empty data and the data in Fortran order are copied instead. The
+        files are replaced when the data is regenerated, so the data should be
+        linked again then.
+        """
+        sparse_format = self._find_sparse_format(key)
+        if sparse_format is None:
+            npy_paths = {None: self._get_dense_path(key)}
+        else:
+            sparse_dir = self._get_sparse_dir(key, sparse_format)
+            npy_paths = {name: os.path.join(sparse_dir, name + ".npy")
+                         for name in ('data', 'indices', 'indptr')}
+        arrays = [np.load(npy_path, mmap_mode='r')
+                  for npy_path in six.itervalues(npy_paths)]
+        if any(array.size == 0 or not array.flags['C_CONTIGUOUS']
+               for array in arrays):
+            self.bundle(key, path, new_key)
+            return
+        with h5py.File(path, 'a') as h5f:
+            if sparse_format is None:
+                create_npy_external_dataset(h5f, new_key, npy_paths[None])
+                return
+            group = h5f.create_group(new_key)
+            group.attrs['h5sparse_format'] = sparse_format
+            group.attrs['h5sparse_shape'] = np.load(
+                os.path.join(sparse_dir, "shape.npy"))
+            for name, npy_path in six.iteritems(npy_paths):
+                create_npy_external_dataset(group, name, npy_path)
+
+    def delete(self, key):
+        sparse_format = self._find_sparse_format(key)
+        if sparse_format is None:
+            os.remove(self._get_dense_path(key))
+        else:
+            rmtree(self._get_sparse_dir(key, sparse_format))
+        fingerprint_path = self._get_fingerprint_path(key)
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
@@ -1,3 +1,10 @@
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_CHUNK_ROWS = 65536
+
+
 def get_shape_from_pandas_hdf_storer(storer):
     # TODO: when the data has MultiIndex column and the format is 'fixed', the
     #       shape will be None
@@ -19,36 +26,133 @@ def get_shape_from_pandas_hdf_storer(storer):
 
 
 class PandasHDFDataset(object):
-    """h5py Dataset-like wrapper for pandas HDFStore."""
+    """h5py Dataset-like wrapper for pandas HDFStore.
+
+    It supports the h5py-style indexing of the rows (an int, a slice with or
+    without step, a boolean mask or an integer array), optionally followed by
+    the column index, e.g., ``dataset[mask, :2]``. Only the selected rows are
+    read if the data is in the table format.
 
-    def __init__(self, hdf_store, key):
+    If ``lock`` is given, the store is only accessed with it, so the dataset
+    can be read by several threads while the store is written (PyTables is
+    not thread-safe).
+    """
+
+    def __init__(self, hdf_store, key, lock=None):
         self._hdf_store = hdf_store
-        self._storer = hdf_store.get_storer(key)
+        self._lock = lock
+        self._storer = self._call_store('get_storer', key)
         self.key = key
         self.shape = get_shape_from_pandas_hdf_storer(self._storer)
+        self._dtype = None
+
+    def _call_store(self, method, *args, **kwargs):
+        if self._lock is None:
+            return getattr(self._hdf_store, method)(*args, **kwargs)
+        with self._lock:
+            return getattr(self._hdf_store, method)(*args, **kwargs)
 
     @property
     def value(self):
-        return self._hdf_store[self.key]
+        return self._call_store('get', self.key)
 
     @property
     def dtype(self):
-        return self._hdf_store.select(self.key, start=0, stop=1).values.dtype
+        if self._dtype is None:
+            self._dtype = self.select(start=0, stop=1).values.dtype
+        return self._dtype
+
+    def __len__(self):
+        if self.shape is not None:
+            return self.shape[0]
+        if self._lock is None:
+            return self._storer.nrows
+        with self._lock:
+            return self._storer.nrows
 
     def select(self, *arg, **kwargs):
-        return self._hdf_store.select(self.key, *arg, **kwargs)
+        return self._call_store('select', self.key, *arg, **kwargs)
 
     def select_column(self, *arg, **kwargs):
-        return self._hdf_store.select_column(self.key, *arg, **kwargs)
+        return self._call_store('select_column', self.key, *arg, **kwargs)
 
     def select_as_coordinates(self, *arg, **kwargs):
-        return self._hdf_store.select_as_coordinates(self.key, *arg, **kwargs)
+        return self._call_store('select_as_coordinates', self.key, *arg,
+                                **kwargs)
 
-    def __getitem__(self, key):
-        if isinstance(key, int):
-            return self._hdf_store.select(self.key, start=key, stop=key + 1)
+    def _select_coordinates(self, coordinates):
+        """Select the rows by their integer positions."""
+        if len(coordinates) == 0:
+            return self.select(start=0, stop=0)
+        sorted_coordinates, inverse = np.unique(coordinates,
+                                                return_inverse=True)
+        if self._storer.is_table:
+            result = self.select(where=sorted_coordinates)
+        else:
+            # the fixed format can only be read by a range of rows
+            start = sorted_coordinates[0]
+            result = self.select(start=start,
+                                 stop=sorted_coordinates[-1] + 1)
+            result = result.iloc[sorted_coordinates - start]
+        if (len(sorted_coordinates) == len(coordinates)
+                and (sorted_coordinates == coordinates).all()):
+            return result
+        return result.iloc[inverse]
+
+    def _select_rows(self, key):
+        n_rows = len(self)
+        if isinstance(key, (int, np.integer)):
+            return self._select_int_row(key, n_rows)
         elif isinstance(key, slice):
-            if key.step is None:
-                return self._hdf_store.select(self.key,
-                                              start=key.start, stop=key.stop)
+            return self._select_slice_rows(key, n_rows)
+        key = np.asarray(key)
+        if key.dtype == np.bool_:
+            return self._select_mask_rows(key, n_rows)
+        elif key.ndim == 1 and np.issubdtype(key.dtype, np.integer):
+            return self._select_index_rows(key, n_rows)
         raise NotImplementedError("Key {} is not supported".format(key))
+
+    def _select_int_row(self, key, n_rows):
+        if key < 0:
+            key += n_rows
+        if not 0 <= key < n_rows:
+            raise IndexError("Index {} is out of range for {} rows"
+                             .format(key, n_rows))
+        return self.select(start=key, stop=key + 1)
+
+    def _select_slice_rows(self, key, n_rows):
+        start, stop, step = key.indices(n_rows)
+        if step == 1:
+            return self.select(start=start, stop=max(start, stop))
+        return self._select_coordinates(np.arange(start, stop, step))
+
+    def _select_mask_rows(self, key, n_rows):
+        if key.shape != (n_rows,):
+            raise IndexError("The boolean mask should have shape ({},), "
+                             "got {}".format(n_rows, key.shape))
+        return self._select_coordinates(np.flatnonzero(key))
+
+    def _select_index_rows(self, key, n_rows):
+        key = np.where(key < 0, key + n_rows, key)
+        if len(key) > 0 and (key.min() < 0 or key.max() >= n_rows):
+            raise IndexError("Index out of range for {} rows".format(n_rows))
+        return self._select_coordinates(key)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            if len(key) == 0:
+                return self.value
+            result = self._select_rows(key[0])
+            if len(key) == 1:
+                return result
+            if len(key) > 2 or isinstance(result, pd.Series):
+                raise IndexError("Too many indices for the data")
+            return result.iloc[:, key[1]]
+        return self._select_rows(key)
+
+    def iter_chunks(self, rows=DEFAULT_CHUNK_ROWS, start=0):
+        """Iterate over the data by blocks of ``rows`` rows from ``start``."""
+        n_rows = len(self)
+        for chunk_start in range(start, n_rows, rows):
+            yield self.select(start=chunk_start,
+                              stop=min(chunk_start + rows, n_rows))
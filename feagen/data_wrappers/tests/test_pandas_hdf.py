@@ -3,8 +3,12 @@ from tempfile import mkdtemp
 import unittest
 from shutil import rmtree
 
+import numpy as np
 import pandas as pd
-from feagen.data_wrappers.pandas_hdf import get_shape_from_pandas_hdf_storer
+from feagen.data_wrappers.pandas_hdf import (
+    PandasHDFDataset,
+    get_shape_from_pandas_hdf_storer,
+)
 
 
 class Test(unittest.TestCase):
@@ -113,3 +117,22 @@ class Test(unittest.TestCase):
         shape = get_shape_from_pandas_hdf_storer(
             self.hdf_store.get_storer('test'))
         assert shape == (6,)
+
+    def test_pandas_hdf_dataset_indexing(self):
+        df = pd.DataFrame(np.arange(30.).reshape(10, 3), columns=list('abc'))
+        self.hdf_store.put('table', df, format='table')
+        self.hdf_store.put('fixed', df)
+        mask = df['a'].values > 10
+        for key in ('table', 'fixed'):
+            dataset = PandasHDFDataset(self.hdf_store, key)
+            assert dataset.dtype == np.float64
+            assert len(dataset) == 10
+            assert dataset[-1].equals(df.iloc[[9]])
+            assert dataset[1:8:3].equals(df.iloc[1:8:3])
+            assert dataset[::-2].equals(df.iloc[::-2])
+            assert dataset[mask].equals(df[mask])
+            assert dataset[[7, 1, 1]].equals(df.iloc[[7, 1, 1]])
+            assert dataset[mask, :2].equals(df[mask].iloc[:, :2])
+            chunks = list(dataset.iter_chunks(4, start=2))
+            assert [chunk.shape[0] for chunk in chunks] == [4, 4]
+            assert pd.concat(chunks).equals(df.iloc[2:])
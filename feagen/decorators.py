@@ -1,21 +1,45 @@
 from past.builtins import basestring
 
 
-def require(data_keys):
+SELECT_ARG_SET = frozenset(['columns', 'where', 'start', 'stop'])
+
+
+def require(data_keys, **select_kwargs):
+    """The decorator that represents what data keys are required.
+
+    Parameters
+    ==========
+    select_kwargs:
+        Only read part of the required data, e.g.,
+        ``require('data_df', columns=['weight'], where='weight > 50')``.
+        The supported arguments are ``columns``, ``where``, ``start`` and
+        ``stop``, which are passed to the ``select`` method of the data
+        handler, so the node function gets the selected data instead of the
+        dataset. ``columns`` and ``where`` are only supported by the
+        'pandas_hdf' handler (``where`` needs the table format).
+    """
     if isinstance(data_keys, basestring):
         data_keys = (data_keys,)
+    unknown_arg_set = set(select_kwargs) - SELECT_ARG_SET
+    if len(unknown_arg_set) > 0:
+        raise ValueError("require() got unknown arguments {}."
+                         .format(sorted(unknown_arg_set)))
 
     def require_decorator(func):
         # pylint: disable=protected-access
         if not hasattr(func, '_feagen_require'):
             func._feagen_require = []
+            func._feagen_require_select = {}
         func._feagen_require.extend(data_keys)
+        if len(select_kwargs) > 0:
+            func._feagen_require_select.update(
+                (data_key, select_kwargs) for data_key in data_keys)
         return func
     return require_decorator
 
 
-def will_generate(data_handler, will_generate_keys, mode=None,
-                  **handler_kwargs):
+def will_generate(data_handler, will_generate_keys, mode=None, stream=False,
+                  incremental=False, batch=False, **handler_kwargs):
     """The decorator that represents what data keys will be generated.
 
     Parameters
@@ -30,6 +54,32 @@ def will_generate(data_handler, will_generate_keys, mode=None,
         None:
             if ``will_generate_keys`` is a string, then the mode is 'one',
             'full' otherwise.
+    stream: bool
+        If True, the node function should be a generator that yields blocks
+        of rows instead of returning the whole data. In 'one' mode, each block
+        is the data of the key; in 'full' mode, each block is a dict like the
+        return value. The blocks are appended to the data handler one by one,
+        so the whole data doesn't need to fit in memory.
+    incremental: bool
+        If True, the node function should accept an argument ``row_start``
+        and only generate the rows starting from it. When generating with
+        ``incremental=True``, the new rows are appended to the existing data
+        instead of regenerating all the rows. ``row_start`` is 0 if the data
+        doesn't exist. The required data should be in memory or incremental
+        too, so that it has the new rows.
+    batch: bool
+        Only for mode='one'. If True, all the keys of this node that are ready
+        to be generated are generated in one function call. The node function
+        gets ``will_generate_keys`` (a list of keys), ``re_args`` (a dict
+        mapping each key to its regex arguments), and ``data`` indexed by the
+        actual upstream keys instead of the templates, so the upstream data
+        shared by several keys is given only once. It should return a dict
+        like mode='full'.
+    handler_kwargs:
+        The options of the data handler, e.g., ``manually_create_dataset``,
+        or ``chunks``, ``compression``, ``compression_opts`` and ``shuffle``
+        of ``H5pyDataHandler``, or ``persist`` of ``MemoryDataHandler`` to
+        keep the data in the cache directory across runs.
     """
     if isinstance(will_generate_keys, basestring):
         if mode == 'full':
@@ -39,6 +89,9 @@ def will_generate(data_handler, will_generate_keys, mode=None,
         mode = 'one'
     elif mode is None:
         mode = 'full'
+    if batch and (mode != 'one' or stream or incremental):
+        raise ValueError("batch=True only supports mode='one' without stream "
+                         "and incremental.")
 
     def will_generate_decorator(func):
         # pylint: disable=protected-access
@@ -50,6 +103,9 @@ def will_generate(data_handler, will_generate_keys, mode=None,
             'handler': data_handler,
             'keys': will_generate_keys,
             'handler_kwargs': handler_kwargs,
+            'stream': stream,
+            'incremental': incremental,
+            'batch': batch,
         }
         return func
     return will_generate_decorator
@@ -0,0 +1,150 @@
+"""Backends that run the node functions concurrently for ``generate``.
+
+Every backend only runs the node function. The results are sent back to the
+scheduler in the main thread, which is the only one writing to the handlers.
+"""
+import sys
+import threading
+import traceback
+import multiprocessing
+
+import six
+from six.moves import queue
+
+
+try:
+    _mp = multiprocessing.get_context('fork')
+except (AttributeError, ValueError):
+    _mp = multiprocessing
+
+
+class ThreadTask(object):
+    """Run a function in a daemon thread."""
+
+    def __init__(self, task_id, function, kwargs, result_queue):
+        self.task_id = task_id
+        self._thread = threading.Thread(
+            target=self._run, args=(function, kwargs, result_queue))
+        self._thread.daemon = True
+
+    def _run(self, function, kwargs, result_queue):
+        try:
+            result = function(**kwargs)
+        except Exception:  # pylint: disable=broad-except
+            result_queue.put((self.task_id, False, sys.exc_info()))
+        else:
+            result_queue.put((self.task_id, True, result))
+
+    def start(self):
+        self._thread.start()
+
+    def terminate(self):
+        # threads cannot be killed, so we just leave the daemon thread alone
+        pass
+
+
+def _process_target(send_conn, function, kwargs):
+    try:
+        result = function(**kwargs)
+    except Exception:  # pylint: disable=broad-except
+        send_conn.send((False, traceback.format_exc()))
+    else:
+        send_conn.send((True, result))
+    send_conn.close()
+
+
+class ProcessTask(object):
+    """Run a function in a forked process.
+
+    The process is forked when the task starts, so it can read all the data
+    that has been written before. The result is pickled back to the parent.
+    """
+
+    def __init__(self, task_id, function, kwargs, result_queue):
+        self.task_id = task_id
+        self._function = function
+        self._kwargs = kwargs
+        self._result_queue = result_queue
+        self._process = None
+
+    def _wait(self, recv_conn):
+        try:
+            success, payload = recv_conn.recv()
+        except EOFError:
+            self._process.join()
+            success, payload = False, (
+                "The worker process exited with code {}."
+                .format(self._process.exitcode))
+        else:
+            self._process.join()
+        recv_conn.close()
+        if not success:
+            payload = (RuntimeError, RuntimeError(payload), None)
+        self._result_queue.put((self.task_id, success, payload))
+
+    def start(self):
+        recv_conn, send_conn = _mp.Pipe(duplex=False)
+        # fork in the calling thread so the child doesn't inherit locks held
+        # by other threads
+        self._process = _mp.Process(
+            target=_process_target,
+            args=(send_conn, self._function, self._kwargs))
+        self._process.start()
+        send_conn.close()
+        # drop the references so that the upstream data can be released
+        self._function = self._kwargs = None
+        waiter = threading.Thread(target=self._wait, args=(recv_conn,))
+        waiter.daemon = True
+        waiter.start()
+
+    def terminate(self):
+        if self._process is not None and self._process.is_alive():
+            self._process.terminate()
+
+
+BACKENDS = {
+    'thread': ThreadTask,
+    'process': ProcessTask,
+}
+
+
+class TaskRunner(object):
+    """Run at most ``n_jobs`` tasks at the same time using ``backend``."""
+
+    def __init__(self, n_jobs, backend='thread'):
+        if n_jobs < 1:
+            raise ValueError("n_jobs should be a positive integer, got {}."
+                             .format(n_jobs))
+        if backend not in BACKENDS:
+            raise ValueError("Backend '{}' is not supported. Supported "
+                             "backends: {}.".format(backend, sorted(BACKENDS)))
+        self.n_jobs = n_jobs
+        self._task_class = BACKENDS[backend]
+        self._result_queue = queue.Queue()
+        self._running_tasks = {}
+
+    @property
+    def n_running(self):
+        return len(self._running_tasks)
+
+    def is_full(self):
+        return len(self._running_tasks) >= self.n_jobs
+
+    def submit(self, task_id, function, kwargs):
+        task = self._task_class(task_id, function, kwargs, self._result_queue)
+        self._running_tasks[task_id] = task
+        task.start()
+
+    def wait_one(self):
+        """Wait for any running task and return ``(task_id, result)``."""
+        task_id, success, payload = self._result_queue.get()
+        del self._running_tasks[task_id]
+        if not success:
+            self.terminate()
+            six.reraise(*payload)
+        return task_id, payload
+
+    def terminate(self):
+        for task in six.itervalues(self._running_tasks):
+            task.terminate()
+        self._running_tasks = {}
@@ -0,0 +1,223 @@
+"""Record the resource usage of the generation and bundling steps.
+
+The report can be written as JSON or as a Chrome trace, which can be opened
+by ``chrome://tracing`` or https://ui.perfetto.dev.
+"""
+from __future__ import division
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# the phases of a node, in the order they are run
+NODE_PHASES = ('fetch', 'compute', 'validate', 'write')
+USAGE_NAMES = ('wall', 'cpu', 'max_rss', 'read_bytes', 'write_bytes')
+
+
+def _get_cpu_time():
+    """Return the CPU time of this thread (or of the process if unknown)."""
+    if hasattr(time, 'thread_time'):
+        return time.thread_time()
+    if resource is not None:
+        rusage = resource.getrusage(resource.RUSAGE_SELF)
+        return rusage.ru_utime + rusage.ru_stime
+    return None
+
+
+def _get_max_rss():
+    """Return the peak resident set size of the process in bytes."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss
+    return max_rss * 1024
+
+
+def _get_io_bytes():
+    """Return the bytes read and written by this thread (or by the process if
+    unknown) through the system calls, or None on the non-Linux systems."""
+    for io_path in ("/proc/thread-self/io", "/proc/self/io"):
+        try:
+            with open(io_path) as fp:
+                counters = dict(line.split(": ") for line in fp)
+        except (IOError, OSError):
+            continue
+        return int(counters['rchar']), int(counters['wchar'])
+    return None, None
+
+
+def get_resource_usage():
+    """Return the current wall time, CPU time, peak RSS and I/O counters."""
+    read_bytes, write_bytes = _get_io_bytes()
+    return {
+        'wall': time.time(),
+        'cpu': _get_cpu_time(),
+        'max_rss': _get_max_rss(),
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+    }
+
+
+def diff_resource_usage(start_usage, end_usage=None):
+    """Return the usage between two ``get_resource_usage`` calls.
+
+    The usage includes the start time, the process and thread IDs, and the
+    increase of the peak RSS as ``max_rss_delta``.
+    """
+    if end_usage is None:
+        end_usage = get_resource_usage()
+    usage = {
+        'start': start_usage['wall'],
+        'pid': os.getpid(),
+        'tid': threading.current_thread().ident,
+    }
+    for name in USAGE_NAMES:
+        usage_name = 'max_rss_delta' if name == 'max_rss' else name
+        if start_usage[name] is None or end_usage[name] is None:
+            usage[usage_name] = None
+        else:
+            usage[usage_name] = end_usage[name] - start_usage[name]
+    return usage
+
+
+class Profiler(object):
+    """Record the spans of the generation and bundling steps.
+
+    A span records the wall time, the CPU time of the thread, the increase
+    of the peak RSS of the process, and the bytes read and written by the
+    thread (on Linux) of a phase:
+
+    - ``fetch``: removing the outdated data and getting the upstream data,
+      with a ``read`` span for each handler. The data in HDF5 is read lazily,
+      so most of its reading may be counted in ``compute``.
+    - ``compute``: running the node function, in the worker thread or process.
+    - ``validate``: checking the returned data.
+    - ``write``: writing the data and the fingerprints. The functions with
+      ``stream=True`` run their computation and validation here.
+    - ``bundle``: bundling a dataset.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_span(self, name, phase, usage, **args):
+        """Add a span measured by ``diff_resource_usage``."""
+        span = dict(usage, name=name, phase=phase, args=args)
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def profile(self, name, phase, **args):
+        """Record the usage in the context as a span.
+
+        The name of the enclosing span in the same thread is recorded as
+        ``parent`` in ``args``.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        if len(stack) > 0:
+            args.setdefault('parent', stack[-1])
+        stack.append(name)
+        start_usage = get_resource_usage()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.add_span(name, phase, diff_resource_usage(start_usage),
+                          **args)
+
+    def get_report(self):
+        """Summarize the spans by node and by bundled dataset."""
+
+        def _add_usage(total, span):
+            for name in ('wall', 'cpu', 'read_bytes', 'write_bytes'):
+                if span[name] is not None:
+                    total[name] = total.get(name, 0) + span[name]
+            if span['max_rss_delta'] is not None:
+                total['max_rss_delta'] = max(total.get('max_rss_delta', 0),
+                                             span['max_rss_delta'])
+
+        nodes = {}
+        bundle = {}
+        phases = {}
+        for span in self.spans:
+            if span['phase'] == 'read':
+                node_report = nodes.setdefault(span['args']['parent'], {})
+                read_bytes = node_report.setdefault('read_bytes_by_handler',
+                                                    {})
+                read_bytes[span['name']] = (read_bytes.get(span['name'], 0)
+                                            + (span['read_bytes'] or 0))
+                continue
+            if span['phase'] == 'bundle':
+                _add_usage(bundle.setdefault(span['name'], {}), span)
+            else:
+                node_report = nodes.setdefault(span['name'], {})
+                _add_usage(node_report.setdefault(span['phase'], {}), span)
+                _add_usage(node_report.setdefault('total', {}), span)
+            _add_usage(phases.setdefault(span['phase'], {}), span)
+        if len(self.spans) > 0:
+            start = min(span['start'] for span in self.spans)
+            end = max(span['start'] + span['wall'] for span in self.spans)
+        else:
+            start = end = None
+        return {
+            'start': start,
+            'wall': None if start is None else end - start,
+            'phases': phases,
+            'nodes': nodes,
+            'bundle': bundle,
+            'spans': self.spans,
+        }
+
+    def get_chrome_trace(self):
+        """Return the spans in the Chrome trace event format."""
+        events = []
+        if len(self.spans) > 0:
+            start = min(span['start'] for span in self.spans)
+        for span in self.spans:
+            args = dict(span['args'])
+            args.update((name, span[name])
+                        for name in ('cpu', 'max_rss_delta', 'read_bytes',
+                                     'write_bytes'))
+            events.append({
+                'name': span['name'],
+                'cat': span['phase'],
+                'ph': 'X',
+                'ts': (span['start'] - start) * 1e6,
+                'dur': span['wall'] * 1e6,
+                'pid': span['pid'],
+                'tid': span['tid'],
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_report(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.get_report(), fp, indent=2, sort_keys=True)
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.get_chrome_trace(), fp)
+
+
+@contextmanager
+def profile(profiler, name, phase, **args):
+    """``Profiler.profile`` that does nothing if ``profiler`` is None."""
+    if profiler is None:
+        yield
+        return
+    with profiler.profile(name, phase, **args):
+        yield
+
@@ -8,6 +8,7 @@ from feagen.decorators import (
 )
 import numpy as np
 import pandas as pd
+import six
 from scipy.sparse import csr_matrix
 from sklearn.model_selection import train_test_split
 
@@ -77,7 +78,25 @@ id,lifetime,tested_age,weight,height,gender,income
         append_functions[will_generate_key](df.iloc[3:])
 
     @require('data_df')
-    @will_generate('h5py', 'BMI')
+    @will_generate('h5py', 'stream_weight', stream=True, chunks=2,
+                   compression='gzip', shuffle=True)
+    def gen_stream_weight(self, data, will_generate_key):
+        weight = data['data_df']['weight'].values
+        for start in range(0, len(weight), 4):
+            yield weight[start:start + 4]
+
+    @require('data_df')
+    @will_generate('pandas_hdf', ['pd_stream_weight', 'pd_stream_height'],
+                   stream=True)
+    def gen_stream_raw_data_df(self, data):
+        data_df = data['data_df']
+        for start in range(0, data_df.shape[0], 4):
+            block_df = data_df.iloc[start:start + 4]
+            yield {'pd_stream_weight': block_df['weight'],
+                   'pd_stream_height': block_df['height']}
+
+    @require('data_df')
+    @will_generate('h5py', 'BMI', compression='lzf')
     def gen_bmi(self, data, will_generate_key):
         data_df = data['data_df']
         bmi = data_df['weight'] / ((data_df['height'] / 100) ** 2)
@@ -90,6 +109,15 @@ id,lifetime,tested_age,weight,height,gender,income
         division_result = data['{dividend}'].value / data['{divisor}'].value
         return division_result
 
+    @require(('{multiplicand}', '{multiplier}'))
+    @will_generate('h5py', r'(?P<multiplicand>\w+)_times_(?P<multiplier>\w+)',
+                   batch=True)
+    def gen_times(self, will_generate_keys, data, re_args):
+        values = {key: dset.value for key, dset in six.iteritems(data)}
+        return {key: (values[re_args[key]['multiplicand']]
+                      * values[re_args[key]['multiplier']])
+                for key in will_generate_keys}
+
     @require('data_df')
     @will_generate('pickle', 'train_test_split')
     def gen_train_test_split(self, data, will_generate_key):
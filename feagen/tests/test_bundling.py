@@ -0,0 +1,50 @@
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+
+import h5py
+import h5sparse
+import numpy as np
+import scipy.sparse as ss
+
+from feagen.bundling import BundleLoader
+
+
+def test_bundle_loader():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+    n_rows = 23
+    with h5py.File(data_bundle_hdf_path, 'w') as h5f:
+        h5f.create_dataset('label', data=np.arange(n_rows))
+        h5f.create_dataset('features',
+                           data=np.arange(n_rows * 2.).reshape(n_rows, 2),
+                           chunks=(4, 2))
+        h5sparse.Group(h5f).create_dataset(
+            'one_hot', data=ss.eye(n_rows, format='csr'))
+
+    loader = BundleLoader(data_bundle_hdf_path, 'label', batch_size=5)
+    assert loader.chunk_rows == 1024
+    assert len(loader) == 5
+    assert ([list(batch) for batch in loader]
+            == [list(range(i, min(i + 5, n_rows)))
+                for i in range(0, n_rows, 5)])
+
+    loader = BundleLoader(data_bundle_hdf_path,
+                          ['label', 'features', 'one_hot'], batch_size=5,
+                          shuffle=True, shuffle_buffer_chunks=2,
+                          drop_last=True, random_state=0)
+    assert loader.chunk_rows == 4
+    labels = []
+    for label, features, one_hot in loader:
+        assert len(label) == 5
+        assert (features[:, 0] == label * 2).all()
+        assert (one_hot.toarray() == np.eye(n_rows)[label]).all()
+        labels.extend(label)
+    assert len(labels) == 20
+    assert len(set(labels)) == 20
+    assert labels != sorted(labels)
+
+    # stop in the middle
+    for _ in loader:
+        break
+    rmtree(test_output_dir)
@@ -0,0 +1,58 @@
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+import threading
+import time
+
+from six import StringIO
+
+from feagen.tools.daemon import FeagenDaemon, send_job
+
+
+def test_daemon():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    socket_path = join(test_output_dir, "feagen.sock")
+    global_config = {
+        'generator_class': 'feagen.tests.lifetime_feature_generator'
+                           '.LifetimeFeatureGenerator',
+        'data_bundles_dir': join(test_output_dir, "data_bundles"),
+        'generator_kwargs': {
+            'h5py_hdf_path': join(test_output_dir, "h5py.h5"),
+            'pandas_hdf_path': join(test_output_dir, "pandas.h5"),
+            'pickle_dir': join(test_output_dir, "pickle"),
+        },
+    }
+    daemon = FeagenDaemon(global_config)
+    server_thread = threading.Thread(target=daemon.serve,
+                                     args=(socket_path,))
+    server_thread.start()
+    while daemon.server is None:
+        time.sleep(0.01)
+
+    def _run(structure):
+        output = StringIO()
+        send_job(socket_path, {
+            'global_config': global_config,
+            'bundle_config': {'name': 'default', 'structure': structure,
+                              'structure_config': {}},
+        }, output)
+        return output.getvalue()
+
+    try:
+        output = _run({'label': 'lifetime'})
+        assert "gen_data_df" in output
+        # the memory data is kept for the next jobs
+        output = _run({'label': 'lifetime', 'weight': 'weight'})
+        assert "gen_data_df" not in output
+        assert "gen_raw_data_features" in output
+        try:
+            _run({'label': 'unknown_key'})
+        except RuntimeError as e:
+            assert "KeyError" in str(e)
+        else:
+            raise AssertionError("The failed job doesn't raise RuntimeError.")
+    finally:
+        send_job(socket_path, {'command': 'shutdown'})
+        server_thread.join()
+    daemon.data_generator.get_handler('pd_raw_data').hdf_store.close()
+    rmtree(test_output_dir)
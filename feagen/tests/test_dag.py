@@ -0,0 +1,118 @@
+from os.path import exists, join
+from tempfile import mkdtemp
+from shutil import rmtree
+from unittest import SkipTest
+
+from feagen.dag import RegexDiGraph, _get_node_label
+
+from .lifetime_feature_generator import LifetimeFeatureGenerator
+
+
+def test_node_label():
+    # the attributes of agraph are str, and "" if only set on other nodes
+    assert _get_node_label({'__name__': 'generate', 'skipped': "False",
+                            'estimated_duration': "",
+                            'estimated_nbytes': ""}) == "generate"
+    assert _get_node_label({'__name__': 'gen_bmi', 'skipped': "False",
+                            'estimated_duration': "None",
+                            'estimated_nbytes': "None"}) == "gen_bmi"
+    assert _get_node_label({'__name__': 'gen_bmi', 'skipped': "False",
+                            'estimated_duration': "90.0",
+                            'estimated_nbytes': "2048"}) == (
+                                "gen_bmi\n~1m30s 2.0KB")
+    assert _get_node_label({'__name__': 'gen_bmi', 'skipped': "True",
+                            'estimated_duration': "",
+                            'estimated_nbytes': ""}) == "gen_bmi (skipped)"
+
+
+def test_draw_involved_dag():
+    try:
+        import pygraphviz  # pylint: disable=unused-variable
+    except ImportError:
+        raise SkipTest("pygraphviz is not installed")
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator_kwargs = {
+        'h5py_hdf_path': join(test_output_dir, "h5py.h5"),
+        'pandas_hdf_path': join(test_output_dir, "pandas.h5"),
+        'pickle_dir': join(test_output_dir, "pickle"),
+        'catalog_path': join(test_output_dir, "catalog.sqlite"),
+    }
+    generator = LifetimeFeatureGenerator(**generator_kwargs)
+    generator.generate(['weight'])
+    # the estimates of the nodes that have run and the unknown ones
+    dag_path = join(test_output_dir, "dag.png")
+    generator.draw_involved_dag(dag_path, ['weight', 'BMI'])
+    assert exists(dag_path)
+    generator.get_handler('pd_raw_data').hdf_store.close()
+    generator._catalog.close()
+    rmtree(test_output_dir)
+
+
+def _assert_matches_multiple_keys(dag, key):
+    try:
+        dag.match_node(key)
+    except ValueError as e:
+        assert "matches multiple keys" in str(e)
+    else:
+        raise AssertionError("The multiple matches of {} are not detected."
+                             .format(key))
+
+
+def test_match_literal_and_regex_keys():
+    dag = RegexDiGraph()
+    dag.add_node('literal', keys='data_1')
+    dag.add_node('regex', keys=r'data_(?P<i>\d+)')
+    _assert_matches_multiple_keys(dag, 'data_1')
+    regex_key, node, match_object = dag.match_node('data_2')
+    assert node == 'regex'
+    assert match_object.groupdict() == {'i': '2'}
+
+
+def test_match_two_regex_keys():
+    dag = RegexDiGraph()
+    dag.add_node('digits', keys=r'data_\d+')
+    dag.add_node('words', keys=r'data_\w+')
+    _assert_matches_multiple_keys(dag, 'data_1')
+    assert dag.match_node('data_a')[1] == 'words'
+
+
+def test_match_re_escape_keys():
+    dag = RegexDiGraph()
+    dag.add_node('escaped', re_escape_keys='data.(1)')
+    regex_key, node, match_object = dag.match_node('data.(1)')
+    assert node == 'escaped'
+    assert match_object.group(0) == 'data.(1)'
+    for key in ('data_1', 'data.1', 'data.(1)x'):
+        try:
+            dag.match_node(key)
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("{} matches the escaped key.".format(key))
+
+
+def test_match_unknown_key():
+    dag = RegexDiGraph()
+    dag.add_node('literal', keys='data')
+    try:
+        dag.match_node('unknown')
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("The unknown key is matched.")
+
+
+def test_match_cache_invalidated():
+    dag = RegexDiGraph()
+    dag.add_node('literal', keys='data')
+    try:
+        dag.match_node('new_data')
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("The unknown key is matched.")
+    assert dag.match_node('data')[1] == 'literal'
+    dag.add_node('new', keys='new_data')
+    assert dag.match_node('new_data')[1] == 'new'
+    dag.add_node('regex', keys=r'\w+')
+    _assert_matches_multiple_keys(dag, 'data')
@@ -0,0 +1,171 @@
+from os import listdir
+from os.path import exists, join
+from tempfile import mkdtemp
+from shutil import rmtree
+import threading
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+from feagen.data_handlers import (
+    BoundedMemoryDataHandler,
+    H5pyDataHandler,
+    MemoryDataHandler,
+    NumpyDataHandler,
+    PandasHDFDataHandler,
+)
+
+
+def test_bounded_memory_data_handler():
+    spill_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = BoundedMemoryDataHandler(max_bytes=1000, spill_dir=spill_dir)
+    arr = np.arange(100, dtype=np.float64)  # 800 bytes
+    df = pd.DataFrame({'a': np.arange(50)}, index=np.arange(50))
+    handler.write_data({'arr': arr, 'df': df})
+    assert list(handler.data) == ['df']
+    assert handler.nbytes <= 1000
+    assert len(listdir(spill_dir)) == 1
+    assert handler.can_skip('arr')
+
+    # reload the spilled array and evict the least recently used data frame
+    assert (handler.get('arr') == arr).all()
+    assert list(handler.data) == ['arr']
+    pd.testing.assert_frame_equal(handler.get({'df'})['df'], df)
+    assert len(listdir(spill_dir)) == 2
+
+    handler.release('arr')
+    handler.release('df')
+    assert not handler.can_skip('arr')
+    assert handler.nbytes == 0
+    assert listdir(spill_dir) == []
+    rmtree(spill_dir)
+
+    # the temporary spill directory is removed by close
+    handler = BoundedMemoryDataHandler(max_bytes=1000)
+    handler.write_data({'arr': arr, 'arr2': arr})
+    assert len(listdir(handler.spill_dir)) == 1
+    handler.close()
+    assert not exists(handler.spill_dir)
+
+
+def test_persisted_memory_data():
+    cache_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = MemoryDataHandler(cache_dir)
+    df = pd.DataFrame({'a': np.arange(50), 'b': np.arange(50) * 0.5,
+                       'c': ["x"] * 50})
+    arr = np.arange(10)
+    handler.write_data({'df': df, 'arr': arr}, persist=True)
+    handler.write_data({'tmp': arr})
+    for key in ('df', 'arr', 'tmp'):
+        handler.set_fingerprint(key, "fingerprint")
+    assert sorted(listdir(cache_dir)) == [
+        'arr.fingerprint', 'arr.npy', 'df.fingerprint', 'df.pkl']
+
+    # a new process only has the persisted data
+    handler = MemoryDataHandler(cache_dir)
+    assert handler.can_skip('df') and handler.can_skip('arr')
+    assert not handler.can_skip('tmp')
+    try:
+        handler.get('tmp')
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("KeyError is not raised for the missing data.")
+    assert handler.get_fingerprint('df') == "fingerprint"
+    pd.testing.assert_frame_equal(handler.get('df'), df)
+    assert (handler.get('arr') == arr).all()
+    handler.release('df')
+    assert handler.can_skip('df')
+    handler.delete('df')
+    assert not handler.can_skip('df')
+    assert sorted(listdir(cache_dir)) == ['arr.fingerprint', 'arr.npy']
+    rmtree(cache_dir)
+
+
+def test_h5py_dataset_options():
+    output_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = H5pyDataHandler(join(output_dir, "h5py.h5"), compression='gzip')
+    arr = np.arange(400000, dtype=np.float64).reshape(-1, 4)
+    sparse = ss.random(100, 20, density=0.1, format='csr')
+    handler.write_data({'default': arr, 'sparse': sparse})
+    handler.write_data({'rows': arr, 'contiguous': arr[:10]}, chunks=1000,
+                       compression='lzf')
+    h5f = handler.h5f
+    # 'auto' chunks of about 1 MiB with whole rows
+    assert h5f['default'].chunks == (32768, 4)
+    assert h5f['default'].compression == 'gzip'
+    assert h5f['rows'].chunks == (1000, 4)
+    assert h5f['rows'].compression == 'lzf'
+    assert h5f['contiguous'].chunks == (10, 4)
+    assert h5f['sparse/indptr'].compression == 'gzip'
+    assert (handler.get('sparse')[:] != sparse).nnz == 0
+    h5f.close()
+    rmtree(output_dir)
+
+
+def test_pandas_hdf_write_options():
+    output_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = PandasHDFDataHandler(join(output_dir, "pandas.h5"))
+    series = pd.Series(np.arange(10, dtype=np.float64))
+    df = pd.DataFrame(np.random.rand(10, 3), columns=['a', 'b', 'c'])
+    handler.write_data({'series': series, 'df': df})
+    handler.write_data({'queried': df}, data_columns=['a'])
+    handler.write_data({'fixed': df}, format='fixed')
+    hdf_store = handler.hdf_store
+    assert not hdf_store.get_storer('series').is_table
+    assert hdf_store.get_storer('df').is_table
+    assert not hdf_store.get_storer('fixed').is_table
+    pd.testing.assert_frame_equal(
+        hdf_store.select('queried', where='a > 0.5'), df[df['a'] > 0.5])
+
+    # the index is created after the generation
+    table = hdf_store.get_storer('df').table
+    assert not table.colindexed['index']
+    handler.flush()
+    assert table.colindexed['index']
+    hdf_store.close()
+    rmtree(output_dir)
+
+
+def test_numpy_data_handler():
+    npy_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = NumpyDataHandler(npy_dir)
+    arr = np.arange(12, dtype=np.float32).reshape(4, 3)
+    sparse = ss.random(5, 4, density=0.5, format='csr')
+    handler.write_data({'arr': arr, 'sparse': sparse})
+    assert handler.can_skip('arr') and handler.can_skip('sparse')
+
+    loaded_arr = handler.get('arr')
+    assert isinstance(loaded_arr, np.memmap)
+    assert (loaded_arr == arr).all()
+    loaded_sparse = handler.get({'sparse'})['sparse']
+    assert loaded_sparse.format == 'csr'
+    assert (loaded_sparse != sparse).nnz == 0
+    assert handler.get_n_rows('sparse') == 5
+
+    handler.set_fingerprint('arr', 'fingerprint')
+    assert handler.get_fingerprint('arr') == 'fingerprint'
+    handler.delete('arr')
+    handler.delete('sparse')
+    assert not handler.can_skip('arr') and not handler.can_skip('sparse')
+    assert handler.get_fingerprint('arr') is None
+    rmtree(npy_dir)
+
+
+def test_pandas_hdf_lock():
+    output_dir = mkdtemp(prefix="feagen_test_output_")
+    handler = PandasHDFDataHandler(join(output_dir, "pandas.h5"))
+    df = pd.DataFrame({'a': np.arange(10)})
+    handler.write_data({'df': df})
+    dataset = handler.get('df')
+    results = []
+    # the dataset can't be read while the store is used by another thread
+    with handler.lock:
+        thread = threading.Thread(target=lambda: results.append(dataset[:2]))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive() and results == []
+    thread.join()
+    assert list(results[0]['a']) == [0, 1]
+    handler.hdf_store.close()
+    rmtree(output_dir)
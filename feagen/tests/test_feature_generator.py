@@ -1,12 +1,26 @@
+import json
+import os
 from os.path import join
 from tempfile import mkdtemp
 from shutil import rmtree
 
 import h5py
+import h5sparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+import feagen as fg
+from feagen import data_generator
+from feagen.bundling import get_data_keys_from_structure
+from feagen.cost_model import format_explanation
+from feagen.decorators import require, will_generate
+from feagen.profiler import Profiler
 from feagen.tools.feagen_runner import feagen_run_with_configs
 
+from .lifetime_feature_generator import LifetimeFeatureGenerator
 
-def test_generate_lifetime_features():
+
+def _generate_lifetime_features(**run_kwargs):
     test_output_dir = mkdtemp(prefix="feagen_test_output_")
     h5py_hdf_path = join(test_output_dir, "h5py.h5")
     pandas_hdf_path = join(test_output_dir, "pandas.h5")
@@ -40,6 +54,12 @@ def test_generate_lifetime_features():
                     'pd_height',
                     'pd_raw_data',
                     'pd_raw_data_append',
+                    'stream_weight',
+                    'pd_stream_weight',
+                    'pd_stream_height',
+                    'weight_times_height',
+                    'height_times_weight',
+                    'BMI_times_weight',
                 ],
             },
             'features': [
@@ -61,7 +81,7 @@ def test_generate_lifetime_features():
         }
     }
 
-    feagen_run_with_configs(global_config, bundle_config)
+    feagen_run_with_configs(global_config, bundle_config, **run_kwargs)
 
     data_bundle_hdf_path = join(data_bundles_dir, bundle_config['name'] + '.h5')
     with h5py.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
@@ -72,5 +92,728 @@ def test_generate_lifetime_features():
         assert (set(data_bundle_h5f['test_dict/comparison'])
                 == set(bundle_config['structure']['test_dict']['comparison']))
         assert data_bundle_h5f['features'].shape == (6, 12)
+        assert (data_bundle_h5f['test_dict/comparison/stream_weight'][...]
+                == data_bundle_h5f['test_dict/comparison/weight'][...]).all()
+        comparison = data_bundle_h5f['test_dict/comparison']
+        assert np.allclose(comparison['weight_times_height'][...],
+                           comparison['weight'][...]
+                           * comparison['height'][...])
+        assert np.allclose(comparison['height_times_weight'][...],
+                           comparison['weight_times_height'][...])
+
+    rmtree(test_output_dir)
+
+
+def test_generate_lifetime_features():
+    _generate_lifetime_features()
+
+
+def test_generate_lifetime_features_in_threads():
+    _generate_lifetime_features(n_jobs=3, backend='thread')
+
+
+def test_generate_lifetime_features_in_processes():
+    _generate_lifetime_features(n_jobs=3, backend='process')
+
+
+def test_release_memory():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = LifetimeFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"),
+        pickle_dir=join(test_output_dir, "pickle"))
+    memory_handler = generator.get_handler('data_df')
+
+    generator.generate(['BMI', 'mem_raw_data'], release_memory=False)
+    assert set(memory_handler.data) == {'data_df', 'mem_raw_data'}
+
+    memory_handler.data.clear()
+    generator.generate(['BMI', 'weight', 'mem_raw_data'])
+    assert set(memory_handler.data) == {'mem_raw_data'}
+
+    generator.get_handler('pd_raw_data').hdf_store.close()
+    rmtree(test_output_dir)
+
+
+class EmptyStreamFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('h5py', 'empty', stream=True)
+    def gen_empty(self, will_generate_key):
+        return iter(())
+
+
+def test_empty_stream():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = EmptyStreamFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"))
+    try:
+        generator.generate(['empty'])
+    except ValueError as e:
+        assert "gen_empty" in str(e)
+    else:
+        raise AssertionError("The empty stream is not detected.")
+    assert not generator.get_handler('empty').can_skip('empty')
+    generator.get_handler('empty').h5f.close()
+    rmtree(test_output_dir)
+
+
+class IncrementalMemoryFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('memory', 'incremental_mem', incremental=True)
+    def gen_incremental_mem(self, will_generate_key):
+        raise AssertionError("The function shouldn't be called.")
+
+
+def test_unsupported_incremental():
+    try:
+        IncrementalMemoryFeatureGenerator()
+    except ValueError as e:
+        assert "gen_incremental_mem" in str(e)
+    else:
+        raise AssertionError("The unsupported incremental is not detected.")
+
+
+class MemoryOrderFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('memory', 'mem_a')
+    def gen_mem_a(self, will_generate_key):
+        return np.zeros(10)
+
+    @will_generate('memory', 'mem_b')
+    def gen_mem_b(self, will_generate_key):
+        return np.zeros(10)
+
+    @require('mem_a')
+    @will_generate('memory', 'use_a')
+    def gen_use_a(self, data, will_generate_key):
+        return data['mem_a'].sum()
+
+    @require('mem_b')
+    @will_generate('memory', 'use_b')
+    def gen_use_b(self, data, will_generate_key):
+        return data['mem_b'].sum()
+
+
+def test_memory_aware_order():
+    generator = MemoryOrderFeatureGenerator()
+    generator.generate(['mem_a', 'mem_b'])
+    memory_handler = generator.get_handler('mem_a')
+    # the node releasing the larger data runs first
+    for large_key, first_node in (('mem_a', 'use_a'), ('mem_b', 'use_b')):
+        for key in ('mem_a', 'mem_b'):
+            memory_handler.data[key] = np.zeros(
+                1000 if key == large_key else 10)
+        involved_dag, generation_order = generator.build_involved_dag(
+            ['use_a', 'use_b'])
+        order = generator._get_memory_aware_order(involved_dag,
+                                                  generation_order)
+        assert order[0] == first_node
+        assert sorted(order) == ['use_a', 'use_b']
+
+
+class CallOrderFeatureGenerator(fg.FeatureGenerator):
+
+    def __init__(self):
+        super(CallOrderFeatureGenerator, self).__init__()
+        self.called_functions = []
+
+    @will_generate('memory', 'mem_a')
+    def gen_mem_a(self, will_generate_key):
+        self.called_functions.append('gen_mem_a')
+        return np.zeros(10)
+
+    @will_generate('memory', 'mem_b')
+    def gen_mem_b(self, will_generate_key):
+        self.called_functions.append('gen_mem_b')
+        return np.zeros(10)
+
+    @require('mem_a')
+    @will_generate('memory', 'use_a')
+    def gen_use_a(self, data, will_generate_key):
+        self.called_functions.append('gen_use_a')
+        return data['mem_a'].sum()
+
+    @require('mem_b')
+    @will_generate('memory', 'use_b')
+    def gen_use_b(self, data, will_generate_key):
+        self.called_functions.append('gen_use_b')
+        return data['mem_b'].sum()
+
+
+def test_memory_aware_generation_order():
+    # the node releasing the larger data is generated first
+    for large_key, first_function in (('mem_a', 'gen_use_a'),
+                                      ('mem_b', 'gen_use_b')):
+        generator = CallOrderFeatureGenerator()
+        generator.generate(['mem_a', 'mem_b'])
+        memory_handler = generator.get_handler('mem_a')
+        for key in ('mem_a', 'mem_b'):
+            memory_handler.data[key] = np.zeros(
+                1000 if key == large_key else 10)
+        del generator.called_functions[:]
+        generator.generate(['use_a', 'use_b'])
+        assert generator.called_functions[0] == first_function
+        assert sorted(generator.called_functions) == ['gen_use_a',
+                                                      'gen_use_b']
+
+
+def test_profile():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = LifetimeFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"),
+        pickle_dir=join(test_output_dir, "pickle"))
+    profiler = Profiler()
+    generator.generate(['weight', 'BMI', 'stream_weight'], n_jobs=2,
+                       backend='process', profiler=profiler)
+    generator.bundle({'features': ['weight', 'BMI']},
+                     join(test_output_dir, "bundle.h5"),
+                     structure_config={'features': {'concat': True}},
+                     profiler=profiler)
+    report = profiler.get_report()
+    assert set(report['nodes']['BMI']) >= {'fetch', 'compute', 'validate',
+                                            'write', 'total'}
+    assert set(report['nodes']['BMI']['read_bytes_by_handler']) == {'memory'}
+    assert report['nodes']['BMI']['compute']['wall'] > 0
+    assert 'write' in report['nodes']['stream_weight']
+    assert set(report['bundle']) == {'/features'}
+    trace_path = join(test_output_dir, "profile.trace.json")
+    profiler.write_chrome_trace(trace_path)
+    with open(trace_path) as fp:
+        events = json.load(fp)['traceEvents']
+    assert len(events) == len(profiler.spans)
+    assert {event['cat'] for event in events} == {
+        'fetch', 'read', 'compute', 'validate', 'write', 'bundle'}
+
+    generator.get_handler('pd_raw_data').hdf_store.close()
+    rmtree(test_output_dir)
+
+
+def test_regenerate_outdated_data():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = LifetimeFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"),
+        pickle_dir=join(test_output_dir, "pickle"))
+    data_keys = ['BMI_divided_by_weight', 'weight']
+    generator.generate(data_keys)
+    involved_dag, _ = generator.build_involved_dag(data_keys)
+    assert involved_dag.node['BMI_divided_by_weight']['skipped']
+
+    # pretend that gen_bmi has been changed
+    orig_hash_function_source = data_generator._hash_function_source
+
+    def _hash_function_source(function):
+        if function.__name__ == 'gen_bmi':
+            return "changed"
+        return orig_hash_function_source(function)
+
+    data_generator._hash_function_source = _hash_function_source
+    try:
+        involved_dag, _ = generator.build_involved_dag(data_keys)
+        assert not involved_dag.node[('data_df',)]['skipped']
+        assert not involved_dag.node['BMI']['skipped']
+        assert not involved_dag.node['BMI_divided_by_weight']['skipped']
+        assert involved_dag.node[('height', 'weight')]['skipped']
+        generator.generate(data_keys)
+        involved_dag, _ = generator.build_involved_dag(data_keys)
+        assert involved_dag.node['BMI_divided_by_weight']['skipped']
+    finally:
+        data_generator._hash_function_source = orig_hash_function_source
+
+    generator.get_handler('pd_raw_data').hdf_store.close()
+    rmtree(test_output_dir)
+
+
+def test_plan_with_catalog():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator_kwargs = {
+        'h5py_hdf_path': join(test_output_dir, "h5py.h5"),
+        'pandas_hdf_path': join(test_output_dir, "pandas.h5"),
+        'pickle_dir': join(test_output_dir, "pickle"),
+        'catalog_path': join(test_output_dir, "catalog.sqlite"),
+    }
+    data_keys = ['BMI', 'weight', 'pd_weight']
+    generator = LifetimeFeatureGenerator(**generator_kwargs)
+    generator.generate(data_keys)
+    generator.get_handler('pd_raw_data').hdf_store.close()
+    generator.get_handler('weight').h5f.close()
+
+    generator = LifetimeFeatureGenerator(**generator_kwargs)
+    record = generator._catalog.get('BMI')
+    assert record['handler'] == 'h5py'
+    assert record['shape'] == (6,)
+    assert record['dtype'] == 'float64'
+    assert record['fingerprint'] is not None
+    assert record['duration'] >= 0
+    record = generator._catalog.get('pd_weight')
+    assert record['handler'] == 'pandas_hdf'
+    assert record['fingerprint'] is not None
+
+    involved_dag, _ = generator.build_involved_dag(data_keys)
+    assert all(node_attr['skipped']
+               for node, node_attr in involved_dag.nodes_iter(data=True)
+               if node != 'generate')
+    # the planning only reads the catalog
+    assert generator.get_handler('weight')._h5f is None
+    assert generator.get_handler('pd_weight')._hdf_store is None
+    generator._catalog.close()
+    rmtree(test_output_dir)
+
+
+def test_catalog_removed_data():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = LifetimeFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"),
+        pickle_dir=join(test_output_dir, "pickle"),
+        catalog_path=join(test_output_dir, "catalog.sqlite"))
+    generator.generate(['train_test_split'])
+    assert 'train_test_split' in generator._catalog
+    # the data removed without feagen is generated again
+    os.remove(join(test_output_dir, "pickle", "train_test_split.pkl"))
+    generator.generate(['is_in_test_set'])
+    assert generator.get('is_in_test_set')[:].shape[0] == 6
+    assert os.path.exists(join(test_output_dir, "pickle",
+                               "train_test_split.pkl"))
+    generator.get_handler('is_in_test_set').h5f.close()
+    generator._catalog.close()
+    rmtree(test_output_dir)
+
+
+def test_explain():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = LifetimeFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"),
+        pickle_dir=join(test_output_dir, "pickle"),
+        catalog_path=join(test_output_dir, "catalog.sqlite"))
+    explanation = generator.explain(['weight_divided_by_height'])
+    assert [node['name'] for node in explanation['nodes']] == [
+        'data_df', 'height, weight', 'weight_divided_by_height']
+    assert explanation['n_unknown'] == 3
+
+    generator.generate(['weight_divided_by_height'])
+    history = generator._catalog.get_history('gen_raw_data_features')
+    assert history['n_runs'] == 1
+    assert history['nbytes'] == 6 * 8
+
+    # the keys matching the same regex share the history
+    explanation = generator.explain(['height_divided_by_weight',
+                                     'weight_divided_by_height'])
+    assert explanation['n_skipped'] == 3
+    assert explanation['n_unknown'] == 0
+    assert [node['name'] for node in explanation['nodes']] == [
+        'height_divided_by_weight']
+    assert explanation['nbytes'] == 6 * 8
+    assert explanation['critical_path'] == ['height_divided_by_weight']
+    assert (explanation['critical_path_duration']
+            == explanation['nodes'][0]['duration'])
+    assert "Critical path" in format_explanation(explanation)
+
+    generator._catalog.close()
+    rmtree(test_output_dir)
+
+
+class SelectFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('pandas_hdf', 'table_df', data_columns=['a'])
+    def gen_table_df(self, will_generate_key):
+        return pd.DataFrame({'a': np.arange(6), 'b': np.arange(6) * 2.,
+                             'c': np.arange(6) * 3.})
+
+    @require('table_df', columns=['a', 'b'], where='a > 2')
+    @will_generate('memory', 'selected_df')
+    def gen_selected_df(self, data, will_generate_key):
+        return data['table_df']
+
+    @require('table_df', stop=2)
+    @will_generate('memory', 'head_df')
+    def gen_head_df(self, data, will_generate_key):
+        return data['table_df']
+
+
+def test_require_select():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = SelectFeatureGenerator(
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"))
+    generator.generate(['selected_df', 'head_df'], release_memory=False)
+    selected_df = generator.get('selected_df')
+    assert list(selected_df.columns) == ['a', 'b']
+    assert list(selected_df['a']) == [3, 4, 5]
+    assert generator.get('head_df').shape == (2, 3)
+    generator.get_handler('table_df').hdf_store.close()
+    rmtree(test_output_dir)
+
+
+class SparseFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('h5py', 'one_hot')
+    def gen_one_hot(self, will_generate_key):
+        return ss.eye(10, 50, format='csr')
+
+    @will_generate('h5py', 'dense')
+    def gen_dense(self, will_generate_key):
+        return np.arange(20.).reshape(10, 2)
+
+
+def test_sparse_concat_bundle():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+    generator = SparseFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"))
+    generator.generate(['one_hot', 'dense'])
+    generator.bundle({'features': ['one_hot', 'dense'],
+                      'features32': ['one_hot', 'dense']},
+                     data_bundle_hdf_path, buffer_size=200,
+                     structure_config={
+                         'features': {'concat': True, 'sparse': 'csr'},
+                         'features32': {'concat': True, 'sparse': 'csr',
+                                        'dtype': 'float32'},
+                     })
+    with h5sparse.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
+        features = data_bundle_h5f['features'][0:10]
+        features32 = data_bundle_h5f['features32'][0:10]
+    assert features.shape == (10, 52)
+    assert features.dtype == np.float64
+    assert features32.dtype == np.float32
+    assert (features.toarray()
+            == np.hstack([np.eye(10, 50), np.arange(20.).reshape(10, 2)])
+            ).all()
+    generator.get_handler('dense').h5f.close()
+    rmtree(test_output_dir)
+
+
+class ConcatFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('memory', 'ids')
+    def gen_ids(self, will_generate_key):
+        return np.arange(10, dtype=np.int64)
+
+    @will_generate('memory', 'flags')
+    def gen_flags(self, will_generate_key):
+        return np.arange(20).reshape(10, 2) % 3 == 0
+
+    @will_generate('h5py', 'counts')
+    def gen_counts(self, will_generate_key):
+        return np.arange(30, dtype=np.int32).reshape(10, 3)
+
+
+def test_concat_bundle_dtype():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+    generator = ConcatFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"))
+    generator.generate(['ids', 'flags', 'counts'], release_memory=False)
+    expected = np.hstack([np.arange(10)[:, np.newaxis],
+                          np.arange(20).reshape(10, 2) % 3 == 0,
+                          np.arange(30).reshape(10, 3)])
+    # buffers of 2 rows
+    for dtype, expected_dtype in ((None, np.int64), ('float32', np.float32)):
+        generator.bundle({'features': ['ids', 'flags', 'counts']},
+                         data_bundle_hdf_path, buffer_size=200,
+                         structure_config={'features': {'concat': True,
+                                                        'dtype': dtype,
+                                                        'n_threads': 2}})
+        with h5py.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
+            features = data_bundle_h5f['features'][...]
+        assert features.dtype == expected_dtype
+        assert (features == expected).all()
+    generator.get_handler('counts').h5f.close()
+    rmtree(test_output_dir)
+
+
+class LinkFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('h5py', 'ids')
+    def gen_ids(self, will_generate_key):
+        return np.arange(10, dtype=np.int64)
+
+    @will_generate('h5py', 'dense')
+    def gen_dense(self, will_generate_key):
+        return np.arange(20, dtype=np.float32).reshape(10, 2)
+
+    @will_generate('h5py', 'one_hot')
+    def gen_one_hot(self, will_generate_key):
+        return ss.eye(10, 5, format='csr')
+
+    @will_generate('npy', 'npy_dense')
+    def gen_npy_dense(self, will_generate_key):
+        return np.arange(30.).reshape(10, 3)
+
+    @will_generate('npy', 'npy_one_hot')
+    def gen_npy_one_hot(self, will_generate_key):
+        return ss.eye(10, 4, format='csr')
+
+
+def test_link_bundle():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    data_bundle_hdf_path = join(test_output_dir, "bundles", "bundle.h5")
+    os.mkdir(join(test_output_dir, "bundles"))
+    generator = LinkFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        npy_dir=join(test_output_dir, "npy"))
+    structure = {
+        'ids': 'ids',
+        'one_hot': 'one_hot',
+        'npy_dense': 'npy_dense',
+        'npy_one_hot': 'npy_one_hot',
+        'features': ['ids', 'dense'],
+        'mixed': ['ids', 'npy_dense'],
+    }
+    generator.generate(get_data_keys_from_structure(structure))
+    generator.bundle(structure, data_bundle_hdf_path,
+                     structure_config={'features': {'concat': True},
+                                       'mixed': {'concat': True}},
+                     link=True)
+    with h5py.File(data_bundle_hdf_path, "r") as h5f:
+        data_bundle_h5f = h5sparse.Group(h5f)
+        assert isinstance(h5f.get('ids', getlink=True), h5py.ExternalLink)
+        assert (h5f['ids'][...] == np.arange(10)).all()
+        assert (data_bundle_h5f['one_hot'][0:10].toarray()
+                == np.eye(10, 5)).all()
+        assert h5f['npy_dense'].external is not None
+        assert (h5f['npy_dense'][...] == np.arange(30.).reshape(10, 3)).all()
+        assert (data_bundle_h5f['npy_one_hot'][0:10].toarray()
+                == np.eye(10, 4)).all()
+        assert h5f['features'].is_virtual
+        assert h5f['features'].dtype == np.float64
+        assert (h5f['features'][...]
+                == np.hstack([np.arange(10)[:, np.newaxis],
+                              np.arange(20).reshape(10, 2)])).all()
+        # the data in the npy files is copied
+        assert not h5f['mixed'].is_virtual
+        assert h5f['mixed'].shape == (10, 4)
+    generator.get_handler('ids').h5f.close()
+    rmtree(test_output_dir)
+
+
+def test_bundle_refresh():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+    generator = LinkFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        npy_dir=join(test_output_dir, "npy"))
+    generator.generate(['ids', 'dense'])
+    structure_config = {'features': {'concat': True}}
+    generator.bundle({'ids': 'ids', 'features': ['dense', 'ids']},
+                     data_bundle_hdf_path, structure_config=structure_config)
+
+    fill_calls = []
+    fill_concat_data = generator.fill_concat_data
+
+    def _fill_concat_data(*args, **kwargs):
+        fill_calls.append(kwargs['refresh_keys'])
+        return fill_concat_data(*args, **kwargs)
+
+    generator.fill_concat_data = _fill_concat_data
+    generator.bundle({'ids': 'ids', 'features': ['dense', 'ids']},
+                     data_bundle_hdf_path, structure_config=structure_config)
+    assert fill_calls == []
+
+    # only the columns of the changed data are rewritten
+    h5py_handler = generator.get_handler('dense')
+    h5py_handler.h5f['dense'][...] = -1.
+    h5py_handler.set_fingerprint('dense', 'changed')
+    generator.bundle({'features': ['dense', 'ids']}, data_bundle_hdf_path,
+                     structure_config=structure_config)
+    assert fill_calls == [['dense']]
+    with h5py.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
+        assert 'ids' not in data_bundle_h5f
+        assert (data_bundle_h5f['features'][...]
+                == np.hstack([-np.ones((10, 2)),
+                              np.arange(10)[:, np.newaxis]])).all()
+    h5py_handler.h5f.close()
+    rmtree(test_output_dir)
+
+
+class FilterFeatureGenerator(fg.FeatureGenerator):
+
+    @will_generate('h5py', 'is_test')
+    def gen_is_test(self, will_generate_key):
+        return np.arange(10) % 3 == 0
+
+    @will_generate('memory', 'picked')
+    def gen_picked(self, will_generate_key):
+        return np.array([7, 1, 2, 4, 5])
+
+    @will_generate('h5py', 'dense')
+    def gen_dense(self, will_generate_key):
+        return np.arange(20.).reshape(10, 2)
+
+    @will_generate('h5py', 'one_hot')
+    def gen_one_hot(self, will_generate_key):
+        return ss.eye(10, 4, format='csr')
+
+    @will_generate('pandas_hdf', 'df')
+    def gen_df(self, will_generate_key):
+        return pd.DataFrame({'a': np.arange(10), 'b': np.arange(10) * 2.})
+
+
+def test_row_filter_bundle():
+    # read by blocks of 2 or 3 rows
+    block_nbytes = fg.data_handlers.BUNDLE_BLOCK_NBYTES
+    chunk_rows = fg.data_handlers.DEFAULT_CHUNK_ROWS
+    fg.data_handlers.BUNDLE_BLOCK_NBYTES = 32
+    fg.data_handlers.DEFAULT_CHUNK_ROWS = 3
+    try:
+        _check_row_filter_bundle()
+    finally:
+        fg.data_handlers.BUNDLE_BLOCK_NBYTES = block_nbytes
+        fg.data_handlers.DEFAULT_CHUNK_ROWS = chunk_rows
+
+
+def _check_row_filter_bundle():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator = FilterFeatureGenerator(
+        h5py_hdf_path=join(test_output_dir, "h5py.h5"),
+        pandas_hdf_path=join(test_output_dir, "pandas.h5"))
+    structure = {
+        'dense': 'dense',
+        'one_hot': 'one_hot',
+        'df': 'df',
+        'features': ['dense', 'one_hot'],
+        'sparse_features': ['dense', 'one_hot'],
+    }
+    generator.generate(get_data_keys_from_structure(structure)
+                       + ['is_test', 'picked'], release_memory=False)
+    for row_filter, rows in (('~is_test', [1, 2, 4, 5, 7, 8]),
+                             (['~is_test', 'picked'], [1, 2, 4, 5, 7])):
+        data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+        generator.bundle(
+            structure, data_bundle_hdf_path, buffer_size=100,
+            structure_config={
+                'row_filter': row_filter,
+                'features': {'concat': True},
+                'sparse_features': {'concat': True, 'sparse': 'csr'},
+            })
+        expected = np.hstack([np.arange(20.).reshape(10, 2),
+                              np.eye(10, 4)])[rows]
+        with h5sparse.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
+            assert (data_bundle_h5f['dense'][...] == expected[:, :2]).all()
+            assert (data_bundle_h5f['one_hot'][0:len(rows)].toarray()
+                    == expected[:, 2:]).all()
+            assert (data_bundle_h5f['features'][...] == expected).all()
+            assert (data_bundle_h5f['sparse_features'][0:len(rows)].toarray()
+                    == expected).all()
+        assert list(pd.read_hdf(data_bundle_hdf_path, 'df')['a']) == rows
+    generator.get_handler('dense').h5f.close()
+    generator.get_handler('df').hdf_store.close()
+    rmtree(test_output_dir)
+
+
+class PersistFeatureGenerator(fg.FeatureGenerator):
+    n_calls = 0
+
+    @will_generate('memory', 'data_df', persist=True)
+    def gen_data_df(self, will_generate_key):
+        PersistFeatureGenerator.n_calls += 1
+        return pd.DataFrame({'weight': [60.1, 90.4, 46.2]})
+
+    @require('data_df')
+    @will_generate('h5py', ['weight', 'double_weight'])
+    def gen_weight(self, data):
+        weight = data['data_df']['weight'].values
+        return {'weight': weight, 'double_weight': weight * 2}
+
+
+def test_persisted_memory_data():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    generator_kwargs = {
+        'h5py_hdf_path': join(test_output_dir, "h5py.h5"),
+        'memory_cache_dir': join(test_output_dir, "memory_cache"),
+    }
+    PersistFeatureGenerator.n_calls = 0
+    generator = PersistFeatureGenerator(**generator_kwargs)
+    generator.generate(['weight'])
+    assert PersistFeatureGenerator.n_calls == 1
+    # data_df is loaded from the cache by a new generator
+    generator.get_handler('weight').h5f.close()
+    generator = PersistFeatureGenerator(**generator_kwargs)
+    for key in ('weight', 'double_weight'):
+        generator.get_handler('weight').delete(key)
+    generator.generate(['weight'])
+    assert PersistFeatureGenerator.n_calls == 1
+    assert np.allclose(generator.get('weight')[...], [60.1, 90.4, 46.2])
+
+    generator.get_handler('weight').h5f.close()
+    rmtree(test_output_dir)
+
+
+class IncrementalFeatureGenerator(fg.FeatureGenerator):
+
+    def __init__(self, n_rows, **kwargs):
+        self.n_rows = n_rows
+        self.row_starts = []
+        super(IncrementalFeatureGenerator, self).__init__(**kwargs)
+
+    @will_generate('memory', 'raw')
+    def gen_raw(self, will_generate_key):
+        return np.arange(self.n_rows, dtype=np.float64)
+
+    @require('raw')
+    @will_generate('h5py', 'double', incremental=True)
+    def gen_double(self, data, will_generate_key, row_start):
+        self.row_starts.append(row_start)
+        return data['raw'][row_start:] * 2
+
+    @require('double')
+    @will_generate('h5py', 'quadruple')
+    def gen_quadruple(self, data, will_generate_key):
+        return data['double'][...] * 2
+
+    @will_generate('h5py', 'h5py_raw')
+    def gen_h5py_raw(self, will_generate_key):
+        return np.arange(self.n_rows, dtype=np.float64)
+
+    @require('h5py_raw')
+    @will_generate('h5py', 'h5py_double', incremental=True)
+    def gen_h5py_double(self, data, will_generate_key, row_start):
+        return data['h5py_raw'][row_start:] * 2
+
+
+def test_incremental_generation():
+    test_output_dir = mkdtemp(prefix="feagen_test_output_")
+    h5py_hdf_path = join(test_output_dir, "h5py.h5")
+    data_bundle_hdf_path = join(test_output_dir, "bundle.h5")
+    structure = {'double': 'double', 'features': ['double', 'raw']}
+    structure_config = {'features': {'concat': True}}
+
+    row_starts = []
+    for n_rows in (4, 6):
+        generator = IncrementalFeatureGenerator(n_rows,
+                                                h5py_hdf_path=h5py_hdf_path)
+        generator.generate(['double', 'raw'], incremental=True)
+        generator.bundle(structure, data_bundle_hdf_path,
+                         structure_config=structure_config, incremental=True)
+        row_starts.extend(generator.row_starts)
+        if n_rows == 4:
+            generator.get_handler('double').h5f.close()
+    assert row_starts == [0, 4]
+    assert (generator.get('double')[...] == np.arange(6) * 2).all()
+
+    with h5py.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
+        assert (data_bundle_h5f['double'][...] == np.arange(6) * 2).all()
+        assert (data_bundle_h5f['features'][...]
+                == np.arange(6)[:, np.newaxis] * [2, 1]).all()
+
+    # the memory data kept by the generator gets the new rows, and the data
+    # depending on the appended data is generated again
+    generator.generate(['quadruple'])
+    generator.n_rows = 8
+    generator.row_starts = []
+    generator.generate(['quadruple'], incremental=True)
+    assert generator.row_starts == [6]
+    assert (generator.get('quadruple')[...] == np.arange(8) * 4).all()
+
+    # the new rows can't come from the data that isn't appended
+    generator.generate(['h5py_double'])
+    try:
+        generator.generate(['h5py_double'], incremental=True)
+    except ValueError as e:
+        assert "h5py_raw" in str(e)
+    else:
+        raise AssertionError("The broken incremental chain is not detected.")
 
+    generator.get_handler('double').h5f.close()
     rmtree(test_output_dir)
@@ -1,3 +1,5 @@
 from .feagen_runner import feagen_run  # noqa: F401
 from .config import init_config  # noqa: F401
 from .dag import draw_dag  # noqa: F401
+from .ls import feagen_ls  # noqa: F401
+from .daemon import feagen_daemon  # noqa: F401
@@ -18,6 +18,40 @@ generator_kwargs:
     h5py.h5
   pandas_hdf_path:
     pandas.h5
+  # The default dataset options of the 'h5py' handler, which can be overridden
+  # by the keyword arguments of will_generate. 'auto' chunks make reading rows
+  # in batches (e.g., when bundling) fast.
+  # h5py_dataset_kwargs:
+  #   chunks: auto
+  #   compression: lzf
+  #   shuffle: True
+  # The default write options of the 'pandas_hdf' handler, which can be
+  # overridden by the keyword arguments of will_generate. format 'auto' uses
+  # the fixed format for narrow numeric data and the table format otherwise.
+  # pandas_hdf_write_kwargs:
+  #   format: auto
+  #   complib: blosc
+  #   complevel: 5
+  # The directory for the 'npy' handler, which stores each data as .npy files
+  # and reads them with memory mapping.
+  # npy_dir:
+  #   npy
+  # Uncomment these lines to record the generated data in an SQLite catalog.
+  # It lets feagen plan the generation without opening the data files and is
+  # listed by feagen-ls.
+  # catalog_path:
+  #   catalog.sqlite
+  # Uncomment these lines to limit the memory used by the 'memory' handler. The
+  # least recently used data will be spilled to memory_spill_dir (a temporary
+  # directory if not set) when the total size exceeds memory_max_bytes.
+  # memory_max_bytes:
+  #   4e+9
+  # memory_spill_dir:
+  #   memory_spill
+  # The directory of the 'memory' data generated with persist=True, which is
+  # reloaded by the next runs instead of generated again.
+  # memory_cache_dir:
+  #   memory_cache
 """
     default_bundle_config = """\
 # The name of this bundle. This will be the file name of the data bundle.
@@ -38,10 +72,19 @@ structure:
 
 # Special configuration for the structure. Here we set concat=True for
 # 'features'. It means that the data list in 'features' will be concatenated
-# into a dataset.
+# into a dataset. Add 'sparse: csr' to concatenate them into a sparse CSR
+# dataset instead, which keeps the bundle small if some of them are sparse.
+# The dtype of the dense dataset is inferred from the data if 'dtype' (e.g.,
+# float32) is not set, and 'n_threads' data are read at the same time.
+# A 'row_filter' (a boolean or index key, a boolean key prefixed with '~' to
+# negate it, or a list of them to intersect) keeps only the selected rows of
+# all the data under it, e.g., 'row_filter: ~is_test' here for the whole
+# bundle.
 structure_config:
   features:
     concat: True
+    # dtype: float32
+    # n_threads: 4
 """
     default_global_config_path = join(".feagenrc", "config.yml")
     if exists(default_global_config_path):
@@ -0,0 +1,187 @@
+"""A daemon that keeps the data generator warm between the runs.
+
+``feagen-daemon`` creates the data generator once and serves the jobs sent by
+``feagen --daemon-socket PATH`` over a Unix socket, so the modules, the DAG,
+the open data stores and the memory data (e.g., a parsed CSV) are reused by
+all the jobs. The jobs are run one at a time in the order they arrive.
+
+Each message is a line of JSON. A job is the arguments of
+``feagen_run_with_configs`` with the global config and the working directory
+of the client, and the daemon replies with the lines of the output
+(``{"output": ...}``) and then the result (``{"success": ..., "error":
+...}``).
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+
+import yaml
+from six.moves import socketserver
+
+from .config import get_data_generator_from_config
+from .feagen_runner import feagen_run_with_configs
+
+
+DEFAULT_SOCKET_PATH = ".feagenrc/feagen.sock"
+# the arguments of feagen_run_with_configs that can be sent by the client
+JOB_ARG_NAMES = ('bundle_config', 'dag_output_path', 'no_bundle', 'n_jobs',
+                 'backend', 'incremental', 'link', 'profile_path', 'explain')
+
+
+def _send_message(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+    wfile.flush()
+
+
+class _OutputWriter(object):
+    """Send the text written to ``sys.stdout`` to the client.
+
+    The text written by the forked worker processes is sent to the original
+    stdout instead, so the messages are not interleaved.
+    """
+
+    def __init__(self, wfile, stdout):
+        self._wfile = wfile
+        self._stdout = stdout
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        if os.getpid() != self._pid:
+            self._stdout.write(text)
+            return
+        with self._lock:
+            _send_message(self._wfile, {'output': text})
+
+    def flush(self):
+        pass
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        job = json.loads(self.rfile.readline().decode('utf-8'))
+        command = job.get('command', 'run')
+        if command == 'shutdown':
+            _send_message(self.wfile, {'success': True})
+            # shutdown() waits for serve_forever(), which runs this handler
+            threading.Thread(target=self.server.shutdown).start()
+            return
+        stdout = sys.stdout
+        sys.stdout = _OutputWriter(self.wfile, stdout)
+        try:
+            self.server.feagen_daemon.run_job(job)
+        except Exception:  # pylint: disable=broad-except
+            result = {'success': False, 'error': traceback.format_exc()}
+        else:
+            result = {'success': True}
+        finally:
+            sys.stdout = stdout
+        _send_message(self.wfile, result)
+
+
+class FeagenDaemon(object):
+    """Keep the data generator of ``global_config`` and run the jobs with it.
+
+    The memory data is not released after a job (``release_memory=False``),
+    so the next jobs don't need to generate it again.
+
+    Parameters
+    ==========
+    global_config: collections.Mapping
+        The global configuration. The jobs with a different global config are
+        rejected, since the generator is created from it.
+    """
+
+    def __init__(self, global_config):
+        # as sent by the clients
+        self.global_config = json.loads(json.dumps(global_config))
+        self.cwd = os.getcwd()
+        self.data_generator = get_data_generator_from_config(global_config)
+        self.server = None
+
+    def run_job(self, job):
+        if job.get('global_config', self.global_config) != self.global_config:
+            raise ValueError("The global config is different from the one "
+                             "of the daemon. Restart the daemon to use it.")
+        if job.get('cwd', self.cwd) != self.cwd:
+            raise ValueError("The working directory {} is different from {} "
+                             "of the daemon.".format(job['cwd'], self.cwd))
+        kwargs = {name: job[name] for name in JOB_ARG_NAMES if name in job}
+        feagen_run_with_configs(self.global_config,
+                                data_generator=self.data_generator,
+                                release_memory=False, **kwargs)
+
+    def serve(self, socket_path):
+        """Serve the jobs on the Unix socket until a shutdown message."""
+        if os.path.exists(socket_path):
+            # remove the socket left by a killed daemon
+            os.remove(socket_path)
+        server = socketserver.UnixStreamServer(socket_path, _JobHandler)
+        server.feagen_daemon = self
+        self.server = server
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_path)
+            self.server = None
+
+
+def send_job(socket_path, job, output=None):
+    """Send the job to the daemon and write its output to ``output`` (default:
+    ``sys.stdout``).
+
+    Raise RuntimeError with the traceback from the daemon if the job fails.
+    """
+    if output is None:
+        output = sys.stdout
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+    try:
+        sock.sendall((json.dumps(job) + "\n").encode('utf-8'))
+        # the file object of Python 2 is not a context manager
+        fp = sock.makefile('rb')
+        try:
+            for line in iter(fp.readline, b""):
+                message = json.loads(line.decode('utf-8'))
+                if 'output' in message:
+                    output.write(message['output'])
+                    output.flush()
+                    continue
+                if not message['success']:
+                    raise RuntimeError("The job failed in the daemon:\n"
+                                       + message['error'])
+                return
+        finally:
+            fp.close()
+    finally:
+        sock.close()
+    raise RuntimeError("The daemon closed the connection before finishing "
+                       "the job.")
+
+
+def feagen_daemon(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Keep the data generator warm and run the jobs sent by "
+                    "feagen --daemon-socket.")
+    parser.add_argument('-g', '--global-config',
+                        default=".feagenrc/config.yml",
+                        help="the path of the path configuration YAML file "
+                             "(default: .feagenrc/config.yml)")
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET_PATH,
+                        help="the path of the Unix socket to listen on "
+                             "(default: {})".format(DEFAULT_SOCKET_PATH))
+    parser.add_argument('--stop', action='store_true',
+                        help="stop the daemon listening on the socket")
+    args = parser.parse_args(argv)
+    if args.stop:
+        send_job(args.socket, {'command': 'shutdown'})
+        return
+    with open(args.global_config) as fp:
+        global_config = yaml.load(fp)
+    FeagenDaemon(global_config).serve(args.socket)
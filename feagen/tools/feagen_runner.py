@@ -1,4 +1,5 @@
 from os.path import basename, splitext, join
+import os
 import sys
 import argparse
 import collections
@@ -8,11 +9,17 @@ from mkdir_p import mkdir_p
 from feagen.dag import draw_dag
 
 from .config import get_data_generator_from_config
-from ..bundling import get_data_keys_from_structure
+from ..cost_model import format_explanation
+from ..profiler import Profiler
+from ..bundling import (get_data_keys_from_structure,
+                        get_row_filter_keys_from_structure_config)
 
 
 def feagen_run_with_configs(global_config, bundle_config, dag_output_path=None,
-                            no_bundle=False):
+                            no_bundle=False, n_jobs=1, backend='thread',
+                            incremental=False, link=False, profile_path=None,
+                            explain=False, data_generator=None,
+                            release_memory=True):
     """Generate feature with configurations.
 
     global_config (collections.Mapping): global configuration
@@ -23,6 +30,28 @@ def feagen_run_with_configs(global_config, bundle_config, dag_output_path=None,
     bundle_config (collections.Mapping): bundle configuration
         name: string
         structure: collections.Mapping
+
+    n_jobs (int): the maximum number of node functions that run concurrently
+
+    backend (str): 'thread' or 'process', the way to run the node functions
+        when ``n_jobs > 1``
+
+    incremental (bool): append the new rows to the existing data of the
+        incremental nodes and to the existing data bundle
+
+    link (bool): link the global data to the data bundle instead of copying
+
+    profile_path (str): write the JSON report of the resource usage of each
+        node and bundled dataset to this path, and the Chrome trace to
+        ``<profile_path without extension>.trace.json``
+
+    explain (bool): only print the nodes to generate with their costs
+        estimated from the history in the catalog, and the critical path
+
+    data_generator (DataGenerator): use this generator instead of creating
+        one from ``global_config``, e.g., the one kept by the daemon
+
+    release_memory (bool): release the memory data that is not needed anymore
     """
     if not isinstance(global_config, collections.Mapping):
         raise ValueError("global_config should be a "
@@ -30,9 +59,21 @@ def feagen_run_with_configs(global_config, bundle_config, dag_output_path=None,
     if not isinstance(bundle_config, collections.Mapping):
         raise ValueError("bundle_config should be a "
                          "collections.Mapping object.")
-    data_generator = get_data_generator_from_config(global_config)
+    if data_generator is None:
+        data_generator = get_data_generator_from_config(global_config)
     data_keys = get_data_keys_from_structure(bundle_config['structure'])
-    data_generator.generate(data_keys, dag_output_path)
+    data_keys += [
+        data_key for data_key in get_row_filter_keys_from_structure_config(
+            bundle_config.get('structure_config', {}))
+        if data_key not in data_keys]
+    if explain:
+        print(format_explanation(data_generator.explain(data_keys,
+                                                        incremental)))
+        return
+    profiler = None if profile_path is None else Profiler()
+    data_generator.generate(data_keys, dag_output_path, n_jobs=n_jobs,
+                            backend=backend, release_memory=release_memory,
+                            incremental=incremental, profiler=profiler)
 
     if not no_bundle:
         mkdir_p(global_config['data_bundles_dir'])
@@ -40,7 +81,12 @@ def feagen_run_with_configs(global_config, bundle_config, dag_output_path=None,
                            bundle_config['name'] + '.h5')
         data_generator.bundle(
             bundle_config['structure'], data_bundle_hdf_path=bundle_path,
-            structure_config=bundle_config['structure_config'])
+            structure_config=bundle_config['structure_config'],
+            incremental=incremental, link=link, profiler=profiler)
+
+    if profiler is not None:
+        profiler.write_report(profile_path)
+        profiler.write_chrome_trace(splitext(profile_path)[0] + '.trace.json')
 
 
 def feagen_run(argv=sys.argv[1:]):
@@ -60,6 +106,34 @@ def feagen_run(argv=sys.argv[1:]):
                              "(default: None)")
     parser.add_argument('--no-bundle', action='store_true',
                         help="not generate the data bundle")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="the maximum number of node functions that run "
+                             "concurrently (default: 1)")
+    parser.add_argument('--backend', choices=['thread', 'process'],
+                        default='thread',
+                        help="run the node functions in threads or processes "
+                             "when --jobs is larger than 1 (default: thread)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append the new rows to the existing data and "
+                             "data bundle instead of rebuilding them")
+    parser.add_argument('--link', action='store_true',
+                        help="link the global data to the data bundle by HDF5 "
+                             "external links and virtual datasets instead of "
+                             "copying")
+    parser.add_argument('--explain', action='store_true',
+                        help="print the nodes to generate, the estimated "
+                             "time and bytes to write, and the critical path "
+                             "without generating anything (needs "
+                             "catalog_path)")
+    parser.add_argument('--profile', default=None, metavar='PATH',
+                        help="write the JSON report of the time, memory and "
+                             "I/O of each node and bundled dataset to PATH, "
+                             "and the Chrome trace to PATH without extension "
+                             "+ .trace.json (default: None)")
+    parser.add_argument('--daemon-socket', default=None, metavar='PATH',
+                        help="send the job to the feagen-daemon listening on "
+                             "PATH instead of running it here (default: "
+                             "None)")
     args = parser.parse_args(argv)
     with open(args.global_config) as fp:
         global_config = yaml.load(fp)
@@ -67,5 +141,24 @@ def feagen_run(argv=sys.argv[1:]):
         bundle_config = yaml.load(fp)
     filename_without_extension = splitext(basename(args.bundle_config))[0]
     bundle_config.setdefault('name', filename_without_extension)
+    if args.daemon_socket is not None:
+        # imported here since the daemon runs feagen_run_with_configs
+        from .daemon import send_job
+        send_job(args.daemon_socket, {
+            'global_config': global_config,
+            'cwd': os.getcwd(),
+            'bundle_config': bundle_config,
+            'dag_output_path': args.dag_output_path,
+            'no_bundle': args.no_bundle,
+            'n_jobs': args.jobs,
+            'backend': args.backend,
+            'incremental': args.incremental,
+            'link': args.link,
+            'profile_path': args.profile,
+            'explain': args.explain,
+        })
+        return
     feagen_run_with_configs(global_config, bundle_config, args.dag_output_path,
-                            args.no_bundle)
+                            args.no_bundle, args.jobs, args.backend,
+                            args.incremental, args.link, args.profile,
+                            args.explain)
@@ -0,0 +1,59 @@
+import sys
+import argparse
+from fnmatch import fnmatch
+from datetime import datetime
+
+import yaml
+
+from ..catalog import DataCatalog
+
+
+def _format_record(record):
+    shape = record['shape']
+    created_at = record['created_at']
+    duration = record['duration']
+    return [
+        record['key'],
+        record['handler'],
+        "" if shape is None else "x".join(str(dim) for dim in shape),
+        "" if record['dtype'] is None else record['dtype'],
+        "" if record['nbytes'] is None else str(record['nbytes']),
+        ("" if created_at is None
+         else datetime.fromtimestamp(created_at).strftime("%Y-%m-%d %H:%M:%S")),
+        "" if duration is None else "{:.3f}".format(duration),
+    ]
+
+
+def feagen_ls(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="List the generated data recorded in the catalog.")
+    parser.add_argument('keys', nargs='*',
+                        help="the key patterns (shell-style wildcards) to "
+                             "list (default: all the keys)")
+    parser.add_argument('-g', '--global-config',
+                        default=".feagenrc/config.yml",
+                        help="the path of the path configuration YAML file "
+                             "(default: .feagenrc/config.yml)")
+    parser.add_argument('--handler',
+                        help="only list the data of this handler")
+    args = parser.parse_args(argv)
+    with open(args.global_config) as fp:
+        global_config = yaml.load(fp)
+    catalog_path = global_config['generator_kwargs'].get('catalog_path')
+    if catalog_path is None:
+        raise ValueError("catalog_path is not set in generator_kwargs of {}."
+                         .format(args.global_config))
+    catalog = DataCatalog(catalog_path)
+    rows = [["key", "handler", "shape", "dtype", "bytes", "created_at",
+             "duration"]]
+    for record in catalog.iter_records(args.handler):
+        if (len(args.keys) > 0
+                and not any(fnmatch(record['key'], pattern)
+                            for pattern in args.keys)):
+            continue
+        rows.append(_format_record(record))
+    catalog.close()
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(val.ljust(width)
+                        for val, width in zip(row, widths)).rstrip())
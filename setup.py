@@ -26,7 +26,7 @@ else:
         'pyyaml',
         'tables',
         'pandas',
-        'h5sparse>=0.0.4',
+        'h5sparse>=0.0.5',
     ]
     tests_require = []
 
@@ -59,6 +59,8 @@ setup(
             'feagen = feagen.tools:feagen_run',
             'feagen-init = feagen.tools:init_config',
             'feagen-draw-dag = feagen.tools:draw_dag',
+            'feagen-ls = feagen.tools:feagen_ls',
+            'feagen-daemon = feagen.tools:feagen_daemon',
         ],
     },
     classifiers=[